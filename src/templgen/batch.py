@@ -0,0 +1,170 @@
+"""
+Run many commands in one process
+"""
+import json
+import os
+from typing import Iterator
+from typing import Union
+
+from templgen.user_manager import UserManager
+
+# Type aliases
+ErrorMsg = str
+StringOrNone = Union[str, None]
+
+
+class BatchRunner:
+    """
+    Methods of this class do not raise exceptions, instead they return a tuple
+    (result, error); 'result' may be of any type and 'error' is
+    an empty string if success or error message otherwise.
+
+    Commands are JSON objects, one per line, e.g.
+        {"id": 1, "cmd": "adduser", "user_name": "john", "config": {"email": "j@example.com"}}
+        {"id": 2, "cmd": "swuser", "user_name": "john"}
+        {"id": 3, "cmd": "set", "values": {"text_editor": "vim"}}
+        {"id": 4, "cmd": "get", "names": ["current_user", "text_editor"]}
+        {"id": 5, "cmd": "generate", "template": "service", "target": "out", "variables": {"name": "app"}}
+    Each command results in a JSON object
+        {"id": ..., "ok": true/false, "result": ..., "error": "..."}
+    where "id" is copied from the command if present.
+    Relative paths and commands with "local": true refer to "project_path",
+    which defaults to the working dir of the batch.
+    Commands never ask questions: users get default config values unless
+    given in "config", deleting users needs no confirmation.
+    """
+    COMMANDS = ("adduser", "deluser", "swuser", "list_users", "get", "set", "generate")
+
+    def __init__(self, *, templgen, cwd: StringOrNone = None, **kwargs):
+        """
+        :param templgen: Templgen instance shared by all commands
+        :param cwd: dir relative paths are resolved against, current working dir by default
+        """
+        super().__init__(**kwargs)
+        self._templgen = templgen
+        self.cwd = cwd or os.getcwd()
+
+    def run(self, lines, stop_on_error=False) -> Iterator[dict]:
+        """
+        Execute JSONL commands lazily, one result per non-empty line.
+        :param lines: iterable of JSON strings, e.g. a text stream
+        :param stop_on_error: if True, nothing is executed after the first failed command
+        """
+        for line in lines:
+            if not line.strip():
+                continue
+            try:
+                command = json.loads(line)
+            except ValueError as e:
+                command, error = {}, f"invalid JSON: {e}"
+            else:
+                error = "" if isinstance(command, dict) else "command must be a JSON object"
+            result = None
+            if not error:
+                result, error = self.execute(command)
+            output = {"ok": not error, "result": result, "error": error}
+            if isinstance(command, dict) and "id" in command:
+                output = {"id": command["id"], **output}
+            yield output
+            if error and stop_on_error:
+                return
+
+    def execute(self, command: dict) -> (object, ErrorMsg):
+        """
+        Execute a single command, see class description for the format.
+        :return: (JSON serializable result, "") or (None, error message)
+        """
+        name = command.get("cmd", "")
+        if name not in BatchRunner.COMMANDS:
+            return None, f"unknown command '{name}', expected one of: {', '.join(BatchRunner.COMMANDS)}"
+        try:
+            return getattr(self, f"_{name}")(command)
+        except (TypeError, ValueError, AttributeError) as e:
+            return None, f"invalid arguments of '{name}': {e}"
+
+    def _path(self, command: dict, key: str) -> str:
+        return os.path.join(self.cwd, os.path.expanduser(command.get(key) or ""))
+
+    def _scope(self, command: dict) -> StringOrNone:
+        """
+        Project path for local commands, None for global ones
+        """
+        return self._path(command, "project_path") if command.get("local") else None
+
+    def _adduser(self, command: dict) -> (None, ErrorMsg):
+        project_path = self._scope(command)
+        user = {**command.get("config", {}), UserManager.USER_NAME_FIELD: command.get("user_name", "")}
+        return self._templgen.user_manager.add_users([user], local=project_path is not None,
+                                                     project_path=project_path)
+
+    def _deluser(self, command: dict) -> (None, ErrorMsg):
+        project_path = self._scope(command)
+        return self._templgen.user_manager.del_users([command.get("user_name", "")],
+                                                     local=project_path is not None,
+                                                     project_path=project_path, confirmed=True)
+
+    def _swuser(self, command: dict) -> (None, ErrorMsg):
+        project_path = self._scope(command)
+        if project_path and not self._templgen.settings.has_local_settings(project_path):
+            return None, f"local config for '{project_path}' does not exist"
+        return self._templgen.user_manager.switch_user(command.get("user_name", ""), project_path=project_path)
+
+    def _list_users(self, command: dict) -> (dict, ErrorMsg):
+        project_path = self._path(command, "project_path")
+        settings = self._templgen.settings
+        _, error = settings.read_settings_for_path(project_path)
+        if error:
+            return None, error
+        current_user, _ = settings.get("current_user")
+        return {"global": UserManager.list_users(self._templgen.home_dir),
+                "local": UserManager.list_users(project_path),
+                "current": current_user}, ""
+
+    def _get(self, command: dict) -> (dict, ErrorMsg):
+        settings = self._templgen.settings
+        _, error = settings.read_settings_for_path(self._path(command, "project_path"))
+        if error:
+            return None, error
+        section = command.get("section", "GENERAL")
+        names = command.get("names")
+        if names is None:
+            return settings.get_section(section)
+        result = {}
+        for name in names:
+            result[name], error = settings.get(name, section)
+            if error:
+                return None, f"setting '{name}': {error}"
+        return result, ""
+
+    def _set(self, command: dict) -> (None, ErrorMsg):
+        settings = self._templgen.settings
+        project_path = self._scope(command)
+        if project_path and not settings.has_local_settings(project_path):
+            return None, f"local config for '{project_path}' does not exist"
+        _, error = settings.read_settings_for_path(project_path)
+        if error:
+            return None, error
+        section = command.get("section", "GENERAL")
+        for name, value in command.get("values", {}).items():
+            settings.set(name, str(value), section, save=False)
+        return settings.save_config()
+
+    def _generate(self, command: dict) -> (dict, ErrorMsg):
+        generator = self._templgen.generator
+        template_path, error = generator.resolve_template(os.path.expanduser(command.get("template") or ""),
+                                                          cwd=self.cwd)
+        if error:
+            return None, error
+        target = self._path(command, "target")
+        variables = {name: str(value) for name, value in command.get("variables", {}).items()}
+        if command.get("dry_run"):
+            return generator.diff(template_path, target, variables)
+        _, error = generator.generate(template_path, target, variables)
+        if error:
+            return None, error
+        result = {"target": target, "hooks": {}}
+        if command.get("hooks", True):
+            result["hooks"], error = self._templgen.hooks.run_template_hooks(template_path, target, variables)
+            if error:
+                return result, error
+        return result, ""
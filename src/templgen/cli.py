@@ -16,12 +16,20 @@ Why does this file exist, and why not put this in __main__?
 """
 # import click
 
+import json
+import os
+import sys
+
 import click.decorators
-# from templgen.settings import Settings
 # from templgen.template_processor import TemplateProcessor
 from iotanbo_py_utils import file_utils
 
+from templgen.batch import BatchRunner
+from templgen.durability import Durability
+from templgen.settings import Settings
 from templgen.templgen import Templgen
+from templgen.user_manager import UserManager
+from templgen.watcher import Watcher
 
 
 @click.group()
@@ -34,12 +42,22 @@ def main():
     pass
 
 
+def _ensure_integrity(tg: Templgen, file=None) -> None:
+    """
+    Exit if templgen dir can't be created or checked
+    """
+    _, error = tg.ensure_integrity()
+    if error:
+        print(f"Error: {error}", file=file)
+        exit(-1)
+
+
 """
 @main.command()
 @click.argument('names', nargs=-1)
 def get(names):
-    tg = Templgen()
-    tg.ensure_integrity()
+    tg = Templgen(log=print)
+    _ensure_integrity(tg)
     current_dir = file_utils.get_cwd()
     tg.settings.read_settings_for_path(current_dir)
     for name in names:
@@ -52,8 +70,8 @@ def initlocal():
     """
     Create local config in current working dir
     """
-    tg = Templgen()
-    tg.ensure_integrity()
+    tg = Templgen(log=print)
+    _ensure_integrity(tg)
     current_dir = file_utils.get_cwd()
     result, error = tg.settings.initlocal(current_dir)
     if not error:
@@ -68,8 +86,13 @@ def initlocal():
               help="Create user locally for project in current working dir")
 @click.option("-d", "--default", is_flag=True,
               help="Create default user config (no interactive questions)")
-def adduser(user_name, local, default):
+@click.option("--from-file", "users_file", default="",
+              help="Add all users from CSV (with header) or JSONL file at once")
+def adduser(user_name, local, default, users_file):
     """Add new user globally (or locally if --local specified)"""
+    if users_file:
+        _bulk_users(users_file, local, add=True)
+        return
     if not user_name:
         print(f"Error: user name not specified")
         exit(-1)
@@ -77,8 +100,8 @@ def adduser(user_name, local, default):
     if default:
         print("default user config selected")
         interactive = False
-    tg = Templgen()
-    tg.ensure_integrity()
+    tg = Templgen(log=print)
+    _ensure_integrity(tg)
     current_dir = file_utils.get_cwd()
     if local:
         _, error = tg.user_manager.add_user(user_name, local=True,
@@ -100,8 +123,13 @@ def adduser(user_name, local, default):
               help="Delete user locally for project in current working dir'")
 @click.option("--confirmed", is_flag=True,
               help="No additional confirmation to be performed'")
-def deluser(user_name, local, confirmed):
+@click.option("--from-file", "users_file", default="",
+              help="Delete all users listed in CSV (with header) or JSONL file at once")
+def deluser(user_name, local, confirmed, users_file):
     """Delete user globally (or locally if --local specified)"""
+    if users_file:
+        _bulk_users(users_file, local, add=False, confirmed=confirmed)
+        return
     if not user_name:
         print(f"Error: user name not specified")
         exit(-1)
@@ -109,8 +137,8 @@ def deluser(user_name, local, confirmed):
         confirmed = True
     else:
         confirmed = False
-    tg = Templgen()
-    tg.ensure_integrity()
+    tg = Templgen(log=print)
+    _ensure_integrity(tg)
     current_dir = file_utils.get_cwd()
 
     if local:
@@ -130,9 +158,55 @@ def deluser(user_name, local, confirmed):
         print(f"Successfully deleted user '{user_name}'")
 
 
+def _bulk_users(users_file, local, add, confirmed=False):
+    users, error = UserManager.read_users_file(users_file)
+    if error:
+        print(f"Error: {error}")
+        exit(0)
+    tg = Templgen(log=print)
+    _ensure_integrity(tg)
+    project_path = file_utils.get_cwd() if local else None
+    if add:
+        _, error = tg.user_manager.add_users(users, local=local, project_path=project_path)
+    else:
+        user_names = [user.get(UserManager.USER_NAME_FIELD, "") for user in users]
+        _, error = tg.user_manager.del_users(user_names, local=local, project_path=project_path,
+                                             confirmed=confirmed)
+    if error:
+        if error == "canceled":
+            print("Operation canceled")
+        else:
+            print(f"Error: {error}")
+        exit(0)
+    print(f"Successfully {'added' if add else 'deleted'} {len(users)} users")
+
+
+@main.command()
+@click.argument("users_file", default="")
+@click.option("--local", is_flag=True,
+              help="Export local users of project in current working dir")
+def export_users(users_file, local):
+    """
+    Export users with their configs into CSV or JSONL (if extension is '.jsonl') file
+    """
+    if not users_file:
+        print("Error: file not specified. Example: 'templgen export-users users.csv [--local]'")
+        exit(0)
+    tg = Templgen(log=print)
+    _ensure_integrity(tg)
+    project_path = file_utils.get_cwd() if local else None
+    users, error = tg.user_manager.export_users(project_path)
+    if not error:
+        _, error = UserManager.write_users_file(users_file, users)
+    if error:
+        print(f"Error: {error}")
+        exit(0)
+    print(f"Successfully exported {len(users)} users to '{users_file}'")
+
+
 def _list_users():
-    tg = Templgen()
-    tg.ensure_integrity()
+    tg = Templgen(log=print)
+    _ensure_integrity(tg)
     current_dir = file_utils.get_cwd()
     global_user_list = tg.user_manager.list_users(project_path=None)
     local_user_list = tg.user_manager.list_users(project_path=current_dir)
@@ -184,8 +258,8 @@ def swuser(user_name, local):
     if not user_name:
         print("Error: user name not specified. Example: 'templgen swuser your_name [--local]'")
         exit(0)
-    tg = Templgen()
-    tg.ensure_integrity()
+    tg = Templgen(log=print)
+    _ensure_integrity(tg)
     project_path = None
     if local:
         project_path = file_utils.get_cwd()
@@ -210,8 +284,8 @@ def edit_user(user_name, local):
     if not user_name:
         print("Error: user name not specified. Example: 'templgen edit-user some_user [--local]'")
         exit(0)
-    tg = Templgen()
-    tg.ensure_integrity()
+    tg = Templgen(log=print)
+    _ensure_integrity(tg)
     project_path = None
     if local:
         project_path = file_utils.get_cwd()
@@ -227,8 +301,8 @@ def edit_config(local):
     """
     Edit global configuration (or local if --local specified)
     """
-    tg = Templgen()
-    tg.ensure_integrity()
+    tg = Templgen(log=print)
+    _ensure_integrity(tg)
     project_path = None
     if local:
         project_path = file_utils.get_cwd()
@@ -238,3 +312,321 @@ def edit_config(local):
     _, error = tg.settings.edit_config(project_path=project_path)
     if error:
         print(f"Error: {error}")
+
+
+def _parse_assignments(assignments) -> (dict, str):
+    result = {}
+    for assignment in assignments:
+        name, sep, value = assignment.partition("=")
+        if not sep or not name.strip():
+            return {}, f"invalid variable assignment '{assignment}', expected 'name=value'"
+        result[name.strip()] = value
+    return result, ""
+
+
+@main.command()
+@click.argument("template", default="")
+@click.argument("target", default="")
+@click.option("-s", "--set", "assignments", multiple=True,
+              help="Set template variable, e.g. '-s use_docker=yes'")
+@click.option("--dry-run", is_flag=True,
+              help="Only list files that would be added (A) or modified (M)")
+@click.option("--diff", "show_diff", is_flag=True,
+              help="Only show unified diff against existing TARGET")
+@click.option("--no-hooks", is_flag=True, help="Do not run post-generation hooks of the template")
+@click.option("-j", "--jobs", type=int, default=None,
+              help="Number of hooks run at the same time, number of CPUs by default")
+@click.option("--durability", type=click.Choice(Durability.MODES), default=Durability.BATCH, show_default=True,
+              help="'none': buffered writes only, 'batch': sync once after all files are written, "
+                   "'strict': fsync and atomically replace each file")
+def generate(template, target, assignments, dry_run, show_diff, no_hooks, jobs, durability):
+    """
+    Instantiate template into TARGET dir (current working dir by default)
+    """
+    tg = Templgen(log=print, durability=durability)
+    _ensure_integrity(tg)
+    template_path, error = tg.generator.resolve_template(template)
+    if error:
+        print(f"Error: {error}")
+        exit(0)
+    variables, error = _parse_assignments(assignments)
+    if error:
+        print(f"Error: {error}")
+        exit(0)
+    if not target:
+        target = file_utils.get_cwd()
+    if dry_run or show_diff:
+        result, error = tg.generator.diff(template_path, target, variables,
+                                          out=click.get_text_stream("stdout"), show_diff=show_diff)
+        if error:
+            print(f"Error: {error}")
+            exit(0)
+        if dry_run:
+            print(f"{len(result['added'])} to add, {len(result['modified'])} to modify, "
+                  f"{result['unchanged']} unchanged")
+        return
+    _, error = tg.generator.generate(template_path, target, variables)
+    if error:
+        print(f"Error: {error}")
+        exit(0)
+    print(f"Successfully generated '{template}' into '{target}'")
+    if no_hooks:
+        return
+    tg.hooks.max_jobs = jobs
+    results, error = tg.hooks.run_template_hooks(template_path, target, variables)
+    for name, result in results.items():
+        if result["returncode"] is None:
+            print(f"Hook '{name}' {result['output']}")
+            continue
+        print(f"Hook '{name}' exited with code {result['returncode']} in {result['seconds']:.1f}s")
+        if result["output"]:
+            print(result["output"].rstrip("\n"))
+    if error:
+        print(f"Error: {error}")
+        exit(0)
+
+
+@main.command()
+@click.argument("template", default="")
+@click.argument("target", default="")
+@click.option("-s", "--set", "assignments", multiple=True,
+              help="Set template variable, e.g. '-s use_docker=yes'")
+@click.option("--poll", is_flag=True,
+              help="Poll for changes instead of using inotify")
+def watch(template, target, assignments, poll):
+    """
+    Regenerate files in already generated TARGET dir (current working dir by default)
+    whenever template, settings or user configs change
+    """
+    tg = Templgen(log=print)
+    _ensure_integrity(tg)
+    tg.generator.keep_compiled = True
+    template_path, error = tg.generator.resolve_template(template)
+    if error:
+        print(f"Error: {error}")
+        exit(0)
+    variables, error = _parse_assignments(assignments)
+    if error:
+        print(f"Error: {error}")
+        exit(0)
+    if not target:
+        target = file_utils.get_cwd()
+    layers, error = tg.generator.get_layers(template_path)
+    if error:
+        print(f"Error: {error}")
+        exit(0)
+    watched = layers + [tg.settings.global_config_file,
+                        os.path.join(tg.settings.global_templgen_dir, Settings.TEMPLGEN_USERS_DIR_NAME)]
+    if tg.settings.has_local_settings(target):
+        watched.append(os.path.join(target, Settings.TEMPLGEN_DIR_NAME))
+    # Later changes of variables rewrite only affected outputs
+    _, error = tg.generator.remember(template_path, target, variables)
+    if error:
+        print(f"Error: {error}")
+        exit(0)
+    watcher = Watcher(watched, use_inotify=not poll)
+    print(f"Watching '{template}' for changes ({'inotify' if watcher.uses_inotify else 'polling'}), "
+          f"press Ctrl+C to stop")
+    try:
+        while True:
+            changed = watcher.wait()
+            written, error = tg.generator.regenerate(template_path, target, changed, variables)
+            if error:
+                print(f"Error: {error}")
+                continue
+            for dst_rel_path in written:
+                print(f"Regenerated '{dst_rel_path}'")
+    except KeyboardInterrupt:
+        pass
+    finally:
+        watcher.close()
+
+
+@main.command()
+@click.argument("template", default="")
+@click.option("--update", is_flag=True,
+              help="Store current fingerprints after checking")
+@click.option("--full", is_flag=True,
+              help="Hash all files, even if their size and modification time did not change")
+def verify(template, update, full):
+    """
+    Check installed templates (or only TEMPLATE), settings and user configs against stored content hashes
+    """
+    tg = Templgen(log=print)
+    _ensure_integrity(tg)
+    report, error = tg.fingerprints.verify(template or None, update=update, full=full)
+    if error:
+        print(f"Error: {error}")
+        exit(-1)
+    for kind, mark in (("modified", "M"), ("added", "A"), ("missing", "D")):
+        for path in report[kind]:
+            print(f"{mark} {path}")
+    changed = len(report["modified"]) + len(report["added"]) + len(report["missing"])
+    print(f"{report['unchanged']} unchanged, {changed} changed")
+    if update:
+        print("Fingerprints updated")
+    elif changed:
+        exit(1)
+
+
+@main.command()
+@click.argument("source", default="")
+@click.argument("template", default="")
+@click.option("-r", "--replace", "assignments", multiple=True,
+              help="Replace literal value with variable, e.g. '-r class_name=MyClass'")
+@click.option("-j", "--jobs", type=int, default=1,
+              help="Number of worker processes, 0 for number of CPUs")
+@click.option("-v", "--verbose", is_flag=True, help="Show number of substitutions in each file")
+def templatize(source, template, assignments, jobs, verbose):
+    """
+    Create TEMPLATE dir from SOURCE dir
+    """
+    if not source or not template:
+        print("Error: source or template not specified. Example: 'templgen templatize src_dir templ_dir -r name=value'")
+        exit(0)
+    variables, error = _parse_assignments(assignments)
+    if error:
+        print(f"Error: {error}")
+        exit(0)
+    tg = Templgen(log=print)
+    _ensure_integrity(tg)
+    replacements = {value: name for name, value in variables.items()}
+
+    def on_file(rel_path, count):
+        if count:
+            print(f"{count:6} {rel_path}")
+
+    result, error = tg.templatizer.templatize(source, template, replacements, processes=jobs or None,
+                                              on_file=on_file if verbose else None)
+    if error:
+        print(f"Error: {error}")
+        exit(0)
+    print(f"Successfully created template '{template}': {result['files']} files, "
+          f"{result['substitutions']} substitutions")
+
+
+@main.command()
+@click.argument("name", default="")
+@click.argument("repo", default="")
+@click.option("--ref", default="HEAD", help="Branch, tag or commit, 'HEAD' by default")
+@click.option("--path", default="", help="Template directory inside the repository, root by default")
+def add_source(name, repo, ref, path):
+    """
+    Register template NAME stored in local git repository REPO (path or 'file://' URL)
+    """
+    if not name or not repo:
+        print("Error: name or repository not specified. Example: 'templgen add-source service ~/repo --ref v1'")
+        exit(0)
+    tg = Templgen(log=print)
+    _ensure_integrity(tg)
+    _, error = tg.template_sources.add_source(name, repo, ref=ref, path=path)
+    if error:
+        print(f"Error: {error}")
+        exit(0)
+    print(f"Successfully added template source '{name}'")
+
+
+@main.command()
+@click.argument("name", default="")
+def del_source(name):
+    """
+    Unregister template source
+    """
+    if not name:
+        print("Error: name not specified. Example: 'templgen del-source service'")
+        exit(0)
+    tg = Templgen(log=print)
+    _ensure_integrity(tg)
+    _, error = tg.template_sources.del_source(name)
+    if error:
+        print(f"Error: {error}")
+        exit(0)
+    print(f"Successfully deleted template source '{name}'")
+
+
+@main.command()
+def list_sources():
+    """
+    List registered template sources
+    """
+    tg = Templgen(log=print)
+    _ensure_integrity(tg)
+    sources, error = tg.template_sources.list_sources()
+    if error:
+        print(f"Error: {error}")
+        exit(0)
+    if not sources:
+        print("No template sources found")
+    for name, source in sources.items():
+        print(f"{name}: {source['repo']} {source['ref']} {source['path']}")
+
+
+@main.command()
+@click.argument("template", default="")
+@click.option("--lzma", "use_lzma", is_flag=True,
+              help="Use lzma instead of zlib (smaller, slower)")
+@click.option("--decompress", is_flag=True,
+              help="Store template files uncompressed")
+def compress(template, use_lzma, decompress):
+    """
+    Store files of installed TEMPLATE compressed
+    """
+    tg = Templgen(log=print)
+    _ensure_integrity(tg)
+    template_path, error = tg.generator.resolve_template(template)
+    if error:
+        print(f"Error: {error}")
+        exit(0)
+    method = None if decompress else ("lzma" if use_lzma else "zlib")
+    result, error = tg.generator.compress_template(template_path, method)
+    if error:
+        print(f"Error: {error}")
+        exit(0)
+    tg.generator.clear_cache()
+    print(f"Successfully processed {result['files']} files of '{template}': "
+          f"{result['size_before']} -> {result['size_after']} bytes")
+
+
+@main.command()
+@click.option("--local", is_flag=True,
+              help="Check local config of project in current working dir")
+@click.option("--repair", is_flag=True,
+              help="Fix problems that can be fixed")
+def doctor(local, repair):
+    """
+    Check global (or local if --local specified) templgen dir, user configs and templates
+    """
+    tg = Templgen(log=print)
+    path = file_utils.get_cwd() if local else None
+    problems, error = tg.integrity.validate(path, repair=repair)
+    if error:
+        print(f"Error: {error}")
+        exit(-1)
+    for problem, repaired in problems:
+        print(f"{'Repaired' if repaired else 'Problem'}: {problem}")
+    unrepaired = sum(1 for _, repaired in problems if not repaired)
+    if not problems:
+        print("No problems found")
+    elif unrepaired:
+        if not repair:
+            print("Run 'templgen doctor --repair' to fix problems that can be fixed")
+        exit(1)
+
+
+@main.command()
+@click.option("--stop-on-error", is_flag=True, help="Do not execute commands after the first failed one")
+@click.option("--durability", type=click.Choice(Durability.MODES), default=Durability.BATCH, show_default=True,
+              help="Durability of generated files and configs, see 'templgen generate --help'")
+def batch(stop_on_error, durability):
+    """
+    Execute JSONL commands from stdin in one process, write JSONL results to stdout.
+    Commands: adduser, deluser, swuser, list_users, get, set, generate, e.g.
+    '{"id": 1, "cmd": "adduser", "user_name": "john"}'
+    """
+    # Messages must not break JSON output
+    tg = Templgen(log=lambda message: print(message, file=sys.stderr), durability=durability)
+    _ensure_integrity(tg, file=sys.stderr)
+    runner = BatchRunner(templgen=tg)
+    for result in runner.run(sys.stdin, stop_on_error=stop_on_error):
+        sys.stdout.write(json.dumps(result) + "\n")
+        sys.stdout.flush()
@@ -0,0 +1,169 @@
+"""
+Durability of written files
+"""
+import ctypes
+import os
+from typing import Union
+
+# Type aliases
+ErrorMsg = str
+StringOrNone = Union[str, None]
+
+
+class Durability:
+    """
+    Modes of making written files durable:
+      - "none": buffered writes only, data reaches the disk whenever the OS decides;
+      - "batch": buffered writes, the file system is synced once after all files
+        are written ('syncfs' on Linux, 'sync' elsewhere); where neither is available
+        (Windows), each file is fsync'ed when written instead;
+      - "strict": each file is written into a temporary file, fsync'ed and renamed
+        over the destination, so after a crash it is either the old or the complete
+        new version; directories are fsync'ed once at the end.
+    Directories are fsync'ed only where they can be opened (POSIX systems).
+    Methods raise OSError unless stated otherwise.
+    """
+    NONE = "none"
+    BATCH = "batch"
+    STRICT = "strict"
+    MODES = (NONE, BATCH, STRICT)
+    WRITE_BUFFER_SIZE = 1024 * 1024
+    TMP_SUFFIX = ".templgen-tmp"
+    # Directories can't be opened for fsync on Windows
+    SYNC_DIRS = os.name == "posix"
+    # Files have no executable bits on Windows
+    SET_EXEC_BITS = hasattr(os, "fchmod")
+    # 'syncfs' function of libc or None, see _get_syncfs()
+    _syncfs = None
+    _syncfs_loaded = False
+
+    @staticmethod
+    def check_mode(mode: str) -> ErrorMsg:
+        if mode not in Durability.MODES:
+            return f"unknown durability mode '{mode}', expected one of: {', '.join(Durability.MODES)}"
+        return ""
+
+    @staticmethod
+    def write_file(path: str, data: bytes, mode: str, dir_fd: Union[int, None] = None, exec_bits: int = 0) -> None:
+        """
+        Write file contents according to durability mode.
+        :param path: file path, relative to `dir_fd` if set
+        :param dir_fd: descriptor of the directory `path` is relative to
+        :param exec_bits: executable bits (mask of 0o111) to set on the file,
+                          each is set only if the matching read bit is set
+        """
+        if mode != Durability.STRICT:
+            # Without a way to sync the file system, batch mode syncs every file
+            Durability._write(path, data, dir_fd,
+                              fsync=mode == Durability.BATCH and not Durability.can_sync_filesystem(),
+                              exec_bits=exec_bits)
+            return
+        tmp_path = path + Durability.TMP_SUFFIX
+        try:
+            Durability._write(tmp_path, data, dir_fd, fsync=True, exec_bits=exec_bits)
+            os.replace(tmp_path, path, src_dir_fd=dir_fd, dst_dir_fd=dir_fd)
+        except BaseException:
+            try:
+                os.unlink(tmp_path, dir_fd=dir_fd)
+            except OSError:
+                pass
+            raise
+
+    @staticmethod
+    def _write(path: str, data: bytes, dir_fd: Union[int, None], fsync: bool, exec_bits: int = 0) -> None:
+        def opener(name, flags):
+            return os.open(name, flags, 0o666, dir_fd=dir_fd)
+
+        with open(path, "wb", buffering=Durability.WRITE_BUFFER_SIZE, opener=opener) as f:
+            if exec_bits and Durability.SET_EXEC_BITS:
+                # Like 'chmod +x' under the umask applied to read bits; an existing file keeps its mode otherwise
+                file_mode = os.fstat(f.fileno()).st_mode & 0o7777
+                new_mode = file_mode | (file_mode & 0o444) >> 2 & exec_bits
+                if new_mode != file_mode:
+                    os.fchmod(f.fileno(), new_mode)
+            f.write(data)
+            if fsync:
+                f.flush()
+                os.fsync(f.fileno())
+
+    @staticmethod
+    def finish(mode: str, root: str, dir_paths=()) -> None:
+        """
+        Make files written with write_file() durable.
+        :param root: any path on the file system the files were written to
+        :param dir_paths: directories whose entries were added or replaced
+        """
+        if mode == Durability.BATCH:
+            if Durability.can_sync_filesystem():
+                Durability.sync_filesystem(root)
+        elif mode == Durability.STRICT:
+            for dir_path in dir_paths:
+                Durability.sync_dir(dir_path)
+
+    @staticmethod
+    def write_config(path: str, text: str, mode: str) -> None:
+        """
+        Write a single config file: it is durable on return unless mode is "none"
+        """
+        data = text.encode("utf-8")
+        if mode == Durability.STRICT:
+            Durability.write_file(path, data, mode)
+        else:
+            # One file only, syncing it is cheaper than syncing the file system
+            Durability._write(path, data, None, fsync=mode == Durability.BATCH)
+        if mode != Durability.NONE:
+            Durability.sync_dir(os.path.dirname(os.path.abspath(path)))
+
+    @staticmethod
+    def sync_dir(dir_path: str) -> None:
+        """
+        Make entries of the directory durable; does nothing where directories can't be fsync'ed
+        """
+        if not Durability.SYNC_DIRS:
+            return
+        fd = os.open(dir_path, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    @staticmethod
+    def can_sync_filesystem() -> bool:
+        return Durability._get_syncfs() is not None or hasattr(os, "sync")
+
+    @staticmethod
+    def sync_filesystem(path: str) -> None:
+        """
+        Flush all dirty data of the file system that contains `path`;
+        does nothing if can_sync_filesystem() is False
+        """
+        syncfs = Durability._get_syncfs()
+        if syncfs is None:
+            if hasattr(os, "sync"):
+                os.sync()
+            return
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            if syncfs(fd) != 0:
+                errno = ctypes.get_errno()
+                raise OSError(errno, os.strerror(errno))
+        finally:
+            os.close(fd)
+
+    @staticmethod
+    def _get_syncfs():
+        if not Durability._syncfs_loaded:
+            Durability._syncfs = Durability._load_syncfs()
+            Durability._syncfs_loaded = True
+        return Durability._syncfs
+
+    @staticmethod
+    def _load_syncfs():
+        """
+        :return: 'syncfs' function of libc or None if not available
+        """
+        try:
+            return ctypes.CDLL(None, use_errno=True).syncfs
+        except (OSError, AttributeError, TypeError):
+            # No 'syncfs' outside of Linux; on Windows CDLL(None) raises TypeError
+            return None
@@ -0,0 +1,139 @@
+"""
+Placeholder filters, e.g. '{{ project_name | snake }}'
+"""
+import re
+import sys
+from typing import Union
+
+# Type aliases
+ErrorMsg = str
+StringOrNone = Union[str, None]
+
+
+class Filters:
+    """
+    A placeholder may pass the variable value through a chain of filters:
+    '{{ name | snake | upper }}'. Filters:
+      - upper, lower, title;
+      - snake (snake_case), kebab (kebab_case), camel (camelCase),
+        pascal (PascalCase), constant (UPPER_SNAKE_CASE); words are split
+        on non-alphanumeric characters, case changes and digits,
+        e.g. 'MyHTTPServer 2' -> ['My', 'HTTP', 'Server', '2'];
+      - year: year of an ISO date value, e.g. '{{ today | year }}'.
+    A placeholder is identified by its key: the variable name for a plain
+    placeholder, 'name|filter|...' for a filtered one. Filtered values are
+    looked up by key like plain ones; FilteredVariables computes each of them
+    on first use, so a chain is applied once per run whatever the number of files.
+    Placeholders with unknown filters are left as is, like unknown variables.
+    """
+    PLACEHOLDER_RE = re.compile(r"{{\s*(\w+)((?:\s*\|\s*\w+)*)\s*}}")
+    WORD_RE = re.compile(r"[A-Z]?[a-z]+|[A-Z]+(?![a-z])|\d+")
+    KEY_SEPARATOR = "|"
+
+    @staticmethod
+    def placeholder_key(match) -> str:
+        """
+        Interned key of a placeholder matched by PLACEHOLDER_RE
+        """
+        if not match.group(2):
+            return sys.intern(match.group(1))
+        chain = [name.strip() for name in match.group(2).split(Filters.KEY_SEPARATOR)[1:]]
+        return sys.intern(Filters.KEY_SEPARATOR.join([match.group(1)] + chain))
+
+    @staticmethod
+    def lookup(variables: dict, key: str) -> StringOrNone:
+        """
+        Value of a placeholder.
+        :return: value or None if the variable or one of the filters is unknown
+        """
+        value = variables.get(key)
+        if value is not None or Filters.KEY_SEPARATOR not in key:
+            return value
+        if isinstance(variables, FilteredVariables):
+            # Computed and stored by FilteredVariables.__missing__()
+            try:
+                return variables[key]
+            except KeyError:
+                return None
+        return Filters.apply(variables, key)
+
+    @staticmethod
+    def apply(variables: dict, key: str) -> StringOrNone:
+        """
+        Compute value of a filtered placeholder 'name|filter|...' without caching.
+        :return: value or None if the variable or one of the filters is unknown
+        """
+        name, *chain = key.split(Filters.KEY_SEPARATOR)
+        value = variables.get(name)
+        if value is None:
+            return None
+        value = str(value)
+        for filter_name in chain:
+            function = FILTERS.get(filter_name)
+            if function is None:
+                return None
+            value = function(value)
+        return value
+
+    @staticmethod
+    def words(value: str) -> list:
+        return Filters.WORD_RE.findall(value)
+
+    @staticmethod
+    def snake(value: str) -> str:
+        return "_".join(word.lower() for word in Filters.words(value))
+
+    @staticmethod
+    def kebab(value: str) -> str:
+        return "-".join(word.lower() for word in Filters.words(value))
+
+    @staticmethod
+    def constant(value: str) -> str:
+        return "_".join(word.upper() for word in Filters.words(value))
+
+    @staticmethod
+    def pascal(value: str) -> str:
+        return "".join(word.capitalize() for word in Filters.words(value))
+
+    @staticmethod
+    def camel(value: str) -> str:
+        words = Filters.words(value)
+        if not words:
+            return ""
+        return words[0].lower() + "".join(word.capitalize() for word in words[1:])
+
+    @staticmethod
+    def year(value: str) -> str:
+        return value.strip()[:4]
+
+
+FILTERS = {
+    "upper": str.upper,
+    "lower": str.lower,
+    "title": str.title,
+    "snake": Filters.snake,
+    "snake_case": Filters.snake,
+    "kebab": Filters.kebab,
+    "kebab_case": Filters.kebab,
+    "camel": Filters.camel,
+    "camelCase": Filters.camel,
+    "pascal": Filters.pascal,
+    "PascalCase": Filters.pascal,
+    "constant": Filters.constant,
+    "year": Filters.year,
+}
+
+
+class FilteredVariables(dict):
+    """
+    Variables of one run; values of filtered placeholders are computed on first
+    access by key and kept, e.g. variables["name|snake"].
+    """
+    __slots__ = ()
+
+    def __missing__(self, key: str):
+        value = Filters.apply(self, key) if Filters.KEY_SEPARATOR in key else None
+        if value is None:
+            raise KeyError(key)
+        self[key] = value
+        return value
@@ -0,0 +1,196 @@
+"""
+Content hashes of installed templates, settings and user configs
+"""
+import hashlib
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Union
+
+from iotanbo_py_utils import file_utils
+
+from templgen.settings import Settings
+from templgen.template_sources import TemplateSources
+
+# Type aliases
+ErrorMsg = str
+StringOrNone = Union[str, None]
+
+
+class Fingerprints:
+    """
+    Methods of this class do not raise exceptions, instead they return a tuple
+    (result, error); 'result' may be of any type and 'error' is
+    an empty string if success or error message otherwise.
+
+    Fingerprints of all files in the global '.templgen' dir are stored in
+    '.templgen/fingerprints.json' as
+    {"relative/path": [size, mtime_ns, "sha256 hex digest"], ...}.
+    Files are hashed in a thread pool (hashlib releases the GIL for large buffers);
+    files whose size and mtime did not change since fingerprints were stored
+    are not read unless a full check is requested.
+    """
+    FINGERPRINTS_FILE_NAME = "fingerprints.json"
+    READ_BUFFER_SIZE = 1024 * 1024
+    # Files that change on their own and are not fingerprinted
+    EXCLUDED_FILE_NAMES = (FINGERPRINTS_FILE_NAME, ".lock", ".integrity")
+    # Top level dirs that are not fingerprinted, git template cache is verified by git itself
+    EXCLUDED_DIR_NAMES = (TemplateSources.CACHE_DIR_NAME,)
+
+    def __init__(self, *, templgen, max_workers=None, **kwargs):
+        """
+        :param templgen: Templgen instance
+        :param max_workers: number of hashing threads, defaults to ThreadPoolExecutor default
+        """
+        super().__init__(**kwargs)
+        self._templgen = templgen
+        self.max_workers = max_workers
+
+    @property
+    def fingerprints_file(self) -> str:
+        return os.path.join(self._templgen.settings.global_templgen_dir, Fingerprints.FINGERPRINTS_FILE_NAME)
+
+    def verify(self, template: StringOrNone = None, update=False, full=False) -> (dict, ErrorMsg):
+        """
+        Compare current files with stored fingerprints.
+        :param template: if set, only files of this template (name or path relative
+                         to the templates dir) are checked
+        :param update: if True, fingerprints of checked files are stored afterwards
+        :param full: if True, all files are hashed even if their size and mtime did not change
+        :return: ({"modified": [...], "added": [...], "missing": [...], "unchanged": int}, "")
+                 or ({}, error message)
+        """
+        stored, error = self.read_fingerprints()
+        if error:
+            return {}, error
+        if not stored and not update:
+            return {}, "no fingerprints stored yet, run 'templgen verify --update' first"
+        root, prefix, error = self._get_scope(template)
+        if error:
+            return {}, error
+        stat_results = Fingerprints.scan(root, prefix)
+        scoped_stored = {path: value for path, value in stored.items()
+                         if not prefix or path == prefix or path.startswith(prefix + "/")}
+        current, error = self.compute(root, stat_results, {} if full else scoped_stored)
+        if error:
+            return {}, error
+        report = {"modified": [], "added": [], "missing": [], "unchanged": 0}
+        for path, value in sorted(current.items()):
+            if path not in scoped_stored:
+                report["added"].append(path)
+            elif scoped_stored[path][2] != value[2]:
+                report["modified"].append(path)
+            else:
+                report["unchanged"] += 1
+        report["missing"] = sorted(path for path in scoped_stored if path not in current)
+        if update:
+            for path in scoped_stored:
+                stored.pop(path)
+            stored.update(current)
+            _, error = self.write_fingerprints(stored)
+            if error:
+                return {}, error
+        return report, ""
+
+    def compute(self, root: str, stat_results: dict, previous: dict) -> (dict, ErrorMsg):
+        """
+        Fingerprint files in parallel.
+        :param root: dir the paths are relative to
+        :param stat_results: {"relative/path": (size, mtime_ns), ...}
+        :param previous: previously stored fingerprints; a file whose size and mtime
+                         match is not read and its previous hash is reused
+        :return: ({"relative/path": [size, mtime_ns, sha256], ...}, "") or ({}, error message)
+        """
+        result = {}
+        to_hash = []
+        for path, (size, mtime_ns) in stat_results.items():
+            old = previous.get(path)
+            if old and old[0] == size and old[1] == mtime_ns:
+                result[path] = list(old)
+            else:
+                to_hash.append(path)
+        try:
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                digests = executor.map(self.hash_file,
+                                       (os.path.join(root, path) for path in to_hash))
+                for path, digest in zip(to_hash, digests):
+                    result[path] = [*stat_results[path], digest]
+        except OSError as e:
+            return {}, str(e)
+        return result, ""
+
+    @staticmethod
+    def hash_file(path: str) -> str:
+        """
+        SHA-256 hex digest of file contents, raises OSError
+        """
+        file_hash = hashlib.sha256()
+        buffer = bytearray(Fingerprints.READ_BUFFER_SIZE)
+        view = memoryview(buffer)
+        with open(path, "rb", buffering=0) as f:
+            while True:
+                size = f.readinto(buffer)
+                if not size:
+                    break
+                file_hash.update(view[:size])
+        return file_hash.hexdigest()
+
+    @staticmethod
+    def scan(root: str, prefix: str = "") -> dict:
+        """
+        Sizes and modification times of all files under `root/prefix`, symlinks are not followed.
+        :return: {"relative/path": (size, mtime_ns), ...}; paths are relative to `root`
+        """
+        result = {}
+        stack = [prefix]
+        while stack:
+            rel_dir = stack.pop()
+            try:
+                with os.scandir(os.path.join(root, rel_dir) if rel_dir else root) as it:
+                    for entry in it:
+                        rel_path = f"{rel_dir}/{entry.name}" if rel_dir else entry.name
+                        if entry.is_dir(follow_symlinks=False):
+                            if rel_dir or entry.name not in Fingerprints.EXCLUDED_DIR_NAMES:
+                                stack.append(rel_path)
+                        elif entry.is_file(follow_symlinks=False) and \
+                                entry.name not in Fingerprints.EXCLUDED_FILE_NAMES:
+                            st = entry.stat(follow_symlinks=False)
+                            result[rel_path] = (st.st_size, st.st_mtime_ns)
+            except OSError:
+                continue
+        return result
+
+    def read_fingerprints(self) -> (dict, ErrorMsg):
+        if not file_utils.file_exists(self.fingerprints_file):
+            return {}, ""
+        try:
+            with open(self.fingerprints_file, "r") as f:
+                return json.load(f), ""
+        except Exception as e:
+            return {}, f"can't read '{self.fingerprints_file}': {e}"
+
+    def write_fingerprints(self, fingerprints: dict) -> (None, ErrorMsg):
+        try:
+            with open(self.fingerprints_file, "w") as f:
+                json.dump(fingerprints, f, indent=0, sort_keys=True)
+        except Exception as e:
+            return None, str(e)
+        return None, ""
+
+    def _get_scope(self, template: StringOrNone) -> (str, str, ErrorMsg):
+        """
+        :return: (root dir, prefix of relative paths to be checked, error message)
+        """
+        root = self._templgen.settings.global_templgen_dir
+        if not template:
+            return root, "", ""
+        templates_dir = os.path.join(root, Settings.TEMPLGEN_TEMPL_DIR_NAME)
+        template_path = os.path.join(templates_dir, template)
+        if not file_utils.dir_exists(template_path):
+            for dir_path, dir_names, _ in os.walk(templates_dir):
+                if template in dir_names:
+                    template_path = os.path.join(dir_path, template)
+                    break
+            else:
+                return "", "", f"template '{template}' is not installed"
+        return root, os.path.relpath(template_path, root).replace(os.sep, "/"), ""
@@ -1,9 +1,1033 @@
 """
 Instantiate template
 """
+import difflib
+import gc
+import gzip
+import hashlib
+import json
+import lzma
+import os
+import re
+import threading
+from array import array
+from datetime import date
+from typing import Iterator
+from typing import NamedTuple
+from typing import Union
+
+from iotanbo_py_utils import file_utils
+
+from templgen.durability import Durability
+from templgen.filters import Filters
+from templgen.settings import Settings
+from templgen.variables import VariableResolver
+
+# Type aliases
+ErrorMsg = str
+StringOrNone = Union[str, None]
+
+
+class PlanEntry(NamedTuple):
+    """
+    Output entry of a template plan; tuple-based, so no per-entry dict
+    """
+    src_path: str
+    dst_rel_path: str
+    is_dir: bool
 
 
 class Generator:
+    """
+    Methods of this class do not raise exceptions, instead they return a tuple
+    (result, error); 'result' may be of any type and 'error' is
+    an empty string if success or error message otherwise.
+
+    A template is a directory named after the template; it contains an optional
+    descriptor file '<template_name>.desc' with default variable values
+    ('name=value' lines) and any number of files and subdirectories.
+    Placeholders like '{{class_name}}' are replaced with variable values both
+    in file contents and in file/directory names; values may be passed through
+    filters, e.g. '{{ class_name | snake }}', see Filters. The built-in variable
+    'today' holds the date of the run, e.g. '{{ today | year }}'.
+
+    Optional subtrees:
+      - a file or directory whose name starts with '{% if var %}' or
+        '{% if not var %}' is generated only if the condition holds,
+        the marker itself is stripped from the output name;
+      - the optional rules file '<template_name>.rules' contains
+        'relative/path = [not] var' lines with the same meaning.
+    Disabled subtrees are pruned while planning: nothing inside them is
+    listed, stat'ed or read.
+
+    Inheritance: 'extends=base_template' in the descriptor makes the template
+    a layer on top of 'base_template' (a template name or a path relative to
+    the template's parent dir), which may extend another template, and so on.
+    Variables and rules of the base are overridden by the derived template;
+    a path present in several layers is taken from the topmost one only.
 
-    def __init__(self, **kwargs):
+    Post-generation hooks: the optional hooks file '<template_name>.hooks' declares
+    shell commands to be run in the generated project, see HookRunner.
+
+    Compression: a template file may be stored compressed with zlib (gzip format)
+    or lzma, as '<file name>.templgen-gz' or '<file name>.templgen-xz'; it is
+    decompressed as a stream while being read and generated as '<file name>'.
+    See compress_template().
+    """
+    TEMPLATE_DESC_FILE_EXTENSION = ".desc"
+    TEMPLATE_RULES_FILE_EXTENSION = ".rules"
+    TEMPLATE_HOOKS_FILE_EXTENSION = ".hooks"
+    TEMPLATE_EXTENDS_KEY = "extends"
+    COMPRESSION_SUFFIXES = {"zlib": ".templgen-gz", "lzma": ".templgen-xz"}
+    PLACEHOLDER_RE = Filters.PLACEHOLDER_RE
+    TODAY_VARIABLE = "today"
+    CONDITION_MARKER_RE = re.compile(r"^{%\s*if\s+(not\s+)?(\w+)\s*%}")
+    TRUE_VALUES = ("1", "true", "yes", "on")
+    HASH_READ_BUFFER_SIZE = 1024 * 1024
+    # Per-output records of the last generate() kept in the target dir, see diff()
+    MANIFEST_FILE_NAME = ".templgen-manifest"
+    # Directory listings kept in memory at most, larger templates are listed again when needed
+    LISTING_CACHE_MAX_ENTRIES = 100000
+    # Resident memory is checked every that many files if `max_rss` is set
+    RSS_CHECK_INTERVAL = 256
+
+    def __init__(self, *, templgen=None, keep_compiled=False, max_rss=None,
+                 durability: StringOrNone = None, **kwargs):
+        """
+        :param templgen: Templgen instance, settings and user config are used as template variables if set
+        :param keep_compiled: if True, compiled template files are kept in memory
+                              for subsequent generations (e.g. in watch mode)
+        :param max_rss: resident memory ceiling in bytes; when exceeded during generation,
+                        in-memory caches are dropped before more files are processed
+        :param durability: how output files are made durable, see Durability;
+                           defaults to the mode of `templgen` or "none"
+        """
         super().__init__(**kwargs)
+        self._templgen = templgen
+        self._durability = durability
+        self.keep_compiled = keep_compiled
+        self.max_rss = max_rss
+        self._compiled_cache = {}
+        self._cached_listing_entries = 0
+        # Guards caches that are updated together, the instance may be shared by threads
+        self._cache_lock = threading.Lock()
+        # Inheritance chains and merged directory listings, keyed by template path;
+        # entries are kept with modification times they were built from and rebuilt when those change
+        self._layers_cache = {}
+        self._listing_cache = {}
+        # Variables and (src_path, dst_rel_path) of written files of the last run,
+        # keyed by (template path, target path), see regenerate()
+        self._runs = {}
+        self.builtin_templates_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                  Settings.TEMPLGEN_TEMPL_DIR_NAME)
+
+    @property
+    def durability(self) -> str:
+        if self._durability is not None:
+            return self._durability
+        return self._templgen.durability if self._templgen is not None else Durability.NONE
+
+    @durability.setter
+    def durability(self, mode: StringOrNone) -> None:
+        self._durability = mode
+
+    def resolve_template(self, template: str, cwd: StringOrNone = None) -> (str, ErrorMsg):
+        """
+        Find template directory by name or path.
+        :param template: path to template directory or template name; names are looked up
+                         in registered git sources first (if created by Templgen),
+                         then in the global templates dir, then in built-in templates
+        :param cwd: dir relative paths are resolved against, current working dir by default
+        :return: (path to template directory, "") or ("", error message)
+        """
+        if not template:
+            return "", "template not specified"
+        template_path = os.path.join(cwd, template) if cwd else template
+        if file_utils.dir_exists(template_path):
+            return os.path.abspath(template_path), ""
+        if self._templgen is not None:
+            template_path, error = self._templgen.template_sources.materialize(template)
+            if error or template_path:
+                return template_path, error
+        home_dir = self._templgen.home_dir if self._templgen is not None else file_utils.get_user_home_dir()
+        search_dirs = [os.path.join(home_dir, Settings.TEMPLGEN_DIR_NAME, Settings.TEMPLGEN_TEMPL_DIR_NAME),
+                       self.builtin_templates_dir]
+        for search_dir in search_dirs:
+            for dir_path, dir_names, _ in os.walk(search_dir):
+                if template in dir_names:
+                    return os.path.join(dir_path, template), ""
+        return "", f"template '{template}' not found"
+
+    def get_layers(self, template_path: str) -> (list, ErrorMsg):
+        """
+        Resolve template inheritance chain; result is cached until a descriptor of the chain changes.
+        :param template_path: path to template directory
+        :return: ([template_path, base_path, base_of_base_path, ...], "") or ([], error message)
+        """
+        template_path = os.path.normpath(os.path.abspath(template_path))
+        cached = self._layers_cache.get(template_path)
+        if cached is not None:
+            layers, desc_mtimes = cached
+            if desc_mtimes == Generator._get_mtimes(Generator._desc_file_path(layer) for layer in layers):
+                return layers, ""
+        layers = []
+        desc_mtimes = []
+        path = template_path
+        while path:
+            if path in layers:
+                return [], f"circular template inheritance: '{path}'"
+            layers.append(path)
+            # Taken before reading, so a change made meanwhile is detected next time
+            desc_mtimes.extend(Generator._get_mtimes([Generator._desc_file_path(path)]))
+            desc, error = Generator.read_template_desc(path)
+            if error:
+                return [], error
+            base = desc.get(Generator.TEMPLATE_EXTENDS_KEY, "")
+            if not base:
+                break
+            base_path = os.path.join(os.path.dirname(path), base)
+            if not file_utils.dir_exists(base_path):
+                base_path, error = self.resolve_template(base)
+                if error:
+                    return [], f"base of template '{path}': {error}"
+            path = os.path.normpath(os.path.abspath(base_path))
+        self._layers_cache[template_path] = (layers, tuple(desc_mtimes))
+        return layers, ""
+
+    def clear_cache(self, compiled=True) -> None:
+        """
+        Forget resolved inheritance chains and directory listings, e.g. after templates were modified
+        :param compiled: if False, compiled template files are kept
+        """
+        with self._cache_lock:
+            self._layers_cache.clear()
+            self._listing_cache.clear()
+            self._cached_listing_entries = 0
+            if compiled:
+                self._compiled_cache.clear()
+
+    @staticmethod
+    def _get_mtimes(paths) -> tuple:
+        """
+        Modification times of paths, None for missing ones
+        """
+        result = []
+        for path in paths:
+            try:
+                result.append(os.stat(path).st_mtime_ns)
+            except OSError:
+                result.append(None)
+        return tuple(result)
+
+    def forget_compiled(self, src_paths) -> None:
+        """
+        Drop compiled versions of the specified template files
+        """
+        for src_path in src_paths:
+            self._compiled_cache.pop(src_path, None)
+
+    @staticmethod
+    def read_template_desc(template_path: str) -> (dict, ErrorMsg):
+        """
+        Read default variable values from the template descriptor file.
+        :param template_path: path to template directory
+        :return: (dict of variables, "") or ({}, error message);
+                 missing descriptor is not an error
+        """
+        return Generator.read_key_value_file(Generator._desc_file_path(template_path))
+
+    @staticmethod
+    def _desc_file_path(template_path: str) -> str:
+        return Generator.template_file_path(template_path, Generator.TEMPLATE_DESC_FILE_EXTENSION)
+
+    def get_template_rules(self, template_path: str) -> (dict, ErrorMsg):
+        """
+        Rules of the template merged with the rules of its base templates
+        """
+        layers, error = self.get_layers(template_path)
+        if error:
+            return {}, error
+        result = {}
+        for layer in reversed(layers):
+            rules, error = Generator.read_template_rules(layer)
+            if error:
+                return {}, error
+            result.update(rules)
+        return result, ""
+
+    @staticmethod
+    def read_template_rules(template_path: str) -> (dict, ErrorMsg):
+        """
+        Read conditions for optional paths from the template rules file.
+        :param template_path: path to template directory
+        :return: ({"relative/path": (negated, variable_name), ...}, "") or ({}, error message)
+        """
+        rules_file = Generator.template_file_path(template_path, Generator.TEMPLATE_RULES_FILE_EXTENSION)
+        entries, error = Generator.read_key_value_file(rules_file)
+        if error:
+            return {}, error
+        rules = {}
+        for path, condition in entries.items():
+            rule = Generator.parse_condition(condition)
+            if rule is None:
+                return {}, f"invalid condition for '{path}' in '{rules_file}': '{condition}'"
+            rules[path.strip("/")] = rule
+        return rules, ""
+
+    @staticmethod
+    def parse_condition(condition: str) -> Union[tuple, None]:
+        """
+        Parse '[not] var' condition.
+        :return: (negated, variable_name) or None if the condition is invalid
+        """
+        words = condition.split()
+        if len(words) == 1:
+            return False, words[0]
+        if len(words) == 2 and words[0] == "not":
+            return True, words[1]
+        return None
+
+    @staticmethod
+    def read_key_value_file(path: str) -> (dict, ErrorMsg):
+        """
+        Read a file of 'name=value' lines; empty lines and lines starting with '#' are skipped.
+        :return: (dict, "") or ({}, error message); missing file results in an empty dict
+        """
+        if not file_utils.file_exists(path):
+            return {}, ""
+        result = {}
+        try:
+            with open(path, "r") as f:
+                for line in f:
+                    line = line.strip()
+                    if not line or line.startswith("#"):
+                        continue
+                    name, sep, value = line.partition("=")
+                    if not sep:
+                        return {}, f"invalid line in '{path}': '{line}'"
+                    result[name.strip()] = value.strip()
+        except Exception as e:
+            return {}, str(e)
+        return result, ""
+
+    def plan(self, template_path: str, variables: dict) -> (list, ErrorMsg):
+        """
+        Build the list of output entries for the template; see iter_plan().
+        :return: ([(src_path, dst_rel_path, is_dir), ...], "") or ([], error message)
+        """
+        entries, error = self.iter_plan(template_path, variables)
+        if error:
+            return [], error
+        try:
+            return list(entries), ""
+        except OSError as e:
+            return [], str(e)
+
+    def iter_plan(self, template_path: str, variables: dict) -> (Iterator, ErrorMsg):
+        """
+        Lazily produce output entries for the template, one directory listing at a time.
+        Subtrees whose conditions evaluate to false are not descended into.
+        :param template_path: path to template directory
+        :param variables: template variables
+        :return: (iterator of (src_path, dst_rel_path, is_dir), "") or (None, error message);
+                 directories always precede their contents; iteration raises OSError
+        """
+        layers, error = self.get_layers(template_path)
+        if error:
+            return None, error
+        rules, error = self.get_template_rules(template_path)
+        if error:
+            return None, error
+        return self._iter_plan(layers, rules, variables), ""
+
+    def _iter_plan(self, layers: list, rules: dict, variables: dict):
+        # Stack of (src_rel_dir, dst_rel_dir)
+        stack = [("", "")]
+        while stack:
+            src_rel_dir, dst_rel_dir = stack.pop()
+            subdirs = []
+            for name, src_path, is_dir in self._list_template_dir(layers, src_rel_dir):
+                src_rel_path = f"{src_rel_dir}/{name}" if src_rel_dir else name
+                if src_rel_path in rules and not self.is_true(variables, *rules[src_rel_path]):
+                    continue
+                marker = Generator.CONDITION_MARKER_RE.match(name)
+                if marker:
+                    if not self.is_true(variables, bool(marker.group(1)), marker.group(2)):
+                        continue
+                    name = name[marker.end():]
+                dst_rel_path = os.path.join(dst_rel_dir, self.render(name, variables))
+                yield PlanEntry(src_path, dst_rel_path, is_dir)
+                if is_dir:
+                    subdirs.append((src_rel_path, dst_rel_path))
+            stack.extend(reversed(subdirs))
+
+    def generate(self, template_path: str, target_path: str,
+                 variables: Union[dict, None] = None) -> (None, ErrorMsg):
+        """
+        Instantiate template into the target directory.
+        :param template_path: path to template directory
+        :param target_path: output directory, created if not exists
+        :param variables: values that override template defaults
+        :return: Tuple with error message as second element
+        """
+        error = Durability.check_mode(self.durability)
+        if error:
+            return None, error
+        all_variables, error = self.get_variables(template_path, variables, project_path=target_path)
+        if error:
+            return None, error
+        entries, error = self.iter_plan(template_path, all_variables)
+        if error:
+            return None, error
+        # Outputs are not collected here to keep memory flat, a remembered run is outdated now
+        self._runs.pop(Generator._run_key(template_path, target_path), None)
+        manifest_path = os.path.join(target_path, Generator.MANIFEST_FILE_NAME)
+        tmp_path = manifest_path + Durability.TMP_SUFFIX
+        try:
+            os.makedirs(target_path, exist_ok=True)
+            # Records are streamed into the manifest as files are written
+            with open(tmp_path, "w") as manifest:
+                manifest.write(json.dumps({"variables": Generator._variables_digest(all_variables)}) + "\n")
+                for _ in self._write_entries(entries, target_path, all_variables, manifest):
+                    pass
+            os.replace(tmp_path, manifest_path)
+        except OSError as e:
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+            return None, str(e)
+        return None, ""
+
+    def remember(self, template_path: str, target_path: str,
+                 variables: Union[dict, None] = None) -> (None, ErrorMsg):
+        """
+        Remember variables and outputs of a project that is already generated in the target
+        directory without writing anything, so that regenerate() after a change of variables
+        rewrites only the affected outputs.
+        :return: Tuple with error message as second element
+        """
+        all_variables, error = self.get_variables(template_path, variables, project_path=target_path)
+        if error:
+            return None, error
+        run_variables = Generator._run_variables(all_variables)
+        entries, error = self.iter_plan(template_path, all_variables)
+        if error:
+            return None, error
+        outputs = set()
+        for _ in Generator._collect_outputs(entries, outputs):
+            pass
+        self._runs[Generator._run_key(template_path, target_path)] = (run_variables, outputs)
+        return None, ""
+
+    def regenerate(self, template_path: str, target_path: str, changed_paths,
+                   variables: Union[dict, None] = None) -> (list, ErrorMsg):
+        """
+        Update an already generated project after some template files changed.
+        Only outputs of the changed files are rendered and written. If anything else
+        changed (descriptor, rules, settings, user config, directory structure), the plan
+        is built again and only new outputs and outputs of files whose placeholders refer to a
+        changed variable are written, compared to the last run remembered by regenerate() or
+        remember(); without a remembered run every output is written.
+        Compiled versions of unchanged files are reused if `keep_compiled` is set.
+        :param template_path: path to template directory
+        :param target_path: output directory
+        :param changed_paths: paths of changed files
+        :param variables: values that override template defaults
+        :return: ([dst_rel_path, ...] of written files, "") or ([], error message)
+        """
+        error = Durability.check_mode(self.durability)
+        if error:
+            return [], error
+        changed_paths = {os.path.normpath(os.path.abspath(path)) for path in changed_paths}
+        if not changed_paths:
+            return [], ""
+        layers, error = self.get_layers(template_path)
+        if error:
+            return [], error
+        templates_only = all(self._is_known_template_file(layers, path) for path in changed_paths)
+        self.forget_compiled(changed_paths)
+        if not templates_only:
+            # Structure, conditions or variables may have changed, unchanged template files may not
+            self.clear_cache(compiled=False)
+        all_variables, error = self.get_variables(template_path, variables, project_path=target_path)
+        if error:
+            return [], error
+        run_variables = Generator._run_variables(all_variables)
+        entries, error = self.iter_plan(template_path, all_variables)
+        if error:
+            return [], error
+        run_key = Generator._run_key(template_path, target_path)
+        run = self._runs.pop(run_key, None)
+        outputs = None
+        if templates_only:
+            entries = (entry for entry in entries if entry[0] in changed_paths)
+        else:
+            outputs = set()
+            entries = Generator._collect_outputs(entries, outputs)
+            if run is not None:
+                previous_variables, previous_outputs = run
+                changed_names = {name for name in previous_variables.keys() | run_variables.keys()
+                                 if previous_variables.get(name) != run_variables.get(name)}
+                # Directories are kept: their entries create them before their files
+                entries = (entry for entry in entries
+                           if entry[2] or entry[0] in changed_paths or (entry[0], entry[1]) not in previous_outputs
+                           or self._refers_to(entry[0], changed_names))
+        try:
+            os.makedirs(target_path, exist_ok=True)
+            written = list(self._write_entries(entries, target_path, all_variables))
+        except OSError as e:
+            return [], str(e)
+        if outputs is not None:
+            run = (run_variables, outputs)
+        if run is not None:
+            self._runs[run_key] = run
+        return written, ""
+
+    @staticmethod
+    def _run_key(template_path: str, target_path: str) -> tuple:
+        return os.path.normpath(os.path.abspath(template_path)), os.path.normpath(os.path.abspath(target_path))
+
+    @staticmethod
+    def _run_variables(variables: dict) -> dict:
+        """
+        Copy of variable values without computed filtered values
+        """
+        return {name: value for name, value in variables.items() if Filters.KEY_SEPARATOR not in name}
+
+    @staticmethod
+    def _collect_outputs(entries, outputs: set):
+        """
+        Pass planned entries through, adding (src_path, dst_rel_path) of files to `outputs`
+        """
+        for entry in entries:
+            if not entry[2]:
+                outputs.add((entry[0], entry[1]))
+            yield entry
+
+    def _refers_to(self, src_path: str, names: set) -> bool:
+        """
+        True if the template file has a placeholder of one of the variables, filtered or not
+        """
+        if not names:
+            return False
+        compiled = self._get_compiled(src_path)
+        if isinstance(compiled, bytes):
+            return False
+        return any(name.split(Filters.KEY_SEPARATOR, 1)[0] in names for name in compiled.names)
+
+    def diff(self, template_path: str, target_path: str,
+             variables: Union[dict, None] = None,
+             out=None, show_diff=False) -> (dict, ErrorMsg):
+        """
+        Compare what would be generated with the existing target directory; nothing is written.
+        Output files are checked against the manifest written by the last generate() with the
+        same variables: a file whose template file and output are as recorded costs two stats
+        and is not rendered. Other files are rendered and compared by size first and byte by byte
+        only if sizes match; diffs are produced only for changed files.
+        :param template_path: path to template directory
+        :param target_path: existing output directory
+        :param variables: values that override template defaults
+        :param out: text stream the report is written to as it is produced, e.g. sys.stdout;
+                    if None, nothing is written
+        :param show_diff: if True, unified diffs are written instead of 'A path'/'M path' lines
+        :return: ({"added": [dst_rel_path, ...], "modified": [dst_rel_path, ...],
+                   "unchanged": int}, "")
+                 or ({}, error message)
+        """
+        all_variables, error = self.get_variables(template_path, variables, project_path=target_path)
+        if error:
+            return {}, error
+        entries, error = self.iter_plan(template_path, all_variables)
+        if error:
+            return {}, error
+        manifest = Generator._read_manifest(target_path, Generator._variables_digest(all_variables))
+        result = {"added": [], "modified": [], "unchanged": 0}
+        try:
+            for src_path, dst_rel_path, is_dir in entries:
+                if is_dir:
+                    continue
+                dst_path = os.path.join(target_path, dst_rel_path)
+                try:
+                    dst_stat = os.stat(dst_path)
+                except FileNotFoundError:
+                    result["added"].append(dst_rel_path)
+                    if out is not None:
+                        if show_diff:
+                            Generator._write_diff(out, dst_rel_path, None, self._render_file(src_path, all_variables))
+                        else:
+                            out.write(f"A {dst_rel_path}\n")
+                    continue
+                data = None
+                record = manifest.get(dst_rel_path)
+                unchanged = Generator._matches_record(record, src_path, dst_path, dst_stat) if record else None
+                if unchanged is None:
+                    data = self._render_file(src_path, all_variables)
+                    unchanged = not Generator._file_differs(dst_path, dst_stat.st_size, data)
+                if unchanged:
+                    result["unchanged"] += 1
+                    continue
+                result["modified"].append(dst_rel_path)
+                if out is not None:
+                    if show_diff:
+                        if data is None:
+                            data = self._render_file(src_path, all_variables)
+                        with open(dst_path, "rb") as f:
+                            Generator._write_diff(out, dst_rel_path, f.read(), data)
+                    else:
+                        out.write(f"M {dst_rel_path}\n")
+        except OSError as e:
+            return {}, str(e)
+        return result, ""
+
+    def get_variables(self, template_path: str, variables: Union[dict, None] = None,
+                      project_path: StringOrNone = None, with_context=True) -> (dict, ErrorMsg):
+        """
+        Collect and resolve template variables: settings and current user config
+        (only if created by Templgen), then template defaults (base templates first),
+        then `variables`; see VariableResolver.
+        :param template_path: path to template directory
+        :param variables: values that override all others, e.g. from command line
+        :param project_path: project dir whose local settings and users are used
+        :param with_context: if False, settings and user config are not used
+        :return: (FilteredVariables, "") or ({}, error message)
+        """
+        layers, error = self.get_layers(template_path)
+        if error:
+            return {}, error
+        result = {Generator.TODAY_VARIABLE: date.today().isoformat()}
+        if self._templgen is not None and with_context:
+            context, error = self._templgen.variable_resolver.get_context_variables(project_path)
+            if error:
+                return {}, error
+            result.update(context)
+        for layer in reversed(layers):
+            desc, error = Generator.read_template_desc(layer)
+            if error:
+                return {}, error
+            result.update(desc)
+        result.pop(Generator.TEMPLATE_EXTENDS_KEY, None)
+        if variables:
+            result.update(variables)
+        # Filtered values are computed once for the whole run, including those used while resolving
+        return VariableResolver.resolve(result)
+
+    def render(self, text: str, variables: dict, quote=None) -> str:
+        """
+        Replace placeholders with variable values; unknown placeholders are left as is
+        :param quote: function applied to each value, e.g. shlex.quote
+        """
+        def replace(match):
+            value = Filters.lookup(variables, Filters.placeholder_key(match))
+            if value is None:
+                return match.group(0)
+            return quote(str(value)) if quote else str(value)
+        return Generator.PLACEHOLDER_RE.sub(replace, text)
+
+    @staticmethod
+    def is_true(variables: dict, negated: bool, name: str) -> bool:
+        """
+        Evaluate '[not] name' condition; missing variables are false
+        """
+        value = str(variables.get(name, "")).strip().lower() in Generator.TRUE_VALUES
+        return not value if negated else value
+
+    def _write_entries(self, entries, target_path: str, variables: dict, manifest=None):
+        """
+        Write planned entries into the existing target dir, one at a time.
+        Since directories come before their contents, each output directory is created
+        top-down with a single mkdir when its entry arrives, without existence checks.
+        Files are opened relative to a descriptor of their directory, which stays open
+        while consecutive files go into the same directory, so paths are not resolved
+        again for every file.
+        Written files are made durable according to `durability` when the last entry is written.
+        If `manifest` (text stream) is set, a record of each written file is written to it.
+        Raises OSError.
+        :return: iterator of dst_rel_path of written files
+        """
+        durability = self.durability
+        # os.replace() and os.unlink() accept directory descriptors wherever os.open() does
+        use_dir_fd = os.open in os.supports_dir_fd
+        current_dir = None
+        dir_fd = None
+        count = 0
+        made_dirs = False
+        # Directories whose entries changed, collected and fsync'ed at the end in strict mode only
+        strict = durability == Durability.STRICT
+        changed_dirs = set()
+
+        try:
+            for src_path, dst_rel_path, is_dir in entries:
+                if is_dir:
+                    try:
+                        os.mkdir(os.path.join(target_path, dst_rel_path))
+                        made_dirs = True
+                        if strict:
+                            changed_dirs.add(os.path.dirname(dst_rel_path))
+                    except FileExistsError:
+                        pass
+                    continue
+                dst_rel_dir, name = os.path.split(dst_rel_path)
+                if strict:
+                    changed_dirs.add(dst_rel_dir)
+                if not use_dir_fd:
+                    name = os.path.join(target_path, dst_rel_path)
+                elif dst_rel_dir != current_dir:
+                    if dir_fd is not None:
+                        os.close(dir_fd)
+                        dir_fd = None
+                    dir_path = os.path.join(target_path, dst_rel_dir)
+                    try:
+                        dir_fd = os.open(dir_path, os.O_RDONLY | os.O_DIRECTORY)
+                    except FileNotFoundError:
+                        # Only changed files are written and their dir was removed meanwhile
+                        os.makedirs(dir_path)
+                        dir_fd = os.open(dir_path, os.O_RDONLY | os.O_DIRECTORY)
+                    current_dir = dst_rel_dir
+                # Taken before reading, so a later change of the template file is not recorded as rendered
+                src_stat = os.stat(src_path)
+                data = self._render_file(src_path, variables)
+                # Executable template files (scripts) stay executable
+                Durability.write_file(name, data, durability, dir_fd, src_stat.st_mode & 0o111)
+                if manifest is not None:
+                    dst_stat = os.stat(os.path.join(target_path, dst_rel_path))
+                    manifest.write(json.dumps([dst_rel_path, src_path, src_stat.st_mtime_ns, src_stat.st_size,
+                                               dst_stat.st_mtime_ns, dst_stat.st_size,
+                                               hashlib.sha1(data).hexdigest()]) + "\n")
+                yield dst_rel_path
+                count += 1
+                if self.max_rss and count % Generator.RSS_CHECK_INTERVAL == 0:
+                    self._limit_memory()
+            if count or made_dirs:
+                Durability.finish(durability, target_path,
+                                  (os.path.join(target_path, rel_dir) for rel_dir in sorted(changed_dirs)))
+        finally:
+            if dir_fd is not None:
+                os.close(dir_fd)
+
+    def _limit_memory(self) -> None:
+        """
+        Drop caches if resident memory exceeds `max_rss`
+        """
+        rss = Generator.get_rss()
+        if rss is None or rss <= self.max_rss:
+            return
+        with self._cache_lock:
+            self._compiled_cache.clear()
+            self._listing_cache.clear()
+            self._cached_listing_entries = 0
+        gc.collect()
+
+    @staticmethod
+    def get_rss() -> Union[int, None]:
+        """
+        Current resident set size in bytes, None if not available on this platform
+        """
+        try:
+            with open("/proc/self/statm", "r") as f:
+                return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+        except (OSError, ValueError, IndexError, AttributeError):
+            return None
+
+    def _is_known_template_file(self, layers: list, path: str) -> bool:
+        """
+        True if `path` is an existing file that was already listed in one of the template layers
+        """
+        if not os.path.isfile(path):
+            return False
+        for layer in layers:
+            if path.startswith(layer + os.sep):
+                src_rel_dir = os.path.dirname(path[len(layer) + 1:]).replace(os.sep, "/")
+                return any(src_path == path and not is_dir
+                           for _, src_path, is_dir in self._list_template_dir(layers, src_rel_dir))
+        return False
+
+    def _get_compiled(self, src_path: str) -> Union["CompiledTemplate", bytes]:
+        compiled = self._compiled_cache.get(src_path)
+        if compiled is None:
+            compiled = Generator.compile_file(src_path)
+            if self.keep_compiled:
+                self._compiled_cache[src_path] = compiled
+        return compiled
+
+    def _render_file(self, src_path: str, variables: dict) -> bytes:
+        compiled = self._get_compiled(src_path)
+        if isinstance(compiled, bytes):
+            return compiled
+        return compiled.render(variables).encode("utf-8")
+
+    @staticmethod
+    def compile_file(src_path: str) -> Union["CompiledTemplate", bytes]:
+        """
+        Read and compile template file.
+        :return: CompiledTemplate or file contents if it is a binary file
+        """
+        with Generator.open_template_file(src_path) as f:
+            data = f.read()
+        try:
+            return CompiledTemplate(data.decode("utf-8"))
+        except UnicodeDecodeError:
+            # Binary file, copy as is
+            return data
+
+    @staticmethod
+    def open_template_file(src_path: str):
+        """
+        Open template file for reading in binary mode, compressed files are decompressed on the fly
+        """
+        if src_path.endswith(Generator.COMPRESSION_SUFFIXES["zlib"]):
+            return gzip.open(src_path, "rb")
+        if src_path.endswith(Generator.COMPRESSION_SUFFIXES["lzma"]):
+            return lzma.open(src_path, "rb")
+        return open(src_path, "rb")
+
+    @staticmethod
+    def stored_file_name(name: str) -> str:
+        """
+        Name of template file without compression suffix
+        """
+        for suffix in Generator.COMPRESSION_SUFFIXES.values():
+            if name.endswith(suffix):
+                return name[:-len(suffix)]
+        return name
+
+    @staticmethod
+    def compress_template(template_path: str, method: StringOrNone = "zlib") -> (dict, ErrorMsg):
+        """
+        Compress (or decompress) template files in place; the descriptor, rules and hooks files
+        are left as is, files that would not get smaller are not compressed.
+        :param template_path: path to template directory
+        :param method: "zlib", "lzma" or None to decompress all files
+        :return: ({"files": int, "size_before": int, "size_after": int}, "") or ({}, error message)
+        """
+        if method is not None and method not in Generator.COMPRESSION_SUFFIXES:
+            return {}, f"unknown compression method '{method}'"
+        skip_files = {Generator.template_file_path(template_path, ext)
+                      for ext in (Generator.TEMPLATE_DESC_FILE_EXTENSION,
+                                  Generator.TEMPLATE_RULES_FILE_EXTENSION,
+                                  Generator.TEMPLATE_HOOKS_FILE_EXTENSION)}
+        result = {"files": 0, "size_before": 0, "size_after": 0}
+        try:
+            for dir_path, _, file_names in os.walk(template_path):
+                for file_name in file_names:
+                    src_path = os.path.join(dir_path, file_name)
+                    if os.path.normpath(src_path) in skip_files or file_name.endswith(".tmp"):
+                        continue
+                    size_before = os.stat(src_path).st_size
+                    plain_name = Generator.stored_file_name(file_name)
+                    if method is None:
+                        dst_path = os.path.join(dir_path, plain_name)
+                    else:
+                        dst_path = os.path.join(dir_path, plain_name + Generator.COMPRESSION_SUFFIXES[method])
+                    if dst_path == src_path:
+                        size_after = size_before
+                    else:
+                        size_after = Generator._recompress_file(src_path, dst_path, method)
+                        if method is not None and size_after >= size_before and plain_name == file_name:
+                            os.remove(dst_path)
+                            size_after = size_before
+                        else:
+                            os.remove(src_path)
+                            result["files"] += 1
+                    result["size_before"] += size_before
+                    result["size_after"] += size_after
+        except (OSError, EOFError, lzma.LZMAError) as e:
+            return {}, str(e)
+        return result, ""
+
+    @staticmethod
+    def _recompress_file(src_path: str, dst_path: str, method: StringOrNone) -> int:
+        """
+        Stream `src_path` into `dst_path` compressed with `method` (or plain if None)
+        :return: size of the new file
+        """
+        tmp_path = dst_path + ".tmp"
+        with Generator.open_template_file(src_path) as src, open(tmp_path, "wb") as raw:
+            if method == "zlib":
+                # No file name and time in gzip header, so the same contents compress to the same bytes
+                dst = gzip.GzipFile(filename="", mode="wb", fileobj=raw, mtime=0)
+            elif method == "lzma":
+                dst = lzma.LZMAFile(raw, "wb")
+            else:
+                dst = raw
+            with dst:
+                for chunk in iter(lambda: src.read(Generator.HASH_READ_BUFFER_SIZE), b""):
+                    dst.write(chunk)
+        os.replace(tmp_path, dst_path)
+        return os.stat(dst_path).st_size
+
+    def _list_template_dir(self, layers: list, src_rel_dir: str) -> list:
+        """
+        Merged listing of a template directory across all layers, the topmost layer wins;
+        each directory is listed once per Generator, later calls use the cached listing
+        (up to LISTING_CACHE_MAX_ENTRIES entries in total) while modification times
+        of the directory in all layers are the same, i.e. no entry was added, removed or renamed.
+        :return: [(name, src_path, is_dir), ...] sorted by name
+        """
+        key = (tuple(layers), src_rel_dir)
+        layer_dirs = [os.path.join(layer, src_rel_dir) if src_rel_dir else layer for layer in layers]
+        mtimes = Generator._get_mtimes(layer_dirs)
+        cached = self._listing_cache.get(key)
+        if cached is not None and cached[1] == mtimes:
+            return cached[0]
+        skip_files = set()
+        if not src_rel_dir:
+            for layer in layers:
+                skip_files.update(os.path.basename(Generator.template_file_path(layer, ext))
+                                  for ext in (Generator.TEMPLATE_DESC_FILE_EXTENSION,
+                                              Generator.TEMPLATE_RULES_FILE_EXTENSION,
+                                              Generator.TEMPLATE_HOOKS_FILE_EXTENSION))
+        merged = {}
+        for i, layer_dir in enumerate(layer_dirs):
+            try:
+                it = os.scandir(layer_dir)
+            except (FileNotFoundError, NotADirectoryError):
+                # Base layers need not contain every directory of the derived ones
+                if i == 0 and not src_rel_dir:
+                    raise
+                continue
+            with it:
+                for entry in it:
+                    if entry.name in skip_files:
+                        continue
+                    is_dir = entry.is_dir()
+                    name = entry.name if is_dir else Generator.stored_file_name(entry.name)
+                    if name not in merged:
+                        merged[name] = (entry.path, is_dir)
+        listing = [(name, src_path, is_dir) for name, (src_path, is_dir) in sorted(merged.items())]
+        # Threads sharing this Generator may list the same directory at the same time
+        with self._cache_lock:
+            cached = self._listing_cache.pop(key, None)
+            if cached is not None:
+                self._cached_listing_entries -= len(cached[0])
+            if self._cached_listing_entries + len(listing) <= Generator.LISTING_CACHE_MAX_ENTRIES:
+                self._listing_cache[key] = (listing, mtimes)
+                self._cached_listing_entries += len(listing)
+        return listing
+
+    @staticmethod
+    def _file_differs(path: str, size: int, data: bytes) -> bool:
+        """
+        Compare file contents with `data`: size first (`size` comes from a stat already made),
+        then bytes.
+        """
+        if size != len(data):
+            return True
+        view = memoryview(data)
+        position = 0
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(Generator.HASH_READ_BUFFER_SIZE), b""):
+                if view[position:position + len(chunk)] != chunk:
+                    return True
+                position += len(chunk)
+        return position != len(data)
+
+    @staticmethod
+    def _file_hash(path: str) -> str:
+        file_hash = hashlib.sha1()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(Generator.HASH_READ_BUFFER_SIZE), b""):
+                file_hash.update(chunk)
+        return file_hash.hexdigest()
+
+    @staticmethod
+    def _variables_digest(variables: dict) -> str:
+        return hashlib.sha1(json.dumps(Generator._run_variables(variables), sort_keys=True,
+                                       default=str).encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def _read_manifest(target_path: str, variables_digest: str) -> dict:
+        """
+        :return: {dst_rel_path: [src_path, src_mtime_ns, src_size, dst_mtime_ns, dst_size, sha1], ...};
+                 empty if there is no manifest, it can't be read or was written with other variables
+        """
+        try:
+            with open(os.path.join(target_path, Generator.MANIFEST_FILE_NAME), "r") as f:
+                header = json.loads(f.readline())
+                if header.get("variables") != variables_digest:
+                    return {}
+                return {record[0]: record[1:] for record in map(json.loads, f)}
+        except (OSError, ValueError, AttributeError, IndexError, TypeError):
+            return {}
+
+    @staticmethod
+    def _matches_record(record: list, src_path: str, dst_path: str, dst_stat) -> Union[bool, None]:
+        """
+        Check an output file against its manifest record without rendering it.
+        :return: True if unchanged, False if modified, None if the template file changed since
+        """
+        recorded_src_path, src_mtime, src_size, dst_mtime, dst_size, digest = record
+        try:
+            src_stat = os.stat(src_path)
+        except OSError:
+            return None
+        if recorded_src_path != src_path or src_stat.st_mtime_ns != src_mtime or src_stat.st_size != src_size:
+            return None
+        if dst_stat.st_size != dst_size:
+            return False
+        if dst_stat.st_mtime_ns == dst_mtime:
+            return True
+        # Touched or rewritten, compared with the recorded contents
+        return Generator._file_hash(dst_path) == digest
+
+    @staticmethod
+    def _write_diff(out, dst_rel_path: str, old_data: Union[bytes, None], new_data: bytes) -> None:
+        try:
+            old_lines = old_data.decode("utf-8").splitlines(keepends=True) if old_data is not None else []
+            new_lines = new_data.decode("utf-8").splitlines(keepends=True)
+        except UnicodeDecodeError:
+            out.write(f"Binary files a/{dst_rel_path} and b/{dst_rel_path} differ\n")
+            return
+        from_file = f"a/{dst_rel_path}" if old_data is not None else "/dev/null"
+        for line in difflib.unified_diff(old_lines, new_lines, from_file, f"b/{dst_rel_path}"):
+            out.write(line if line.endswith("\n") else line + "\n\\ No newline at end of file\n")
+
+    @staticmethod
+    def template_file_path(template_path: str, extension: str) -> str:
+        template_path = os.path.normpath(template_path)
+        return os.path.join(template_path, os.path.basename(template_path) + extension)
+
+
+class CompiledTemplate:
+    """
+    Template text with its placeholders located once.
+    Placeholder keys ('name' or 'name|filter|...', see Filters) are interned and
+    their (start, end) positions are kept in one flat array, so a compiled file
+    costs its text plus a few bytes per placeholder rather than an object per
+    placeholder. Filter chains are resolved by key, so with FilteredVariables
+    a filtered value is a single dict lookup after its first use.
+    """
+    __slots__ = ("text", "names", "offsets")
+
+    def __init__(self, text: str):
+        names = []
+        offsets = array("L")
+        for match in Generator.PLACEHOLDER_RE.finditer(text):
+            names.append(Filters.placeholder_key(match))
+            offsets.append(match.start())
+            offsets.append(match.end())
+        self.text = text
+        self.names = tuple(names)
+        self.offsets = offsets
+
+    def render(self, variables: dict) -> str:
+        """
+        Replace placeholders with variable values; unknown placeholders are left as is
+        """
+        if not self.names:
+            return self.text
+        text = self.text
+        offsets = self.offsets
+        parts = []
+        position = 0
+        for i, name in enumerate(self.names):
+            start = offsets[2 * i]
+            end = offsets[2 * i + 1]
+            parts.append(text[position:start])
+            value = variables.get(name)
+            if value is None and Filters.KEY_SEPARATOR in name:
+                value = Filters.lookup(variables, name)
+            parts.append(text[start:end] if value is None else str(value))
+            position = end
+        parts.append(text[position:])
+        return "".join(parts)
@@ -0,0 +1,234 @@
+"""
+Post-generation hooks
+"""
+import os
+import shlex
+import subprocess
+import time
+from concurrent.futures import FIRST_COMPLETED
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import wait
+from configparser import ConfigParser
+from typing import Union
+
+from iotanbo_py_utils import file_utils
+
+from templgen.generator import Generator
+from templgen.settings import Settings
+
+# Type aliases
+ErrorMsg = str
+StringOrNone = Union[str, None]
+
+
+class HookRunner:
+    """
+    Methods of this class do not raise exceptions, instead they return a tuple
+    (result, error); 'result' may be of any type and 'error' is
+    an empty string if success or error message otherwise.
+
+    Hooks are declared in the template hooks file '<template_name>.hooks',
+    one section per hook:
+
+        [git_init]
+        run = git init -q
+
+        [format]
+        run = black {{name}}
+        after = git_init
+        if = use_black
+
+    'run' is a shell command executed in the generated project dir, placeholders
+    are replaced with shell-quoted variable values; 'after' lists hooks that must
+    succeed first; 'if' is an optional '[not] var' condition.
+    Hooks of base templates are inherited and may be overridden by name.
+
+    Independent hooks run concurrently, up to `max_jobs` at a time; output of
+    each hook (stdout and stderr) is captured, so outputs are never interleaved.
+    If a hook fails, hooks that depend on it are skipped.
+    """
+    RUN_KEY = "run"
+    AFTER_KEY = "after"
+    CONDITION_KEY = "if"
+
+    def __init__(self, *, templgen=None, max_jobs=None, **kwargs):
+        """
+        :param templgen: Templgen instance
+        :param max_jobs: number of hooks run at the same time, number of CPUs by default
+        """
+        super().__init__(**kwargs)
+        self._templgen = templgen
+        self.max_jobs = max_jobs
+
+    @property
+    def generator(self) -> Generator:
+        return self._templgen.generator if self._templgen else Generator()
+
+    def run_template_hooks(self, template_path: str, target_path: str,
+                           variables: Union[dict, None] = None) -> (dict, ErrorMsg):
+        """
+        Run hooks of the template in the generated project dir.
+        :param template_path: path to template directory
+        :param target_path: generated project dir
+        :param variables: values that override template defaults
+        :return: see run()
+        """
+        generator = self.generator
+        all_variables, error = generator.get_variables(template_path, variables, project_path=target_path)
+        if error:
+            return {}, error
+        hooks, error = self.get_template_hooks(template_path)
+        if error:
+            return {}, error
+        commands = {}
+        for name, hook in hooks.items():
+            condition = hook.get("condition")
+            if condition and not generator.is_true(all_variables, *condition):
+                continue
+            commands[name] = {"run": generator.render(hook["run"], all_variables, quote=shlex.quote), "after": hook["after"]}
+        # Dependencies on disabled hooks are satisfied
+        for hook in commands.values():
+            hook["after"] = [dependency for dependency in hook["after"]
+                             if dependency in commands or dependency not in hooks]
+        return self.run(commands, target_path)
+
+    def get_template_hooks(self, template_path: str) -> (dict, ErrorMsg):
+        """
+        Hooks of the template merged with the hooks of its base templates
+        """
+        layers, error = self.generator.get_layers(template_path)
+        if error:
+            return {}, error
+        result = {}
+        for layer in reversed(layers):
+            hooks, error = HookRunner.read_template_hooks(layer)
+            if error:
+                return {}, error
+            result.update(hooks)
+        return result, ""
+
+    @staticmethod
+    def read_template_hooks(template_path: str) -> (dict, ErrorMsg):
+        """
+        Read the template hooks file.
+        :param template_path: path to template directory
+        :return: ({"name": {"run": str, "after": [names], "condition": (negated, var) or None}, ...}, "")
+                 or ({}, error message); missing hooks file is not an error
+        """
+        hooks_file = Generator.template_file_path(template_path, Generator.TEMPLATE_HOOKS_FILE_EXTENSION)
+        if not file_utils.file_exists(hooks_file):
+            return {}, ""
+        # Commands may contain '%', so no interpolation
+        sections, error = Settings.read_settings_from_file(ConfigParser(interpolation=None), hooks_file)
+        if error:
+            return {}, error
+        hooks = {}
+        for name, entries in sections.items():
+            run = entries.get(HookRunner.RUN_KEY, "").strip()
+            if not run:
+                return {}, f"hook '{name}' in '{hooks_file}' has no '{HookRunner.RUN_KEY}' command"
+            condition = None
+            if entries.get(HookRunner.CONDITION_KEY):
+                condition = Generator.parse_condition(entries[HookRunner.CONDITION_KEY])
+                if condition is None:
+                    return {}, f"invalid condition for hook '{name}' in '{hooks_file}': " \
+                               f"'{entries[HookRunner.CONDITION_KEY]}'"
+            hooks[name] = {"run": run,
+                           "after": entries.get(HookRunner.AFTER_KEY, "").replace(",", " ").split(),
+                           "condition": condition}
+        return hooks, ""
+
+    def run(self, hooks: dict, cwd: str) -> (dict, ErrorMsg):
+        """
+        Run shell commands concurrently, each one after all of its dependencies succeeded.
+        :param hooks: {"name": {"run": "shell command", "after": [names]}, ...}
+        :param cwd: working directory of the commands
+        :return: ({"name": {"returncode": int or None, "output": str, "seconds": float}, ...}, "")
+                 in order of completion; skipped hooks have returncode None.
+                 If any hook failed, results are returned along with error message.
+                 ({}, error message) if dependencies are unknown or circular.
+        """
+        error = HookRunner.check_dependencies(hooks)
+        if error:
+            return {}, error
+        results = {}
+        pending = {name: set(hook["after"]) for name, hook in hooks.items()}
+        running = {}
+        with ThreadPoolExecutor(max_workers=self.max_jobs or os.cpu_count()) as executor:
+            while pending or running:
+                for name in sorted(name for name, dependencies in pending.items() if not dependencies):
+                    del pending[name]
+                    running[executor.submit(HookRunner.run_command, hooks[name]["run"], cwd)] = name
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    results[name] = future.result()
+                    if results[name]["returncode"] == 0:
+                        for dependencies in pending.values():
+                            dependencies.discard(name)
+                    else:
+                        HookRunner._skip_dependents(name, pending, results)
+        failed = [name for name, result in results.items() if result["returncode"]]
+        if failed:
+            return results, f"hooks failed: {', '.join(failed)}"
+        return results, ""
+
+    @staticmethod
+    def run_command(cmd: str, cwd: str) -> dict:
+        """
+        Run shell command capturing its stdout and stderr together.
+        :return: {"returncode": int, "output": str, "seconds": float}
+        """
+        start = time.monotonic()
+        try:
+            completed = subprocess.run(cmd, shell=True, cwd=cwd, env=dict(os.environ),
+                                       stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+            returncode, output = completed.returncode, completed.stdout.decode("utf-8", errors="replace")
+        except OSError as e:
+            returncode, output = -1, str(e)
+        return {"returncode": returncode, "output": output, "seconds": time.monotonic() - start}
+
+    @staticmethod
+    def check_dependencies(hooks: dict) -> ErrorMsg:
+        """
+        :return: error message if a hook depends on an unknown hook or dependencies are circular
+        """
+        for name, hook in hooks.items():
+            for dependency in hook["after"]:
+                if dependency not in hooks:
+                    return f"hook '{name}' depends on unknown hook '{dependency}'"
+        # Depth-first search, path holds the chain currently being visited
+        visited = set()
+        for start in sorted(hooks):
+            if start in visited:
+                continue
+            path = [start]
+            stack = [(start, iter(hooks[start]["after"]))]
+            while stack:
+                name, dependencies = stack[-1]
+                dependency = next(dependencies, None)
+                if dependency is None:
+                    visited.add(name)
+                    stack.pop()
+                    path.pop()
+                elif dependency in path:
+                    cycle = path[path.index(dependency):] + [dependency]
+                    return f"circular hook dependency: {' -> '.join(cycle)}"
+                elif dependency not in visited:
+                    stack.append((dependency, iter(hooks[dependency]["after"])))
+                    path.append(dependency)
+        return ""
+
+    @staticmethod
+    def _skip_dependents(failed: str, pending: dict, results: dict) -> None:
+        """
+        Remove hooks that directly or indirectly depend on `failed` from `pending`
+        """
+        blocked = [failed]
+        while blocked:
+            name = blocked.pop()
+            for dependent in [dependent for dependent, dependencies in pending.items() if name in dependencies]:
+                del pending[dependent]
+                results[dependent] = {"returncode": None, "output": f"skipped, '{name}' did not succeed",
+                                      "seconds": 0.0}
+                blocked.append(dependent)
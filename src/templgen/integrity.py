@@ -0,0 +1,235 @@
+"""
+Validation and repair of '.templgen' directories
+"""
+import os
+from configparser import ConfigParser
+from typing import Union
+
+from iotanbo_py_utils import file_utils
+
+from templgen.generator import Generator
+from templgen.settings import Settings
+from templgen.user_manager import UserManager
+
+# Type aliases
+ErrorMsg = str
+StringOrNone = Union[str, None]
+
+
+class IntegrityChecker:
+    """
+    Methods of this class do not raise exceptions, instead they return a tuple
+    (result, error); 'result' may be of any type and 'error' is
+    an empty string if success or error message otherwise.
+
+    Full validation checks main config, every user dir and config and every
+    installed template; after a successful validation a stamp file with
+    modification times of the '.templgen' dir, the main config, the 'users' and
+    'templates' dirs, every user dir with its config and 'templ_config' dir, and
+    every template dir directly in 'templates' with its descriptor and rules file
+    is written into the '.templgen' dir. While these times do not change,
+    validation is skipped.
+    Not covered by the stamp: templates nested deeper in 'templates' and base
+    templates outside of it, and files inside templates other than descriptor and rules;
+    run 'templgen doctor' after changing those.
+    """
+    STAMP_FILE_NAME = ".integrity"
+
+    def __init__(self, *, templgen, **kwargs):
+        super().__init__(**kwargs)
+        self._templgen = templgen
+
+    @staticmethod
+    def is_stamp_fresh(path: StringOrNone = None) -> bool:
+        """
+        Fast check: True if the dir was validated and not changed since.
+        :param path: dir that contains '.templgen', user home dir by default
+        """
+        templgen_dir = os.path.join(path or file_utils.get_user_home_dir(), Settings.TEMPLGEN_DIR_NAME)
+        try:
+            with open(os.path.join(templgen_dir, IntegrityChecker.STAMP_FILE_NAME), "r") as f:
+                stamp = f.read()
+            return stamp == IntegrityChecker._get_stamp(templgen_dir)
+        except (OSError, UnicodeDecodeError):
+            return False
+
+    @staticmethod
+    def _get_stamp(templgen_dir: str) -> str:
+        """
+        Modification times of everything whose change requires validation, one
+        'relative/path mtime' line per path, '-' for missing paths; raises OSError
+        """
+        users_dir = os.path.join(templgen_dir, Settings.TEMPLGEN_USERS_DIR_NAME)
+        templates_dir = os.path.join(templgen_dir, Settings.TEMPLGEN_TEMPL_DIR_NAME)
+        checked = [os.path.join(templgen_dir, Settings.TEMPLGEN_CONFIG_FILE_NAME), users_dir, templates_dir]
+        for user_name in IntegrityChecker._list_subdirs(users_dir):
+            user_dir = os.path.join(users_dir, user_name)
+            checked += [user_dir, os.path.join(user_dir, Settings.TEMPLGEN_USER_CONFIG_FILE_NAME),
+                        os.path.join(user_dir, Settings.TEMPLGEN_USER_TEMPL_CONFIG_DIR_NAME)]
+        for template_name in IntegrityChecker._list_subdirs(templates_dir):
+            template_dir = os.path.join(templates_dir, template_name)
+            checked += [template_dir] + [Generator.template_file_path(template_dir, ext)
+                                         for ext in (Generator.TEMPLATE_DESC_FILE_EXTENSION,
+                                                     Generator.TEMPLATE_RULES_FILE_EXTENSION)]
+        lines = [f". {os.stat(templgen_dir).st_mtime_ns}"]
+        for path in checked:
+            try:
+                mtime = str(os.stat(path).st_mtime_ns)
+            except FileNotFoundError:
+                mtime = "-"
+            lines.append(f"{os.path.relpath(path, templgen_dir)} {mtime}")
+        return "\n".join(lines)
+
+    @staticmethod
+    def _list_subdirs(dir_path: str) -> list:
+        try:
+            with os.scandir(dir_path) as it:
+                return sorted(entry.name for entry in it if entry.is_dir())
+        except FileNotFoundError:
+            return []
+
+    def validate(self, path: StringOrNone = None, repair=False) -> (list, ErrorMsg):
+        """
+        Check structure of '.templgen' dir, user configs and templates.
+        :param path: dir that contains '.templgen', user home dir by default
+        :param repair: if True, problems that can be fixed are fixed
+        :return: ([(problem description, repaired: bool), ...], "") or ([], error message);
+                 if there are no unrepaired problems, the integrity stamp is updated
+        """
+        if not path:
+            path = self._templgen.home_dir
+        templgen_dir = os.path.join(path, Settings.TEMPLGEN_DIR_NAME)
+        problems = []
+
+        def report(problem, fix=None):
+            repaired = False
+            if repair and fix is not None:
+                try:
+                    fix()
+                    repaired = True
+                except Exception as e:
+                    problem = f"{problem} (repair failed: {e})"
+            problems.append((problem, repaired))
+
+        if not file_utils.dir_exists(templgen_dir):
+            if not repair:
+                return [(f"directory '{templgen_dir}' not exists", False)], ""
+            _, error = self._templgen.settings.init(path)
+            if error:
+                return [], error
+            problems.append((f"directory '{templgen_dir}' not exists", True))
+
+        for dir_name in (Settings.TEMPLGEN_USERS_DIR_NAME, Settings.TEMPLGEN_TEMPL_DIR_NAME):
+            dir_path = os.path.join(templgen_dir, dir_name)
+            if not file_utils.dir_exists(dir_path):
+                report(f"directory '{dir_path}' not exists", lambda p=dir_path: os.makedirs(p))
+
+        # Main config
+        config_file = os.path.join(templgen_dir, Settings.TEMPLGEN_CONFIG_FILE_NAME)
+        settings = {}
+        if not file_utils.file_exists(config_file):
+            report(f"config file '{config_file}' not exists",
+                   lambda: self._write_config(config_file, Settings.DEFAULT_SETTINGS))
+        else:
+            settings, error = IntegrityChecker._read_config(config_file)
+            if error:
+                report(f"config file '{config_file}' can't be read: {error}")
+            else:
+                missing = IntegrityChecker._missing_values(settings, Settings.DEFAULT_SETTINGS)
+                if missing:
+                    report(f"config file '{config_file}' misses {', '.join(sorted(missing))}",
+                           lambda: self._add_missing(config_file, settings, Settings.DEFAULT_SETTINGS))
+
+        # Users
+        users_dir = os.path.join(templgen_dir, Settings.TEMPLGEN_USERS_DIR_NAME)
+        user_names = UserManager.list_users(path)
+        default_user_config = UserManager._get_default_user_config(None)
+        for user_name in user_names:
+            user_dir = os.path.join(users_dir, user_name)
+            templ_config_dir = os.path.join(user_dir, Settings.TEMPLGEN_USER_TEMPL_CONFIG_DIR_NAME)
+            if not file_utils.dir_exists(templ_config_dir):
+                report(f"directory '{templ_config_dir}' not exists", lambda p=templ_config_dir: os.makedirs(p))
+            user_config_file = os.path.join(user_dir, Settings.TEMPLGEN_USER_CONFIG_FILE_NAME)
+            if not file_utils.file_exists(user_config_file):
+                report(f"user config '{user_config_file}' not exists",
+                       lambda p=user_config_file: self._write_config(p, default_user_config))
+                continue
+            user_config, error = IntegrityChecker._read_config(user_config_file)
+            if error:
+                report(f"user config '{user_config_file}' can't be read: {error}")
+                continue
+            missing = IntegrityChecker._missing_values(user_config, default_user_config)
+            if missing:
+                report(f"user config '{user_config_file}' misses {', '.join(sorted(missing))}",
+                       lambda p=user_config_file, c=user_config:
+                       self._add_missing(p, c, default_user_config))
+        if file_utils.dir_exists(users_dir):
+            with os.scandir(users_dir) as it:
+                for entry in it:
+                    if not entry.is_dir() and entry.name != UserManager.USERS_LOCK_FILE_NAME:
+                        report(f"unexpected file '{entry.path}' in users directory")
+        current_user = settings.get("GENERAL", {}).get("current_user", "")
+        if current_user and current_user not in user_names and not UserManager.user_exists_globally(current_user, self._templgen.home_dir):
+            report(f"current user '{current_user}' not exists",
+                   lambda: self._add_missing(config_file, settings, {"GENERAL": {"current_user": ""}},
+                                             overwrite=True))
+
+        # Templates
+        templates_dir = os.path.join(templgen_dir, Settings.TEMPLGEN_TEMPL_DIR_NAME)
+        # Templates are checked without settings and user variables, which are validated above;
+        # base templates are resolved against the home dir of this Templgen instance
+        generator = self._templgen.generator
+        for dir_path, dir_names, _ in os.walk(templates_dir):
+            if not file_utils.file_exists(Generator.template_file_path(dir_path, Generator.TEMPLATE_DESC_FILE_EXTENSION)):
+                continue
+            # Do not descend into template contents
+            dir_names.clear()
+            _, error = generator.get_variables(dir_path, with_context=False)
+            if not error:
+                _, error = generator.get_template_rules(dir_path)
+            if error:
+                report(f"template '{dir_path}': {error}")
+
+        if not any(not repaired for _, repaired in problems):
+            error = IntegrityChecker.write_stamp(path)
+            if error:
+                return problems, error
+        return problems, ""
+
+    @staticmethod
+    def write_stamp(path: StringOrNone = None) -> ErrorMsg:
+        templgen_dir = os.path.join(path or file_utils.get_user_home_dir(), Settings.TEMPLGEN_DIR_NAME)
+        stamp_file = os.path.join(templgen_dir, IntegrityChecker.STAMP_FILE_NAME)
+        try:
+            # Create the file first: creation changes dir mtime, rewriting it does not
+            with open(stamp_file, "a"):
+                pass
+            stamp = IntegrityChecker._get_stamp(templgen_dir)
+            with open(stamp_file, "w") as f:
+                f.write(stamp)
+        except OSError as e:
+            return str(e)
+        return ""
+
+    @staticmethod
+    def _read_config(path: str) -> (dict, ErrorMsg):
+        return Settings.read_settings_from_file(ConfigParser(allow_no_value=True), path)
+
+    def _write_config(self, path: str, values: dict) -> None:
+        config_parser = ConfigParser(allow_no_value=True)
+        config_parser.read_dict(values)
+        Settings.write_config(config_parser, path, self._templgen.durability)
+
+    @staticmethod
+    def _missing_values(config: dict, defaults: dict) -> list:
+        # Keys with asterisk are descriptions of settings, they may be removed
+        return [f"{section}.{key}" for section, entries in defaults.items()
+                for key in entries if not key.endswith("*") and key not in config.get(section, {})]
+
+    def _add_missing(self, path: str, config: dict, defaults: dict, overwrite=False) -> None:
+        for section, entries in defaults.items():
+            config_section = config.setdefault(section, {})
+            for key, value in entries.items():
+                if overwrite or key not in config_section:
+                    config_section[key] = value
+        self._write_config(path, config)
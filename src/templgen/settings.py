@@ -1,13 +1,19 @@
 """
 Global and local (project - scope) settings
 """
+import io
 import os
+import shutil
 import subprocess
+import sys
+import threading
 from configparser import ConfigParser
 from typing import Union
 
 from iotanbo_py_utils import file_utils
 
+from templgen.durability import Durability
+
 # Type aliases
 ErrorMsg = str
 StringOrNone = Union[str, None]
@@ -18,6 +24,10 @@ class Settings:
     Methods of this class do not raise exceptions, instead they return a tuple
     (result, error); 'result' may be of any type and 'error' is
     an empty string if success or error message otherwise.
+
+    Settings read by read_settings_for_path() are kept per thread, so threads
+    sharing one instance may work with different projects at the same time;
+    config files are rewritten under a lock.
     """
     DEFAULT_SETTINGS = {
         "GENERAL": {
@@ -39,42 +49,96 @@ class Settings:
     TEMPLGEN_CONFIG_FILE_EXTENSION = ".cfg"
     TEMPLGEN_CONFIG_FILE_NAME = "main.cfg"
     TEMPLGEN_USER_CONFIG_FILE_NAME = "user.cfg"
+    # Entries of the global templgen dir that are not copied into local configs:
+    # git template cache, template sources, template fingerprints and integrity stamp
+    TEMPLGEN_GLOBAL_ONLY_NAMES = ("cache", "sources.cfg", "fingerprints.json", ".integrity")
 
     def __init__(self, *, templgen, **kwargs):
         super().__init__(**kwargs)
-        self.global_templgen_dir = os.path.join(file_utils.get_user_home_dir(),
-                                                Settings.TEMPLGEN_DIR_NAME)
+        self.home_dir = templgen.home_dir
+        self.global_templgen_dir = os.path.join(self.home_dir, Settings.TEMPLGEN_DIR_NAME)
         self.global_config_file = os.path.join(self.global_templgen_dir,
                                                Settings.TEMPLGEN_CONFIG_FILE_NAME)
 
-        self.cfg_parser = ConfigParser(allow_no_value=True)
         self._templgen = templgen
-        self._current_settings = {}
-        self._current_project_path = None
-        self._current_settings_modified = False
+        self._lock = threading.RLock()
+        self._thread_state = threading.local()
 
-    def ensure_integrity(self, path=None) -> (None, ErrorMsg):
+    @property
+    def durability(self) -> str:
+        """
+        Durability mode of config writes, see Durability
         """
+        return self._templgen.durability
+
+    def _get_thread_state(self):
+        state = self._thread_state
+        if not hasattr(state, "settings"):
+            state.settings = {}
+            state.project_path = None
+            state.modified = False
+        return state
+
+    @property
+    def _current_settings(self) -> dict:
+        return self._get_thread_state().settings
+
+    @_current_settings.setter
+    def _current_settings(self, value: dict) -> None:
+        self._get_thread_state().settings = value
+
+    @property
+    def _current_project_path(self) -> StringOrNone:
+        return self._get_thread_state().project_path
+
+    @_current_project_path.setter
+    def _current_project_path(self, value: StringOrNone) -> None:
+        self._get_thread_state().project_path = value
 
+    @property
+    def _current_settings_modified(self) -> bool:
+        return self._get_thread_state().modified
+
+    @_current_settings_modified.setter
+    def _current_settings_modified(self, value: bool) -> None:
+        self._get_thread_state().modified = value
+
+    def ensure_integrity(self, path=None) -> (None, ErrorMsg):
+        """
+        Make sure templgen dir exists and is valid. If it was validated before and
+        not changed since, this costs a few stat calls; otherwise full validation
+        is performed (see IntegrityChecker).
         :param path: path to dir that must contain templgen settings;
                      if `None`, path is set to user home dir and global
                      settings integrity is checked
         :return: Error message as the second element in tuple
         """
         if not path:
-            path = file_utils.get_user_home_dir()
+            path = self.home_dir
+        integrity = self._templgen.integrity
+        if integrity.is_stamp_fresh(path):
+            return None, ""
 
-        # Ensure .templgen directory exists
-        path_to_templgen = os.path.join(path, Settings.TEMPLGEN_DIR_NAME)
-        if not file_utils.dir_exists(path_to_templgen):
-            # if not exists, create a new one
-            print(f" ** Initializing directory '{path_to_templgen}' ...")
-            return self.init(path)
-        # Check config file
-        config_file = os.path.join(path_to_templgen, Settings.TEMPLGEN_CONFIG_FILE_NAME)
-        if not file_utils.file_exists(config_file):
-            self._create_default_config_file(config_file)
-        # TODO: additional check of file structure
+        with self._lock:
+            # Ensure .templgen directory exists
+            path_to_templgen = os.path.join(path, Settings.TEMPLGEN_DIR_NAME)
+            if not file_utils.dir_exists(path_to_templgen):
+                # if not exists, create a new one
+                self._templgen.log(f" ** Initializing directory '{path_to_templgen}' ...")
+                return self.init(path)
+            # Check config file
+            config_file = os.path.join(path_to_templgen, Settings.TEMPLGEN_CONFIG_FILE_NAME)
+            if not file_utils.file_exists(config_file):
+                error = Settings._create_default_config_file(config_file, self.durability)
+                if error:
+                    return None, error
+            problems, error = integrity.validate(path)
+        if error:
+            return None, error
+        problem_count = sum(1 for _, repaired in problems if not repaired)
+        if problem_count:
+            self._templgen.log(f" ** Found {problem_count} problems in '{path_to_templgen}', "
+                               f"run 'templgen doctor' for details")
         return None, ""
 
     @staticmethod
@@ -86,45 +150,47 @@ class Settings:
             If `path` is `None`, global settings in the user home dir will be initialized
         """
         if not path:
-            path = file_utils.get_user_home_dir()
+            path = self.home_dir
         path_to_templgen = os.path.join(path, Settings.TEMPLGEN_DIR_NAME)
-        if file_utils.dir_exists(path_to_templgen):
-            # remove old directory
-            file_utils.remove_dir_noexcept(path_to_templgen)
-
-        # Create main dir and 'users' and 'templates' dirs inside it
-        Settings._create_dir_or_die(os.path.join(path_to_templgen, Settings.TEMPLGEN_USERS_DIR_NAME))
-        Settings._create_dir_or_die(os.path.join(path_to_templgen, Settings.TEMPLGEN_TEMPL_DIR_NAME))
-        # Write default config file
-        config_file = os.path.join(path_to_templgen, Settings.TEMPLGEN_CONFIG_FILE_NAME)
-        self._create_default_config_file(config_file)
-
-        return None, ""
+        with self._lock:
+            if file_utils.dir_exists(path_to_templgen):
+                # remove old directory
+                file_utils.remove_dir_noexcept(path_to_templgen)
+
+            # Create main dir and 'users' and 'templates' dirs inside it
+            for dir_name in (Settings.TEMPLGEN_USERS_DIR_NAME, Settings.TEMPLGEN_TEMPL_DIR_NAME):
+                error = Settings._create_dir(os.path.join(path_to_templgen, dir_name))
+                if error:
+                    return None, error
+            # Write default config file
+            config_file = os.path.join(path_to_templgen, Settings.TEMPLGEN_CONFIG_FILE_NAME)
+            error = Settings._create_default_config_file(config_file, self.durability)
+        return None, error
 
     def read_settings_for_path(self, project_path) -> (None, ErrorMsg):
         """
         Update self._current_settings according to local settings for 'project_path' (if any)
-        and global settings.
+        and global settings; settings of the calling thread that were modified
+        and not saved are discarded.
         :param project_path: path to the directory for which settings are updated; normally
-                     it's a current working directory
+                     it's a current working directory; home dir if None
         :return: error message as the second element of the tuple
         """
-        if self._current_settings_modified:
-            return None, f"modified settings not saved"
-        if not file_utils.dir_exists(project_path):
+        if not project_path or not file_utils.dir_exists(project_path):
             # return None, f"Path not exists{project_path}"
-            project_path = file_utils.get_user_home_dir()
+            project_path = self.home_dir
         self._current_project_path = project_path
+        self._current_settings_modified = False
         # Load global settings
 
         # print(f"Before adding settings from {self.global_config_file}")
         # self._add_settings_from_file(self.global_config_file)
-        self._current_settings, error = Settings.read_settings_from_file(self.cfg_parser,
+        self._current_settings, error = Settings.read_settings_from_file(ConfigParser(allow_no_value=True),
                                                                          self.global_config_file)
         if error:
             return None, error
 
-        if project_path == file_utils.get_user_home_dir():
+        if project_path == self.home_dir:
             return None, ""
 
         current_templgen_dir = os.path.join(project_path, Settings.TEMPLGEN_DIR_NAME)
@@ -137,13 +203,13 @@ class Settings:
         if file_utils.file_exists(local_config_file):
             # Load local settings and override global
             # self._add_settings_from_file(config_file)
-            local_settings, error = Settings.read_settings_from_file(self.cfg_parser,
+            local_settings, error = Settings.read_settings_from_file(ConfigParser(allow_no_value=True),
                                                                      local_config_file)
             if error:
                 return None, error
             Settings.merge_settings(self._current_settings, local_settings)
         else:
-            print(f"-- Settings: local config file not found: '{local_config_file}'")
+            self._templgen.log(f"-- Settings: local config file not found: '{local_config_file}'")
         return None, ""
 
     def get(self, name: str, section: str = "GENERAL") -> (str, ErrorMsg):
@@ -164,6 +230,17 @@ class Settings:
         else:
             return "", "Not exists"
 
+    def get_section(self, section: str = "GENERAL") -> (dict, ErrorMsg):
+        """
+        Get all settings of the section;
+        read_settings_for_path() must be called before to update settings for the specified path;
+        :param section: section name, defaults to "GENERAL"
+        :return: (copy of section entries, "") or ({}, "Section not exists")
+        """
+        if section not in self._current_settings:
+            return {}, "Section not exists"
+        return dict(self._current_settings[section]), ""
+
     def set(self, param: str, value: str, section: str = "GENERAL", save=True) -> (None, ErrorMsg):
         """
         Set new parameter value
@@ -195,11 +272,12 @@ class Settings:
         if not self._current_project_path:
             return None, "'read_settings_for_path()' must be called before changing settings"
 
-        _, error = Settings.update_config_file(self.cfg_parser,
-                                               os.path.join(self._current_project_path,
-                                                            Settings.TEMPLGEN_DIR_NAME,
-                                                            Settings.TEMPLGEN_CONFIG_FILE_NAME),
-                                               self._current_settings)
+        with self._lock:
+            _, error = Settings.update_config_file(ConfigParser(allow_no_value=True),
+                                                   os.path.join(self._current_project_path,
+                                                                Settings.TEMPLGEN_DIR_NAME,
+                                                                Settings.TEMPLGEN_CONFIG_FILE_NAME),
+                                                   self._current_settings, self.durability)
         if error:
             return None, error
         self._current_settings_modified = False
@@ -208,7 +286,7 @@ class Settings:
     def edit_config(self, project_path=None) -> (None, ErrorMsg):
         self.read_settings_for_path(project_path)
         if not project_path:
-            project_path = file_utils.get_user_home_dir()
+            project_path = self.home_dir
         text_editor, error = self._templgen.settings.get("text_editor")
         if error:
             text_editor = "nano"
@@ -222,7 +300,8 @@ class Settings:
     @staticmethod
     def update_config_file(config_parser: ConfigParser,
                            path_to_config_file: str,
-                           new_values: dict) -> (None, ErrorMsg):
+                           new_values: dict,
+                           durability: str = Durability.NONE) -> (None, ErrorMsg):
         """
         Read config file or create new if not exists, then add new/modified values to it and save back.
         :param config_parser:
@@ -232,6 +311,7 @@ class Settings:
                                         "section1": {"key1": "val1", "key2": "val2, ...},
                                         ...
                                         }
+        :param durability: durability mode of the write, see Durability
         :return: Error message as second element of the tuple
         """
         # print(f"DEBUG: writing config to file: {path_to_config_file}")
@@ -252,43 +332,68 @@ class Settings:
             # print(f"DEBUG: resulting config: {result}")
 
             # Write settings to file
-            with open(path_to_config_file, 'w') as f:
-                config_parser.write(f)
+            Settings.write_config(config_parser, path_to_config_file, durability)
         except Exception as e:
             return None, str(e)
         return None, ""
 
+    @staticmethod
+    def write_config(config_parser: ConfigParser, path_to_config_file: str,
+                     durability: str = Durability.NONE) -> None:
+        """
+        Write config file with a single write call; raises OSError
+        """
+        text = io.StringIO()
+        config_parser.write(text)
+        Durability.write_config(path_to_config_file, text.getvalue(), durability)
+
     def initlocal(self, path) -> (None, ErrorMsg):
         local_config_dir = os.path.join(path, Settings.TEMPLGEN_DIR_NAME)
         if file_utils.dir_exists(local_config_dir):
             return None, f"local config directory already exists: '{local_config_dir}'"
         # Create a copy of global settings for current user only
-        file_utils.copy_dir_noexcept(self.global_templgen_dir, local_config_dir)
+        global_templgen_dir = self.global_templgen_dir
+
+        def ignore(dir_path, names):
+            if os.path.normpath(dir_path) != os.path.normpath(global_templgen_dir):
+                return []
+            return [name for name in names if name in Settings.TEMPLGEN_GLOBAL_ONLY_NAMES]
+
+        try:
+            shutil.copytree(global_templgen_dir, local_config_dir, ignore=ignore)
+        except OSError as e:
+            return None, str(e)
         return None, ""
         # return self.init(is_global=False, path=path)
 
     @staticmethod
     def merge_settings(settings: dict, new_values: dict):
         for section, elements in new_values.items():
+            section = sys.intern(section)
             if section not in settings:
                 settings[section] = {}
             for key, value in elements.items():
-                settings[section][key] = value
+                settings[section][sys.intern(key)] = value
 
     @staticmethod
-    def _create_dir_or_die(path) -> None:
+    def _create_dir(path) -> ErrorMsg:
         err = file_utils.create_path_noexcept(path)["error"]
         if err:
-            print(f"Error: can't create path '{path}', {err}")
-            exit(-1)
+            return f"can't create path '{path}', {err}"
+        return ""
 
-    def _create_default_config_file(self, path_to_config_file) -> None:
+    @staticmethod
+    def _create_default_config_file(path_to_config_file, durability: str = Durability.NONE) -> ErrorMsg:
         # Set default values in the config parser
-        self.cfg_parser.read_dict(self.DEFAULT_SETTINGS)
+        config_parser = ConfigParser(allow_no_value=True)
+        config_parser.read_dict(Settings.DEFAULT_SETTINGS)
 
         # Write settings to file
-        with open(path_to_config_file, 'w') as f:
-            self.cfg_parser.write(f)
+        try:
+            Settings.write_config(config_parser, path_to_config_file, durability)
+        except OSError as e:
+            return str(e)
+        return ""
 
     # def _add_settings_from_file(self, file_name) -> None:
     #     self.cfg_parser.read(file_name)
@@ -309,12 +414,13 @@ class Settings:
 
     @staticmethod
     def config_parser_to_dict(cfg_parser) -> dict:
+        # Section names and keys are interned, they repeat in every config that is read
         result = {}
         for section in cfg_parser.sections():
             section_entries = {}
             for key, value in cfg_parser.items(section):
-                section_entries[key] = value
-            result[section] = section_entries
+                section_entries[sys.intern(key)] = value
+            result[sys.intern(section)] = section_entries
         return result
 
     @staticmethod
@@ -0,0 +1,236 @@
+"""
+Templates stored in local git repositories
+"""
+import os
+import shutil
+import subprocess
+import uuid
+from configparser import ConfigParser
+from typing import Union
+
+from iotanbo_py_utils import file_utils
+
+from templgen.settings import Settings
+
+# Type aliases
+ErrorMsg = str
+StringOrNone = Union[str, None]
+
+
+class TemplateSources:
+    """
+    Methods of this class do not raise exceptions, instead they return a tuple
+    (result, error); 'result' may be of any type and 'error' is
+    an empty string if success or error message otherwise.
+
+    A template source is a directory inside a local git repository at some ref;
+    sources are registered in '.templgen/sources.cfg', one section per template name.
+    Templates are read straight from the git object store into a cache in
+    '.templgen/cache/git':
+      - 'blobs/<xx>/<sha>' holds each file version once, whatever ref it comes from;
+      - 'trees/<tree_sha>/<template_name>' is a template instance made of hard links to blobs.
+    A ref whose template tree was already materialized costs one 'git cat-file'.
+    """
+    SOURCES_FILE_NAME = "sources.cfg"
+    CACHE_DIR_NAME = "cache"
+    GIT_CACHE_DIR_NAME = "git"
+    FILE_URL_PREFIX = "file://"
+    DEFAULT_REF = "HEAD"
+
+    def __init__(self, *, templgen, **kwargs):
+        super().__init__(**kwargs)
+        self._templgen = templgen
+
+    @property
+    def sources_file(self) -> str:
+        return os.path.join(self._templgen.settings.global_templgen_dir, TemplateSources.SOURCES_FILE_NAME)
+
+    @property
+    def cache_dir(self) -> str:
+        return os.path.join(self._templgen.settings.global_templgen_dir, TemplateSources.CACHE_DIR_NAME,
+                            TemplateSources.GIT_CACHE_DIR_NAME)
+
+    def add_source(self, name: str, repo: str, ref: str = DEFAULT_REF, path: str = "") -> (None, ErrorMsg):
+        """
+        Register template from a git repository.
+        :param name: template name used to refer to this source
+        :param repo: path to local repository or 'file://' URL
+        :param ref: branch, tag or commit
+        :param path: template directory inside the repository, repository root by default
+        :return: Tuple with error message as second element
+        """
+        if not name:
+            return None, "template name not specified"
+        sources, error = self.list_sources()
+        if error:
+            return None, error
+        if name in sources:
+            return None, f"template source '{name}' already exists"
+        repo = TemplateSources._repo_path(repo)
+        source = {"repo": repo, "ref": ref or TemplateSources.DEFAULT_REF, "path": path.strip("/")}
+        _, error = TemplateSources._resolve_tree(source)
+        if error:
+            return None, error
+        return Settings.update_config_file(ConfigParser(allow_no_value=True), self.sources_file, {name: source},
+                                           self._templgen.durability)
+
+    def del_source(self, name: str) -> (None, ErrorMsg):
+        sources, error = self.list_sources()
+        if error:
+            return None, error
+        if name not in sources:
+            return None, f"template source '{name}' not exists"
+        del sources[name]
+        config_parser = ConfigParser(allow_no_value=True)
+        config_parser.read_dict(sources)
+        try:
+            Settings.write_config(config_parser, self.sources_file, self._templgen.durability)
+        except OSError as e:
+            return None, str(e)
+        return None, ""
+
+    def list_sources(self) -> (dict, ErrorMsg):
+        """
+        :return: ({"name": {"repo": ..., "ref": ..., "path": ...}, ...}, "") or ({}, error message)
+        """
+        if not file_utils.file_exists(self.sources_file):
+            return {}, ""
+        return Settings.read_settings_from_file(ConfigParser(allow_no_value=True), self.sources_file)
+
+    def materialize(self, name: str) -> (str, ErrorMsg):
+        """
+        Get template directory for a registered source, reading it from git if not cached yet.
+        :return: (path to template directory, "") or ("", error message);
+                 ("", "") if there is no source with such name
+        """
+        sources, error = self.list_sources()
+        if error:
+            return "", error
+        source = sources.get(name)
+        if source is None:
+            return "", ""
+        tree, error = TemplateSources._resolve_tree(source)
+        if error:
+            return "", error
+        template_name = os.path.basename(source.get("path", "")) or name
+        tree_dir = os.path.join(self.cache_dir, "trees", tree)
+        template_path = os.path.join(tree_dir, template_name)
+        if file_utils.dir_exists(template_path):
+            return template_path, ""
+        staging_dir = os.path.join(self.cache_dir, "trees", f".tmp-{uuid.uuid4().hex}")
+        try:
+            self._checkout_tree(source["repo"], tree, os.path.join(staging_dir, template_name))
+            try:
+                os.rename(staging_dir, tree_dir)
+            except OSError:
+                # The tree is already materialized, possibly under another template name
+                # of a source with the same contents
+                if not file_utils.dir_exists(tree_dir):
+                    raise
+                try:
+                    os.rename(os.path.join(staging_dir, template_name), template_path)
+                except OSError:
+                    # Materialized concurrently by another process
+                    if not file_utils.dir_exists(template_path):
+                        raise
+        except (OSError, subprocess.SubprocessError) as e:
+            return "", str(e)
+        finally:
+            shutil.rmtree(staging_dir, ignore_errors=True)
+        return template_path, ""
+
+    def _checkout_tree(self, repo: str, tree: str, dst_dir: str) -> None:
+        """
+        Create template dir from git tree, each blob is fetched once into the blob cache
+        and hard linked into place; raises OSError and subprocess.SubprocessError.
+        """
+        listing = subprocess.run(["git", "-C", repo, "ls-tree", "-r", "-z", "--full-tree", tree],
+                                 check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE).stdout
+        entries = []
+        for record in listing.split(b"\0"):
+            if not record:
+                continue
+            info, path = record.split(b"\t", 1)
+            mode, kind, sha = info.decode().split()
+            if kind == "blob":
+                entries.append((mode, sha, os.fsdecode(path)))
+        blobs_dir = os.path.join(self.cache_dir, "blobs")
+        missing = sorted({sha for _, sha, _ in entries
+                          if not os.path.exists(os.path.join(blobs_dir, sha[:2], sha))})
+        if missing:
+            self._fetch_blobs(repo, missing, blobs_dir)
+        os.makedirs(dst_dir)
+        for mode, sha, path in entries:
+            blob = os.path.join(blobs_dir, sha[:2], sha)
+            dst_path = os.path.join(dst_dir, path)
+            os.makedirs(os.path.dirname(dst_path), exist_ok=True)
+            if mode == "120000":
+                with open(blob, "rb") as f:
+                    os.symlink(os.fsdecode(f.read()), dst_path)
+                continue
+            if mode == "100755":
+                # Not linked, mode is shared by all links to the blob
+                shutil.copyfile(blob, dst_path)
+                os.chmod(dst_path, 0o755)
+                continue
+            try:
+                os.link(blob, dst_path)
+            except OSError:
+                shutil.copyfile(blob, dst_path)
+
+    @staticmethod
+    def _fetch_blobs(repo: str, shas: list, blobs_dir: str) -> None:
+        """
+        Read blobs through a single 'git cat-file --batch' process
+        """
+        with subprocess.Popen(["git", "-C", repo, "cat-file", "--batch"],
+                              stdin=subprocess.PIPE, stdout=subprocess.PIPE) as process:
+            for sha in shas:
+                process.stdin.write(sha.encode() + b"\n")
+                process.stdin.flush()
+                header = process.stdout.readline().split()
+                if len(header) != 3:
+                    raise OSError(f"can't read git object {sha}")
+                size = int(header[2])
+                blob_dir = os.path.join(blobs_dir, sha[:2])
+                os.makedirs(blob_dir, exist_ok=True)
+                tmp_path = os.path.join(blob_dir, f".{sha}.tmp")
+                with open(tmp_path, "wb") as f:
+                    remaining = size
+                    while remaining:
+                        chunk = process.stdout.read(min(remaining, 1024 * 1024))
+                        if not chunk:
+                            raise OSError(f"unexpected end of git object {sha}")
+                        f.write(chunk)
+                        remaining -= len(chunk)
+                os.replace(tmp_path, os.path.join(blob_dir, sha))
+                # Trailing newline after object contents
+                process.stdout.read(1)
+            process.stdin.close()
+
+    @staticmethod
+    def _resolve_tree(source: dict) -> (str, ErrorMsg):
+        """
+        :return: (sha of the template tree at the source ref, "") or ("", error message)
+        """
+        # '<ref>:' is the root tree of the ref
+        spec = f"{source.get('ref') or TemplateSources.DEFAULT_REF}:{source.get('path', '')}"
+        try:
+            result = subprocess.run(["git", "-C", source["repo"], "cat-file", "--batch-check"],
+                                    input=spec.encode() + b"\n",
+                                    stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        except OSError as e:
+            return "", str(e)
+        # Output is '<sha> <type> <size>' or '<spec> missing'
+        words = result.stdout.decode().split()
+        if result.returncode or len(words) != 3:
+            return "", f"can't find '{spec}' in git repository '{source['repo']}'"
+        if words[1] != "tree":
+            return "", f"'{spec}' is not a directory in git repository '{source['repo']}'"
+        return words[0], ""
+
+    @staticmethod
+    def _repo_path(repo: str) -> str:
+        if repo.startswith(TemplateSources.FILE_URL_PREFIX):
+            repo = repo[len(TemplateSources.FILE_URL_PREFIX):]
+        return os.path.abspath(os.path.expanduser(repo))
@@ -1,10 +1,211 @@
 """
+Create template from existing project
+"""
+import os
+import re
+from concurrent.futures import FIRST_COMPLETED
+from concurrent.futures import BrokenExecutor
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import wait
+from typing import Callable
+from typing import Union
 
+from templgen.generator import Generator
+from templgen.settings import Settings
 
-"""
+# Type aliases
+ErrorMsg = str
+StringOrNone = Union[str, None]
+
+# Replacements compiled once per worker process, see Templatizer._init_worker()
+_worker_state = {}
 
 
 class Templatizer:
+    """
+    Methods of this class do not raise exceptions, instead they return a tuple
+    (result, error); 'result' may be of any type and 'error' is
+    an empty string if success or error message otherwise.
+
+    Literal values found in file contents and in file/directory names of the
+    source tree are replaced with placeholders, e.g. every 'MyClass' with
+    '{{class_name}}'; original values become defaults in the template descriptor.
+    The source tree is processed as a stream: directories are listed one at a
+    time and each file is written out before the next one is read.
 
-    def __init__(self, **kwargs):
+    With several processes, the main process walks the tree and creates
+    directories, files are sent to a process pool in shards of SHARD_SIZE;
+    workers write templatized files themselves and send back only
+    substitution counts, which are merged into the report as shards complete.
+    Per-file counts are not kept: they are passed to the `on_file` callback
+    as files (or shards) complete.
+    """
+    # Directories that are never copied into templates
+    SKIP_DIR_NAMES = (".git", Settings.TEMPLGEN_DIR_NAME)
+    # Files that are never copied into templates
+    SKIP_FILE_NAMES = (Generator.MANIFEST_FILE_NAME,)
+    # Files per task sent to a worker process
+    SHARD_SIZE = 256
+    # Shards queued per worker process, limits memory used by the queue
+    SHARDS_PER_PROCESS = 2
+
+    def __init__(self, *, templgen=None, **kwargs):
         super().__init__(**kwargs)
+        self._templgen = templgen
+
+    def templatize(self, source_path: str, template_path: str,
+                   replacements: dict, processes: Union[int, None] = 1,
+                   on_file: Union[Callable[[str, int], None], None] = None) -> (dict, ErrorMsg):
+        """
+        Create template from source directory.
+        :param source_path: directory to create template from
+        :param template_path: template directory to be created; its name becomes the template name
+        :param replacements: {"literal value": "variable_name", ...}; longer literals take precedence
+        :param processes: number of worker processes, number of CPUs if None;
+                          1 means everything is done in the calling process
+        :param on_file: called with (source/rel/path, number of substitutions) for each file
+                        in the calling process, in order of completion
+        :return: ({"files": int, "substitutions": int}, "") or ({}, error message)
+        """
+        if not os.path.isdir(source_path):
+            return {}, f"source directory not exists: '{source_path}'"
+        if os.path.exists(template_path):
+            return {}, f"template directory already exists: '{template_path}'"
+        pattern = Templatizer.compile_replacements(replacements)
+        result = {"files": 0, "substitutions": 0}
+        processes = processes or os.cpu_count() or 1
+        try:
+            os.makedirs(template_path)
+            files = Templatizer._iter_files(pattern, replacements, source_path, template_path)
+            if processes == 1:
+                for src_path, rel_path, dst_path in files:
+                    count = Templatizer.templatize_file(pattern, replacements, src_path, dst_path)
+                    Templatizer._merge(result, [(rel_path, count)], on_file)
+            else:
+                Templatizer._templatize_in_pool(files, replacements, processes, result, on_file)
+            with open(Generator.template_file_path(template_path, Generator.TEMPLATE_DESC_FILE_EXTENSION), "w") as f:
+                for value, name in replacements.items():
+                    f.write(f"{name}={value}\n")
+        except (OSError, BrokenExecutor) as e:
+            return {}, str(e)
+        return result, ""
+
+    @staticmethod
+    def _iter_files(pattern, replacements: dict, source_path: str, template_path: str):
+        """
+        Create template directories while walking the source tree.
+        :return: iterator of (src_path, rel_path, dst_path) of files; iteration raises OSError
+        """
+        for src_path, rel_path, is_dir in Templatizer.iter_source(source_path):
+            dst_path = os.path.join(template_path, Templatizer.replace(pattern, replacements, rel_path)[0])
+            if is_dir:
+                os.mkdir(dst_path)
+            else:
+                yield src_path, rel_path, dst_path
+
+    @staticmethod
+    def _templatize_in_pool(files, replacements: dict, processes: int, result: dict, on_file) -> None:
+        """
+        Templatize files in worker processes shard by shard, merging counts into `result`
+        as shards complete; raises OSError
+        """
+        with ProcessPoolExecutor(max_workers=processes, initializer=Templatizer._init_worker,
+                                 initargs=(replacements,)) as executor:
+            pending = set()
+            shard = []
+            for file in files:
+                shard.append(file)
+                if len(shard) < Templatizer.SHARD_SIZE:
+                    continue
+                pending.add(executor.submit(Templatizer._templatize_shard, shard))
+                shard = []
+                if len(pending) >= processes * Templatizer.SHARDS_PER_PROCESS:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        Templatizer._merge(result, future.result(), on_file)
+            if shard:
+                pending.add(executor.submit(Templatizer._templatize_shard, shard))
+            for future in wait(pending)[0]:
+                Templatizer._merge(result, future.result(), on_file)
+
+    @staticmethod
+    def _init_worker(replacements: dict) -> None:
+        _worker_state["replacements"] = replacements
+        _worker_state["pattern"] = Templatizer.compile_replacements(replacements)
+
+    @staticmethod
+    def _templatize_shard(shard: list) -> list:
+        """
+        Runs in a worker process.
+        :param shard: [(src_path, rel_path, dst_path), ...]
+        :return: [(rel_path, number of replacements), ...]
+        """
+        pattern, replacements = _worker_state["pattern"], _worker_state["replacements"]
+        return [(rel_path, Templatizer.templatize_file(pattern, replacements, src_path, dst_path))
+                for src_path, rel_path, dst_path in shard]
+
+    @staticmethod
+    def _merge(result: dict, counts: list, on_file) -> None:
+        for rel_path, count in counts:
+            result["files"] += 1
+            result["substitutions"] += count
+            if on_file is not None:
+                on_file(rel_path, count)
+
+    @staticmethod
+    def iter_source(source_path: str):
+        """
+        Lazily walk source tree, directories come before their contents.
+        :return: iterator of (src_path, rel_path, is_dir); iteration raises OSError
+        """
+        stack = [""]
+        while stack:
+            rel_dir = stack.pop()
+            with os.scandir(os.path.join(source_path, rel_dir) if rel_dir else source_path) as it:
+                entries = sorted(it, key=lambda e: e.name)
+            for entry in entries:
+                rel_path = os.path.join(rel_dir, entry.name)
+                if entry.is_dir(follow_symlinks=False):
+                    if entry.name in Templatizer.SKIP_DIR_NAMES:
+                        continue
+                    yield entry.path, rel_path, True
+                    stack.append(rel_path)
+                elif entry.name not in Templatizer.SKIP_FILE_NAMES:
+                    yield entry.path, rel_path, False
+
+    @staticmethod
+    def compile_replacements(replacements: dict):
+        """
+        Single regular expression that matches any of the literals, longest first
+        """
+        literals = sorted((value for value in replacements if value), key=len, reverse=True)
+        if not literals:
+            return None
+        return re.compile("|".join(re.escape(literal) for literal in literals))
+
+    @staticmethod
+    def replace(pattern, replacements: dict, text: str) -> (str, int):
+        """
+        :return: (text with literals replaced by placeholders, number of replacements)
+        """
+        if pattern is None:
+            return text, 0
+        return pattern.subn(lambda match: "{{" + replacements[match.group(0)] + "}}", text)
+
+    @staticmethod
+    def templatize_file(pattern, replacements: dict, src_path: str, dst_path: str) -> int:
+        """
+        Write templatized copy of a file, binary files are copied as is; raises OSError.
+        :return: number of replacements
+        """
+        with open(src_path, "rb") as f:
+            data = f.read()
+        count = 0
+        try:
+            text, count = Templatizer.replace(pattern, replacements, data.decode("utf-8"))
+            data = text.encode("utf-8")
+        except UnicodeDecodeError:
+            pass
+        with open(dst_path, "wb") as f:
+            f.write(data)
+        return count
@@ -1,19 +1,55 @@
 """
 Root class
 """
-# from templgen.generator import Generator
+import os
+
+from iotanbo_py_utils import file_utils
+
+from templgen.durability import Durability
+from templgen.fingerprints import Fingerprints
+from templgen.generator import Generator
+from templgen.hooks import HookRunner
+from templgen.integrity import IntegrityChecker
 from templgen.settings import Settings
-# from templgen.templatizer import Templatizer
+from templgen.template_sources import TemplateSources
+from templgen.templatizer import Templatizer
 from templgen.user_manager import UserManager
+from templgen.variables import VariableResolver
 
 
 class Templgen:
+    """
+    Templgen may be embedded into a long running service: one instance can be
+    shared by many threads, nothing is printed and the process is never exited.
+    All paths are derived from `home_dir` and from project paths passed to methods
+    explicitly, so instances with different home dirs are independent.
+    """
 
-    def __init__(self, **kwargs):
+    def __init__(self, *, home_dir=None, log=None, durability=Durability.NONE, **kwargs):
+        """
+        :param home_dir: dir that contains the global '.templgen' dir, user home dir by default
+        :param log: callable that receives informational messages, e.g. `print`;
+                    messages are dropped if None
+        :param durability: how generated files and configs are made durable, see Durability
+        """
         super().__init__(**kwargs)
+        self.home_dir = os.path.abspath(home_dir or file_utils.get_user_home_dir())
+        self._log = log
+        self.durability = durability
         # Settings must be initialized first
         self.settings = Settings(templgen=self)
         self.user_manager = UserManager(templgen=self)
+        self.variable_resolver = VariableResolver(templgen=self)
+        self.generator = Generator(templgen=self)
+        self.templatizer = Templatizer(templgen=self)
+        self.fingerprints = Fingerprints(templgen=self)
+        self.template_sources = TemplateSources(templgen=self)
+        self.integrity = IntegrityChecker(templgen=self)
+        self.hooks = HookRunner(templgen=self)
+
+    def ensure_integrity(self, path=None):
+        return self.settings.ensure_integrity(path)
 
-    def ensure_integrity(self):
-        self.settings.ensure_integrity()
+    def log(self, message: str) -> None:
+        if self._log is not None:
+            self._log(message)
@@ -2,11 +2,15 @@
 
 """
 import configparser
+import csv
+import json
 import os
+import uuid
 from typing import Union
 
 from iotanbo_py_utils import file_utils
 
+from templgen.durability import Durability
 from templgen.settings import Settings
 
 # Type aliases
@@ -21,13 +25,15 @@ class UserManager:
         ("email", "", "GENERAL", "Email: "),
         ("site", "", "GENERAL", "Personal site: ")
     ]
+    USER_NAME_FIELD = "user_name"
+    # Lock file that is held in 'users' dir while users are added or deleted in bulk
+    USERS_LOCK_FILE_NAME = ".lock"
 
     def __init__(self, templgen, **kwargs):
         super().__init__(**kwargs)
         self._templgen = templgen
-        self.home_dir = file_utils.get_user_home_dir()
+        self.home_dir = self._templgen.home_dir
         self.global_templgen_dir = self._templgen.settings.global_templgen_dir
-        self.cfg_parser = configparser.ConfigParser(allow_no_value=True)
 
     # def ensure_integrity(self, path=None) -> (None, ErrorMsg):
     #     if not path:
@@ -64,10 +70,10 @@ class UserManager:
             if error:
                 return None, error
         else:
-            project_path = file_utils.get_user_home_dir()
+            project_path = self.home_dir
 
         # Check if user exists
-        if self.user_exists(user_name, project_path):
+        if self.user_exists(user_name, project_path, self.home_dir):
             # If exists, return with error
             return None, f"user '{user_name}' already exists"
 
@@ -77,25 +83,11 @@ class UserManager:
         else:
             user_config_dict = self._get_default_user_config(user_name)
 
-        # Create dir for user
-        user_dir = os.path.join(project_path, Settings.TEMPLGEN_DIR_NAME,
-                                Settings.TEMPLGEN_USERS_DIR_NAME, user_name)
-
-        error = file_utils.create_path_noexcept(user_dir)["error"]
-        if error:
-            return None, error
-
-        # Create templ_config dir
-        user_templ_config_dir = os.path.join(user_dir,
-                                             Settings.TEMPLGEN_USER_TEMPL_CONFIG_DIR_NAME)
-        error = file_utils.create_path_noexcept(user_templ_config_dir)["error"]
-        if error:
-            return None, error
-
-        # Write user config file
-        config_file = os.path.join(user_dir, Settings.TEMPLGEN_USER_CONFIG_FILE_NAME)
-        return Settings.update_config_file(self.cfg_parser, config_file, user_config_dict)
-        # self._update_user_config_file(config_file, user_config_dict)
+        # Created like a bulk of one user, under the users dir lock
+        user = {UserManager.USER_NAME_FIELD: user_name}
+        for section in user_config_dict.values():
+            user.update(section)
+        return self.add_users([user], local=local, project_path=project_path if local else None)
 
     def del_user(self, user_name: str, local=False,
                  project_path: StringOrNone = None,
@@ -114,10 +106,10 @@ class UserManager:
             if error:
                 return None, error
         else:
-            project_path = file_utils.get_user_home_dir()
+            project_path = self.home_dir
 
         # Check if user exists
-        if not self.user_exists(user_name, project_path):
+        if not self.user_exists(user_name, project_path, self.home_dir):
             # If exists, return with error
             return None, f"user '{user_name}' not exists"
 
@@ -131,13 +123,186 @@ class UserManager:
             confirm = input(prompt)
             if "yes" != confirm:
                 return None, "canceled"
-        # delete user folder
-        user_dir = os.path.join(project_path, Settings.TEMPLGEN_DIR_NAME,
-                                Settings.TEMPLGEN_USERS_DIR_NAME, user_name)
-        error = file_utils.remove_dir_noexcept(user_dir)["error"]
+        # Deleted like a bulk of one user, under the users dir lock
+        return self.del_users([user_name], local=local, project_path=project_path if local else None,
+                              confirmed=True)
+
+    def add_users(self, users: list, local=False,
+                  project_path: StringOrNone = None) -> (None, ErrorMsg):
+        """
+        Add (create) many users at once, either all of them or none.
+        All users are validated first, then created in a temporary dir under the lock
+        and moved into place; if anything fails, users created so far are removed.
+        :param users: list of dicts {"user_name": ..., "full_name": ..., "email": ..., "site": ...};
+                      missing config params get default values, unknown ones are ignored
+        :param local: if True, users will be added only to project scope
+        :param project_path: path to project directory or None if users to be added globally
+        :return: (None, ErrorMsg) - Error message if error, empty string otherwise
+        """
+        if local:
+            result, error = self._templgen.settings.ensure_integrity(project_path)
+            if error:
+                return None, error
+        else:
+            project_path = self.home_dir
+        users_dir = os.path.join(project_path, Settings.TEMPLGEN_DIR_NAME,
+                                 Settings.TEMPLGEN_USERS_DIR_NAME)
+        # Validate everything before touching the file system
+        existing = set(UserManager.list_users(project_path))
+        existing.update(UserManager.list_users(self.home_dir))
+        user_configs = {}
+        for user in users:
+            user_name = str(user.get(UserManager.USER_NAME_FIELD) or "").strip()
+            error = UserManager._validate_user_name(user_name)
+            if error:
+                return None, error
+            if user_name in existing or user_name in user_configs:
+                return None, f"user '{user_name}' already exists"
+            user_config = {}
+            for param, value, section, _ in UserManager.DEFAULT_USER_CONFIG:
+                # Missing values of short CSV rows and JSON nulls are None
+                if user.get(param) is not None:
+                    value = user[param]
+                user_config.setdefault(section, {})[param] = str(value)
+            user_configs[user_name] = user_config
+        if not user_configs:
+            return None, ""
+
+        _, error = UserManager._lock_users_dir(users_dir)
         if error:
             return None, error
+        staging_dir = os.path.join(users_dir, f".add-{uuid.uuid4().hex}")
+        added = []
+        try:
+            for user_name, user_config in user_configs.items():
+                user_dir = os.path.join(staging_dir, user_name)
+                os.makedirs(os.path.join(user_dir, Settings.TEMPLGEN_USER_TEMPL_CONFIG_DIR_NAME))
+                UserManager._write_user_config(os.path.join(user_dir, Settings.TEMPLGEN_USER_CONFIG_FILE_NAME),
+                                               user_config, self._templgen.durability)
+            for user_name in user_configs:
+                os.rename(os.path.join(staging_dir, user_name), os.path.join(users_dir, user_name))
+                added.append(user_name)
+            if self._templgen.durability != Durability.NONE:
+                Durability.sync_dir(users_dir)
+        except Exception as e:
+            for user_name in added:
+                file_utils.remove_dir_noexcept(os.path.join(users_dir, user_name))
+            return None, str(e)
+        finally:
+            file_utils.remove_dir_noexcept(staging_dir)
+            UserManager._unlock_users_dir(users_dir)
+        return None, ""
 
+    def del_users(self, user_names: list, local=False,
+                  project_path: StringOrNone = None,
+                  confirmed=False) -> (None, ErrorMsg):
+        """
+        Delete many users at once, either all of them or none.
+        :param user_names: names of users to be deleted
+        :param local: if True, users will be deleted only from project scope
+        :param project_path: path to project directory or None if users have to be deleted globally
+        :param confirmed: if False, one interactive confirmation will be performed for all users
+        :return: (None, ErrorMsg) - Error message if any, empty string if success
+        """
+        if local:
+            result, error = self._templgen.settings.ensure_integrity(project_path)
+            if error:
+                return None, error
+        else:
+            project_path = self.home_dir
+        users_dir = os.path.join(project_path, Settings.TEMPLGEN_DIR_NAME,
+                                 Settings.TEMPLGEN_USERS_DIR_NAME)
+        existing = set(UserManager.list_users(project_path))
+        for user_name in user_names:
+            if user_name not in existing:
+                return None, f"user '{user_name}' not exists"
+        if not user_names:
+            return None, ""
+        if not confirmed:
+            scope = f"locally for '{project_path}'" if local else "globally"
+            confirm = input(f"Do you confirm deleting {len(user_names)} users {scope} (yes/no)?")
+            if "yes" != confirm:
+                return None, "canceled"
+
+        _, error = UserManager._lock_users_dir(users_dir)
+        if error:
+            return None, error
+        # Move users away first, so that the operation can be rolled back
+        trash_dir = os.path.join(users_dir, f".del-{uuid.uuid4().hex}")
+        moved = []
+        try:
+            os.makedirs(trash_dir)
+            for user_name in dict.fromkeys(user_names):
+                os.rename(os.path.join(users_dir, user_name), os.path.join(trash_dir, user_name))
+                moved.append(user_name)
+        except Exception as e:
+            for user_name in moved:
+                os.rename(os.path.join(trash_dir, user_name), os.path.join(users_dir, user_name))
+            file_utils.remove_dir_noexcept(trash_dir)
+            UserManager._unlock_users_dir(users_dir)
+            return None, str(e)
+        error = file_utils.remove_dir_noexcept(trash_dir)["error"]
+        UserManager._unlock_users_dir(users_dir)
+        return None, error
+
+    def export_users(self, project_path: StringOrNone = None) -> (list, ErrorMsg):
+        """
+        Read configs of all users for the specified path
+        :param project_path: project for which users will be exported;
+                             if None, global users will be exported;
+        :return: ([{"user_name": ..., "full_name": ..., ...}, ...], "") or ([], error message)
+        """
+        if not project_path:
+            project_path = self.home_dir
+        users_dir = os.path.join(project_path, Settings.TEMPLGEN_DIR_NAME,
+                                 Settings.TEMPLGEN_USERS_DIR_NAME)
+        result = []
+        for user_name in sorted(UserManager.list_users(project_path)):
+            config_file = os.path.join(users_dir, user_name, Settings.TEMPLGEN_USER_CONFIG_FILE_NAME)
+            user_config, error = Settings.read_settings_from_file(configparser.ConfigParser(allow_no_value=True),
+                                                                  config_file)
+            if error:
+                return [], error
+            user = {UserManager.USER_NAME_FIELD: user_name}
+            for param, value, section, _ in UserManager.DEFAULT_USER_CONFIG:
+                user[param] = user_config.get(section, {}).get(param, value) or ""
+            result.append(user)
+        return result, ""
+
+    @staticmethod
+    def read_users_file(path: str) -> (list, ErrorMsg):
+        """
+        Read users from a CSV file with a header line or from a JSON Lines file
+        ('.jsonl' extension), e.g.:
+            user_name,full_name,email,site
+            jdoe,John Doe,jdoe@example.com,
+        :return: ([{"user_name": ..., ...}, ...], "") or ([], error message)
+        """
+        try:
+            with open(path, "r", newline="") as f:
+                if path.endswith(".jsonl"):
+                    return [json.loads(line) for line in f if line.strip()], ""
+                return list(csv.DictReader(f)), ""
+        except Exception as e:
+            return [], str(e)
+
+    @staticmethod
+    def write_users_file(path: str, users: list) -> (None, ErrorMsg):
+        """
+        Write users to a CSV file or to a JSON Lines file ('.jsonl' extension)
+        """
+        fields = [UserManager.USER_NAME_FIELD] + [param for param, _, _, _ in UserManager.DEFAULT_USER_CONFIG]
+        try:
+            with open(path, "w", newline="") as f:
+                if path.endswith(".jsonl"):
+                    for user in users:
+                        f.write(json.dumps(user) + "\n")
+                else:
+                    writer = csv.DictWriter(f, fieldnames=fields, extrasaction="ignore")
+                    writer.writeheader()
+                    writer.writerows(users)
+        except Exception as e:
+            return None, str(e)
         return None, ""
 
     @staticmethod
@@ -161,7 +326,8 @@ class UserManager:
         if error:
             return []
 
-        return file_utils.get_subdirs(users_dir)["subdirs"]
+        # Hidden dirs are temporary dirs of bulk operations
+        return [subdir for subdir in file_utils.get_subdirs(users_dir)["subdirs"] if not subdir.startswith(".")]
 
     def edit_user(self, user_name, project_path=None) -> (None, ErrorMsg):
         settings = self._templgen.settings
@@ -169,8 +335,8 @@ class UserManager:
         if not user_name:
             user_name = self._templgen.settings.get("current_user")
         if not project_path:
-            project_path = file_utils.get_user_home_dir()
-        if not self.user_exists(user_name, project_path):
+            project_path = self.home_dir
+        if not self.user_exists(user_name, project_path, self.home_dir):
             return None, "user not exists"
         text_editor, error = self._templgen.settings.get("text_editor")
         if error:
@@ -199,13 +365,13 @@ class UserManager:
         # is_local = True
         # Ensure that project_path is valid
         if not project_path:
-            project_path = file_utils.get_user_home_dir()
+            project_path = self.home_dir
             # is_local = False
         # Read local settings for the path
         settings.read_settings_for_path(project_path)
 
         # Check if user exists for the project path:
-        if not UserManager.user_exists(user_name, project_path):
+        if not UserManager.user_exists(user_name, project_path, self.home_dir):
             return None, "user not found"
 
         # Write new user to the settings
@@ -254,12 +420,12 @@ class UserManager:
     #     return result
 
     @staticmethod
-    def user_exists(user_name, project_path) -> bool:
+    def user_exists(user_name, project_path, home_dir: StringOrNone = None) -> bool:
         """
         Check if user exists for the project ( either locally or globally)
         """
         return (UserManager.user_exists_locally(user_name, project_path) or
-                UserManager.user_exists_globally(user_name))
+                UserManager.user_exists_globally(user_name, home_dir))
 
     @staticmethod
     def user_exists_locally(user_name, project_path) -> bool:
@@ -276,17 +442,51 @@ class UserManager:
         return False
 
     @staticmethod
-    def user_exists_globally(user_name) -> bool:
+    def user_exists_globally(user_name, home_dir: StringOrNone = None) -> bool:
         """
         Check if user exists globally
+        :param home_dir: dir that contains the global '.templgen' dir, user home dir by default
         """
-        user_dir = os.path.join(file_utils.get_user_home_dir(), Settings.TEMPLGEN_DIR_NAME,
+        user_dir = os.path.join(home_dir or file_utils.get_user_home_dir(), Settings.TEMPLGEN_DIR_NAME,
                                 Settings.TEMPLGEN_USERS_DIR_NAME, user_name)
         # print(f"Debug: user_dir: {user_dir}")
         if file_utils.dir_exists(user_dir):
             return True
         return False
 
+    @staticmethod
+    def _validate_user_name(user_name: str) -> ErrorMsg:
+        if not user_name:
+            return "user name not specified"
+        if user_name.startswith(".") or os.sep in user_name or (os.altsep and os.altsep in user_name):
+            return f"invalid user name '{user_name}'"
+        return ""
+
+    @staticmethod
+    def _write_user_config(path: str, user_config: dict, durability: str = Durability.NONE) -> None:
+        config_parser = configparser.ConfigParser(allow_no_value=True)
+        config_parser.read_dict(user_config)
+        Settings.write_config(config_parser, path, durability)
+
+    @staticmethod
+    def _lock_users_dir(users_dir: str) -> (None, ErrorMsg):
+        lock_file = os.path.join(users_dir, UserManager.USERS_LOCK_FILE_NAME)
+        try:
+            os.makedirs(users_dir, exist_ok=True)
+            os.close(os.open(lock_file, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+        except FileExistsError:
+            return None, f"users are being modified by another process; remove '{lock_file}' if it is stale"
+        except OSError as e:
+            return None, str(e)
+        return None, ""
+
+    @staticmethod
+    def _unlock_users_dir(users_dir: str) -> None:
+        try:
+            os.remove(os.path.join(users_dir, UserManager.USERS_LOCK_FILE_NAME))
+        except OSError:
+            pass
+
     @staticmethod
     def _get_default_user_config(_) -> dict:  # user_name
         result = {}
@@ -294,7 +494,7 @@ class UserManager:
             if section not in result:
                 result[section] = {}
             result[section][param] = value
-            return result
+        return result
 
     @staticmethod
     def _get_interactive_user_config(_) -> dict:  # user_name
@@ -0,0 +1,120 @@
+"""
+Template variables from settings, user config, template defaults and command line
+"""
+import os
+from configparser import ConfigParser
+from typing import Union
+
+from iotanbo_py_utils import file_utils
+
+from templgen.filters import FilteredVariables
+from templgen.filters import Filters
+from templgen.settings import Settings
+
+# Type aliases
+ErrorMsg = str
+StringOrNone = Union[str, None]
+
+
+class VariableResolver:
+    """
+    Methods of this class do not raise exceptions, instead they return a tuple
+    (result, error); 'result' may be of any type and 'error' is
+    an empty string if success or error message otherwise.
+
+    Variables are collected from (lowest precedence first):
+      - settings, section [GENERAL] (`current_user`, `text_editor`, ...);
+      - config of the current user (`full_name`, `email`, `site`, ...);
+      - template defaults;
+      - command line.
+    A value may refer to other variables, e.g. `author={{full_name}} <{{email}}>`
+    or `package={{ name | snake }}`; such derived values are expanded once by `resolve()`, so rendering only
+    does dictionary lookups. Filtered values computed while resolving are kept in the result
+    (see FilteredVariables) and reused by rendering.
+    """
+    REFERENCE_RE = Filters.PLACEHOLDER_RE
+
+    def __init__(self, *, templgen, **kwargs):
+        super().__init__(**kwargs)
+        self._templgen = templgen
+
+    def get_context_variables(self, project_path: StringOrNone = None) -> (dict, ErrorMsg):
+        """
+        Variables from settings and from the current user config for the project
+        :param project_path: project dir, local settings and users take precedence over global ones;
+                             if None, only global settings are used
+        :return: (dict, "") or ({}, error message)
+        """
+        settings = self._templgen.settings
+        _, error = settings.read_settings_for_path(project_path or self._templgen.home_dir)
+        if error:
+            return {}, error
+        general, _ = settings.get_section("GENERAL")
+        result = {key: value for key, value in general.items() if not key.endswith("*")}
+        user_name = result.get("current_user", "")
+        if not user_name:
+            return result, ""
+        for base_path in (project_path, self._templgen.home_dir):
+            if not base_path:
+                continue
+            user_config_file = os.path.join(base_path, Settings.TEMPLGEN_DIR_NAME,
+                                            Settings.TEMPLGEN_USERS_DIR_NAME, user_name,
+                                            Settings.TEMPLGEN_USER_CONFIG_FILE_NAME)
+            if file_utils.file_exists(user_config_file):
+                user_config, error = Settings.read_settings_from_file(ConfigParser(allow_no_value=True),
+                                                                      user_config_file)
+                if error:
+                    return {}, error
+                for section in user_config.values():
+                    result.update((key, value) for key, value in section.items() if value is not None)
+                break
+        return result, ""
+
+    @staticmethod
+    def resolve(variables: dict) -> (dict, ErrorMsg):
+        """
+        Expand references to other variables in values.
+        Each variable is evaluated exactly once, in dependency order;
+        references to unknown variables are left as is.
+        :param variables: {"name": "value", ...}
+        :return: (FilteredVariables of expanded values, "") or ({}, error message) if references are circular
+        """
+        # Dependency graph: variable -> names of variables its value refers to
+        graph = {}
+        for name, value in variables.items():
+            value = str(value)
+            graph[name] = [match.group(1) for match in VariableResolver.REFERENCE_RE.finditer(value)
+                           if match.group(1) in variables]
+        resolved = FilteredVariables()
+        for root in graph:
+            if root in resolved:
+                continue
+            # Iterative depth-first traversal, `path` holds the chain being evaluated
+            path = [root]
+            in_path = {root}
+            pending = [iter(graph[root])]
+            while pending:
+                dependency = next(pending[-1], None)
+                if dependency is None:
+                    name = path.pop()
+                    in_path.discard(name)
+                    pending.pop()
+                    resolved[name] = VariableResolver._expand(str(variables[name]), resolved)
+                elif dependency in in_path:
+                    cycle = path[path.index(dependency):] + [dependency]
+                    return {}, f"circular variable reference: {' -> '.join(cycle)}"
+                elif dependency not in resolved:
+                    path.append(dependency)
+                    in_path.add(dependency)
+                    pending.append(iter(graph[dependency]))
+        return resolved, ""
+
+    @staticmethod
+    def _expand(value: str, resolved: FilteredVariables) -> str:
+        if "{{" not in value:
+            return value
+
+        def replace(match):
+            value = Filters.lookup(resolved, Filters.placeholder_key(match))
+            return match.group(0) if value is None else value
+        return VariableResolver.REFERENCE_RE.sub(replace, value)
@@ -0,0 +1,197 @@
+"""
+Watch files and directories for changes
+"""
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import sys
+import time
+from typing import Union
+
+# Type aliases
+ErrorMsg = str
+FloatOrNone = Union[float, None]
+
+
+class Watcher:
+    """
+    Reports changed files under watched directories (recursively) and changed
+    watched files. Uses inotify on Linux and falls back to polling
+    modification times if inotify is not available.
+    """
+    POLL_INTERVAL = 1.0
+    # Time to wait for more events after the first one, editors often write files in several steps
+    SETTLE_TIME = 0.1
+
+    # inotify(7) constants
+    _IN_MODIFY = 0x00000002
+    _IN_ATTRIB = 0x00000004
+    _IN_CLOSE_WRITE = 0x00000008
+    _IN_MOVED_FROM = 0x00000040
+    _IN_MOVED_TO = 0x00000080
+    _IN_CREATE = 0x00000100
+    _IN_DELETE = 0x00000200
+    _IN_Q_OVERFLOW = 0x00004000
+    _IN_ISDIR = 0x40000000
+    _IN_MASK = (_IN_MODIFY | _IN_ATTRIB | _IN_CLOSE_WRITE | _IN_MOVED_FROM |
+                _IN_MOVED_TO | _IN_CREATE | _IN_DELETE)
+    _EVENT_HEADER = struct.Struct("iIII")
+
+    def __init__(self, paths, use_inotify=True, **kwargs):
+        """
+        :param paths: directories to be watched recursively and files to be watched
+        :param use_inotify: if False, polling is used even if inotify is available
+        """
+        super().__init__(**kwargs)
+        self.dirs = [os.path.abspath(path) for path in paths if os.path.isdir(path)]
+        self.files = {os.path.abspath(path) for path in paths if not os.path.isdir(path)}
+        self._inotify_fd = -1
+        self._watch_descriptors = {}
+        self._libc = None
+        self._snapshot = {}
+        if use_inotify and sys.platform.startswith("linux"):
+            self._init_inotify()
+        if self._inotify_fd < 0:
+            self._snapshot = self._take_snapshot()
+
+    @property
+    def uses_inotify(self) -> bool:
+        return self._inotify_fd >= 0
+
+    def wait(self, timeout: FloatOrNone = None) -> set:
+        """
+        Block until something changes or timeout expires.
+        :param timeout: seconds, None - wait forever
+        :return: set of absolute paths of changed files (empty on timeout)
+        """
+        if self.uses_inotify:
+            return self._wait_inotify(timeout)
+        return self._wait_polling(timeout)
+
+    def close(self) -> None:
+        if self._inotify_fd >= 0:
+            os.close(self._inotify_fd)
+            self._inotify_fd = -1
+
+    def _is_watched(self, path) -> bool:
+        if path in self.files:
+            return True
+        return any(path.startswith(directory + os.sep) for directory in self.dirs)
+
+    # *** Polling ***
+
+    def _take_snapshot(self) -> dict:
+        result = {}
+        for path in self.files:
+            try:
+                st = os.stat(path)
+                result[path] = (st.st_mtime_ns, st.st_size)
+            except OSError:
+                pass
+        stack = list(self.dirs)
+        while stack:
+            try:
+                with os.scandir(stack.pop()) as it:
+                    for entry in it:
+                        if entry.is_dir(follow_symlinks=False):
+                            stack.append(entry.path)
+                        else:
+                            st = entry.stat()
+                            result[entry.path] = (st.st_mtime_ns, st.st_size)
+            except OSError:
+                continue
+        return result
+
+    def _wait_polling(self, timeout: FloatOrNone) -> set:
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            snapshot = self._take_snapshot()
+            changed = {path for path in snapshot.keys() | self._snapshot.keys()
+                       if snapshot.get(path) != self._snapshot.get(path)}
+            self._snapshot = snapshot
+            if changed:
+                return changed
+            if deadline is not None and time.monotonic() >= deadline:
+                return set()
+            delay = Watcher.POLL_INTERVAL
+            if deadline is not None:
+                delay = min(delay, max(deadline - time.monotonic(), 0))
+            time.sleep(delay)
+
+    # *** inotify ***
+
+    def _init_inotify(self) -> None:
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+            fd = libc.inotify_init1(os.O_CLOEXEC | os.O_NONBLOCK)
+        except (OSError, AttributeError):
+            return
+        if fd < 0:
+            return
+        self._libc = libc
+        self._inotify_fd = fd
+        for path in self.files:
+            self._add_watch(os.path.dirname(path))
+        for directory in self.dirs:
+            self._add_watch_recursively(directory)
+
+    def _add_watch(self, path) -> None:
+        wd = self._libc.inotify_add_watch(self._inotify_fd, os.fsencode(path), Watcher._IN_MASK)
+        if wd >= 0:
+            self._watch_descriptors[wd] = path
+
+    def _add_watch_recursively(self, path) -> None:
+        for dir_path, _, _ in os.walk(path):
+            self._add_watch(dir_path)
+
+    def _read_inotify_events(self) -> (set, bool):
+        """
+        :return: (changed paths, True if event queue overflowed)
+        """
+        changed = set()
+        overflow = False
+        try:
+            data = os.read(self._inotify_fd, 64 * 1024)
+        except BlockingIOError:
+            return changed, overflow
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, name_len = Watcher._EVENT_HEADER.unpack_from(data, offset)
+            offset += Watcher._EVENT_HEADER.size
+            name = os.fsdecode(data[offset:offset + name_len].rstrip(b"\0"))
+            offset += name_len
+            if mask & Watcher._IN_Q_OVERFLOW:
+                overflow = True
+                continue
+            directory = self._watch_descriptors.get(wd)
+            if directory is None:
+                continue
+            path = os.path.join(directory, name) if name else directory
+            if mask & Watcher._IN_ISDIR:
+                if mask & (Watcher._IN_CREATE | Watcher._IN_MOVED_TO) and self._is_watched(path):
+                    self._add_watch_recursively(path)
+                    for dir_path, _, file_names in os.walk(path):
+                        changed.update(os.path.join(dir_path, file_name) for file_name in file_names)
+            if self._is_watched(path):
+                changed.add(path)
+        return changed, overflow
+
+    def _wait_inotify(self, timeout: FloatOrNone) -> set:
+        changed = set()
+        while True:
+            ready, _, _ = select.select([self._inotify_fd], [], [], timeout)
+            if not ready:
+                return changed
+            events, overflow = self._read_inotify_events()
+            if overflow:
+                # Some events were lost, report everything that is watched
+                events = set(self.files)
+                for directory in self.dirs:
+                    for dir_path, _, file_names in os.walk(directory):
+                        events.update(os.path.join(dir_path, file_name) for file_name in file_names)
+            changed.update(events)
+            if changed:
+                # Collect events that follow shortly
+                timeout = Watcher.SETTLE_TIME
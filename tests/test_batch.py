@@ -0,0 +1,55 @@
+import json
+import os
+
+from click.testing import CliRunner
+
+from templgen.batch import BatchRunner
+from templgen.cli import main
+from templgen.templgen import Templgen
+
+
+def test_batch_runs_commands_in_one_process(tmp_path, monkeypatch):
+    monkeypatch.setenv("HOME", str(tmp_path))
+    monkeypatch.chdir(str(tmp_path))
+    template = os.path.join(str(tmp_path), "tpl", "app")
+    os.makedirs(template)
+    with open(os.path.join(template, "app.desc"), "w") as f:
+        f.write("name=demo\n")
+    with open(os.path.join(template, "{{name}}.txt"), "w") as f:
+        f.write("{{name}} by {{full_name}}\n")
+    commands = [
+        {"id": 1, "cmd": "adduser", "user_name": "john", "config": {"full_name": "John Doe"}},
+        {"id": 2, "cmd": "swuser", "user_name": "john"},
+        {"id": 3, "cmd": "set", "values": {"text_editor": "vim"}},
+        {"id": 4, "cmd": "get", "names": ["current_user", "text_editor"]},
+        {"id": 5, "cmd": "generate", "template": template, "target": "out", "variables": {"name": "app"}},
+        {"id": 6, "cmd": "swuser", "user_name": "nobody"},
+        {"id": 7, "cmd": "frobnicate"},
+    ]
+    stdin = "\n".join(json.dumps(command) for command in commands) + "\nnot json\n"
+    result = CliRunner().invoke(main, ["batch"], input=stdin)
+    assert result.exit_code == 0
+    outputs = [json.loads(line) for line in result.stdout.splitlines() if line.startswith("{")]
+    assert [output.get("id") for output in outputs] == [1, 2, 3, 4, 5, 6, 7, None]
+    assert [output["ok"] for output in outputs] == [True] * 5 + [False] * 3
+    assert outputs[3]["result"] == {"current_user": "john", "text_editor": "vim"}
+    assert outputs[6]["error"].startswith("unknown command 'frobnicate'")
+    with open(os.path.join(str(tmp_path), "out", "app.txt")) as f:
+        assert f.read() == "app by John Doe\n"
+
+
+def test_batch_resolves_relative_templates_against_its_cwd(tmp_path, monkeypatch):
+    monkeypatch.setenv("HOME", str(tmp_path))
+    work_dir = os.path.join(str(tmp_path), "work")
+    template = os.path.join(work_dir, "tpl", "app")
+    os.makedirs(template)
+    with open(os.path.join(template, "a.txt"), "w") as f:
+        f.write("a\n")
+    # Process cwd has no 'tpl' dir
+    monkeypatch.chdir(str(tmp_path))
+    tg = Templgen()
+    tg.ensure_integrity()
+    runner = BatchRunner(templgen=tg, cwd=work_dir)
+    _, error = runner.execute({"cmd": "generate", "template": "tpl/app", "target": "out"})
+    assert not error
+    assert os.path.isfile(os.path.join(work_dir, "out", "a.txt"))
@@ -0,0 +1,160 @@
+import ctypes
+import os
+
+import pytest
+
+from templgen.durability import Durability
+from templgen.generator import Generator
+from templgen.templgen import Templgen
+
+
+def _make_template(root):
+    template = os.path.join(root, "app")
+    os.makedirs(os.path.join(template, "src"))
+    with open(os.path.join(template, "app.desc"), "w") as f:
+        f.write("name=demo\n")
+    for i in range(5):
+        with open(os.path.join(template, "src", f"f{i}.txt"), "w") as f:
+            f.write("{{name}}\n" * i)
+    return template
+
+
+def test_generation_in_every_durability_mode(tmp_path, monkeypatch):
+    template = _make_template(str(tmp_path))
+    calls = {"syncfs": 0, "fsync": 0}
+    real_fsync = os.fsync
+
+    def fsync(fd):
+        calls["fsync"] += 1
+        real_fsync(fd)
+
+    monkeypatch.setattr(Durability, "sync_filesystem",
+                        staticmethod(lambda path: calls.__setitem__("syncfs", calls["syncfs"] + 1)))
+    monkeypatch.setattr(os, "fsync", fsync)
+    outputs = {}
+    for mode in Durability.MODES:
+        target = os.path.join(str(tmp_path), mode)
+        calls.update(syncfs=0, fsync=0)
+        _, error = Generator(durability=mode).generate(template, target, {"name": "x"})
+        assert not error
+        outputs[mode] = sorted(os.listdir(os.path.join(target, "src")))
+        assert calls["syncfs"] == (1 if mode == Durability.BATCH else 0)
+        # Strict mode: every file, then target and 'src' dirs
+        assert calls["fsync"] == (5 + 2 if mode == Durability.STRICT else 0)
+    assert outputs["none"] == outputs["batch"] == outputs["strict"] == [f"f{i}.txt" for i in range(5)]
+
+    # Existing files are replaced atomically in strict mode
+    target = os.path.join(str(tmp_path), "strict")
+    old_inode = os.stat(os.path.join(target, "src", "f1.txt")).st_ino
+    _, error = Generator(durability="strict").generate(template, target, {"name": "y"})
+    assert not error
+    with open(os.path.join(target, "src", "f1.txt")) as f:
+        assert f.read() == "y\n"
+    assert os.stat(os.path.join(target, "src", "f1.txt")).st_ino != old_inode
+
+    _, error = Generator(durability="paranoid").generate(template, target)
+    assert error.startswith("unknown durability mode 'paranoid'")
+
+
+def test_config_writes_follow_templgen_durability(tmp_path):
+    tg = Templgen(home_dir=str(tmp_path), durability=Durability.STRICT)
+    assert tg.ensure_integrity() == (None, "")
+    _, error = tg.user_manager.add_users([{"user_name": "bob", "email": "bob@example.com"}])
+    assert not error
+    tg.settings.read_settings_for_path(None)
+    assert tg.settings.set("current_user", "bob") == (None, "")
+    leftovers = [name for _, _, names in os.walk(str(tmp_path)) for name in names
+                 if name.endswith(Durability.TMP_SUFFIX)]
+    assert leftovers == []
+    tg.settings.read_settings_for_path(None)
+    assert tg.settings.get("current_user") == ("bob", "")
+    assert tg.user_manager.export_users()[0][0]["email"] == "bob@example.com"
+
+
+def test_repairs_and_sources_follow_templgen_durability(tmp_path, monkeypatch):
+    tg = Templgen(home_dir=str(tmp_path), durability=Durability.STRICT)
+    assert tg.ensure_integrity() == (None, "")
+    templgen_dir = os.path.join(str(tmp_path), ".templgen")
+    os.remove(os.path.join(templgen_dir, "main.cfg"))
+    with open(os.path.join(templgen_dir, "sources.cfg"), "w") as f:
+        f.write("[app]\nrepo = /nowhere\nref = HEAD\npath =\n")
+    writes = []
+    real_write_config = Durability.write_config
+
+    def write_config(path, text, mode):
+        writes.append((os.path.basename(path), mode))
+        real_write_config(path, text, mode)
+
+    monkeypatch.setattr(Durability, "write_config", staticmethod(write_config))
+    problems, error = tg.integrity.validate(repair=True)
+    assert not error
+    assert problems and all(repaired for _, repaired in problems)
+    assert tg.template_sources.del_source("app") == (None, "")
+    assert writes == [("main.cfg", Durability.STRICT), ("sources.cfg", Durability.STRICT)]
+
+
+@pytest.mark.skipif(os.open not in os.supports_dir_fd, reason="no dir_fd support")
+def test_files_are_written_relative_to_dir_fds(tmp_path, monkeypatch):
+    template = _make_template(str(tmp_path))
+    calls = []
+    real_write_file = Durability.write_file
+
+    def write_file(path, data, mode, dir_fd=None, exec_bits=0):
+        calls.append((path, dir_fd))
+        real_write_file(path, data, mode, dir_fd, exec_bits)
+
+    monkeypatch.setattr(Durability, "write_file", staticmethod(write_file))
+    for mode in Durability.MODES:
+        del calls[:]
+        _, error = Generator(durability=mode).generate(template, os.path.join(str(tmp_path), mode))
+        assert not error
+        assert len(calls) == 5
+        assert all(dir_fd is not None and os.sep not in path for path, dir_fd in calls)
+
+
+def test_batch_mode_without_file_system_sync(tmp_path, monkeypatch):
+    # As on Windows: no libc to look 'syncfs' up in, no os.sync(), directories can't be fsync'ed
+    def cdll(name, **kwargs):
+        raise TypeError("expected str, bytes or os.PathLike object, not NoneType")
+
+    monkeypatch.setattr(ctypes, "CDLL", cdll)
+    assert Durability._load_syncfs() is None
+    monkeypatch.setattr(Durability, "_get_syncfs", staticmethod(lambda: None))
+    monkeypatch.delattr(os, "sync", raising=False)
+    monkeypatch.setattr(Durability, "SYNC_DIRS", False)
+    assert not Durability.can_sync_filesystem()
+    template = _make_template(str(tmp_path))
+    fsynced = []
+    real_fsync = os.fsync
+    monkeypatch.setattr(os, "fsync", lambda fd: fsynced.append(fd) or real_fsync(fd))
+
+    _, error = Generator(durability=Durability.BATCH).generate(template, os.path.join(str(tmp_path), "out"))
+    assert not error
+    # Every file instead of the file system
+    assert len(fsynced) == 5
+    del fsynced[:]
+    tg = Templgen(home_dir=str(tmp_path), durability=Durability.BATCH)
+    assert tg.ensure_integrity() == (None, "")
+    _, error = tg.user_manager.add_users([{"user_name": "bob"}])
+    assert not error
+    assert fsynced
+
+
+@pytest.mark.skipif(not Durability.SET_EXEC_BITS, reason="no executable bits")
+def test_executable_template_files_stay_executable(tmp_path):
+    template = _make_template(str(tmp_path))
+    script = os.path.join(template, "run.sh")
+    with open(script, "w") as f:
+        f.write("#!/bin/sh\necho {{name}}\n")
+    os.chmod(script, 0o755)
+    for mode in Durability.MODES:
+        target = os.path.join(str(tmp_path), mode)
+        os.makedirs(target)
+        # Existing output without the executable bit gets it
+        with open(os.path.join(target, "run.sh"), "w") as f:
+            f.write("old\n")
+        os.chmod(os.path.join(target, "run.sh"), 0o644)
+        _, error = Generator(durability=mode).generate(template, target, {"name": "x"})
+        assert not error
+        assert os.stat(os.path.join(target, "run.sh")).st_mode & 0o100
+        assert not os.stat(os.path.join(target, "src", "f1.txt")).st_mode & 0o111
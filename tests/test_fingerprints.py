@@ -0,0 +1,39 @@
+import os
+
+from templgen.templgen import Templgen
+
+
+def test_verify_detects_changes_and_skips_unchanged_files(tmp_path, monkeypatch):
+    monkeypatch.setenv("HOME", str(tmp_path))
+    tg = Templgen()
+    tg.ensure_integrity()
+    template_dir = os.path.join(tg.settings.global_templgen_dir, "templates", "cpp", "cls")
+    os.makedirs(template_dir)
+    with open(os.path.join(template_dir, "a.h"), "w") as f:
+        f.write("a")
+    _, error = tg.fingerprints.verify()
+    assert error
+    report, error = tg.fingerprints.verify(update=True)
+    assert not error
+    assert report["added"] == ["main.cfg", "templates/cpp/cls/a.h"]
+
+    hashed = []
+    original_hash_file = tg.fingerprints.hash_file
+
+    def hash_file(path):
+        hashed.append(path)
+        return original_hash_file(path)
+
+    monkeypatch.setattr(tg.fingerprints, "hash_file", hash_file)
+    report, error = tg.fingerprints.verify("cls")
+    assert not error
+    assert report == {"modified": [], "added": [], "missing": [], "unchanged": 1}
+    assert hashed == []
+
+    with open(os.path.join(template_dir, "a.h"), "w") as f:
+        f.write("b")
+    os.utime(os.path.join(template_dir, "a.h"), ns=(0, 0))
+    report, error = tg.fingerprints.verify("cls")
+    assert not error
+    assert report["modified"] == ["templates/cpp/cls/a.h"]
+    assert hashed == [os.path.join(template_dir, "a.h")]
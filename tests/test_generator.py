@@ -0,0 +1,302 @@
+import io
+import os
+import tracemalloc
+from datetime import date
+
+from templgen.filters import FILTERS
+from templgen.filters import Filters
+from templgen.generator import CompiledTemplate
+from templgen.generator import Generator
+
+
+def _write(path, contents=""):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        f.write(contents)
+
+
+def _make_template(root):
+    template = os.path.join(root, "service")
+    _write(os.path.join(template, "service.desc"), "name=demo\nuse_docker=no\nuse_ci=yes\n")
+    _write(os.path.join(template, "service.rules"), "ci = use_ci\nlegacy = not use_ci\n")
+    _write(os.path.join(template, "{{name}}.txt"), "Project {{ name }}\n")
+    _write(os.path.join(template, "{% if use_docker %}docker", "Dockerfile"), "FROM {{name}}\n")
+    _write(os.path.join(template, "ci", "pipeline.yml"), "name: {{name}}\n")
+    _write(os.path.join(template, "legacy", "old.txt"), "old\n")
+    return template
+
+
+def test_generate_renders_names_and_contents(tmp_path):
+    template = _make_template(str(tmp_path))
+    target = os.path.join(str(tmp_path), "out")
+    _, error = Generator().generate(template, target, {"name": "app"})
+    assert not error
+    with open(os.path.join(target, "app.txt")) as f:
+        assert f.read() == "Project app\n"
+    assert os.path.isfile(os.path.join(target, "ci", "pipeline.yml"))
+    assert not os.path.exists(os.path.join(target, "legacy"))
+    assert not os.path.exists(os.path.join(target, "docker"))
+    assert not os.path.exists(os.path.join(target, "service.desc"))
+
+
+def test_conditional_marker_enables_subtree(tmp_path):
+    template = _make_template(str(tmp_path))
+    target = os.path.join(str(tmp_path), "out")
+    _, error = Generator().generate(template, target, {"use_docker": "true"})
+    assert not error
+    with open(os.path.join(target, "docker", "Dockerfile")) as f:
+        assert f.read() == "FROM demo\n"
+
+
+def test_disabled_subtrees_are_not_scanned(tmp_path, monkeypatch):
+    template = _make_template(str(tmp_path))
+    scanned = []
+    original_scandir = os.scandir
+
+    def scandir(path):
+        scanned.append(os.path.basename(path))
+        return original_scandir(path)
+
+    monkeypatch.setattr(os, "scandir", scandir)
+    generator = Generator()
+    variables, _ = generator.get_variables(template)
+    entries, error = generator.plan(template, variables)
+    assert not error
+    assert sorted(scanned) == ["ci", "service"]
+    assert sorted(dst for _, dst, _ in entries) == ["ci", "ci/pipeline.yml", "demo.txt"]
+
+
+def test_diff_reports_only_changed_files(tmp_path):
+    template = _make_template(str(tmp_path))
+    target = os.path.join(str(tmp_path), "out")
+    generator = Generator()
+    generator.generate(template, target)
+    _write(os.path.join(target, "demo.txt"), "Project other\n")
+    os.remove(os.path.join(target, "ci", "pipeline.yml"))
+    out = io.StringIO()
+    result, error = generator.diff(template, target, out=out, show_diff=True)
+    assert not error
+    assert result == {"added": ["ci/pipeline.yml"], "modified": ["demo.txt"], "unchanged": 0}
+    assert "-Project other\n+Project demo\n" in out.getvalue()
+    assert "--- /dev/null\n+++ b/ci/pipeline.yml\n" in out.getvalue()
+
+
+def test_diff_renders_only_files_changed_since_generation(tmp_path, monkeypatch):
+    template = _make_template(str(tmp_path))
+    target = os.path.join(str(tmp_path), "out")
+    generator = Generator()
+    assert generator.generate(template, target) == (None, "")
+    compiled = []
+    real_compile_file = Generator.compile_file
+
+    def compile_file(src_path):
+        compiled.append(os.path.relpath(src_path, template))
+        return real_compile_file(src_path)
+
+    monkeypatch.setattr(Generator, "compile_file", staticmethod(compile_file))
+    result, error = generator.diff(template, target)
+    assert not error
+    assert result == {"added": [], "modified": [], "unchanged": 2}
+    assert compiled == []
+    # Output edited (same size) or rewritten with the same contents: still no render
+    with open(os.path.join(target, "demo.txt"), "r+") as f:
+        f.write("X")
+    with open(os.path.join(target, "ci", "pipeline.yml"), "r+") as f:
+        f.write("n")
+    result, error = generator.diff(template, target)
+    assert not error
+    assert result == {"added": [], "modified": ["demo.txt"], "unchanged": 1}
+    assert compiled == []
+    # Changed template files and variables are rendered
+    _write(os.path.join(template, "ci", "pipeline.yml"), "name: {{ name }}\n")
+    result, error = generator.diff(template, target)
+    assert not error
+    assert result == {"added": [], "modified": ["demo.txt"], "unchanged": 1}
+    assert compiled == [os.path.join("ci", "pipeline.yml")]
+    del compiled[:]
+    result, error = generator.diff(template, target, {"extra": "1"})
+    assert not error
+    assert sorted(compiled) == [os.path.join("ci", "pipeline.yml"), "{{name}}.txt"]
+
+
+def test_inherited_template_takes_each_file_from_topmost_layer(tmp_path):
+    root = str(tmp_path)
+    _write(os.path.join(root, "base", "base.desc"), "name=base\nlicense=MIT\n")
+    _write(os.path.join(root, "base", "LICENSE"), "{{license}}\n")
+    _write(os.path.join(root, "base", "src", "main.txt"), "base main\n")
+    _write(os.path.join(root, "base", "src", "util.txt"), "base util\n")
+    _write(os.path.join(root, "service", "service.desc"), "extends=base\nname=service\n")
+    _write(os.path.join(root, "service", "src", "main.txt"), "{{name}} main\n")
+    template = os.path.join(root, "service")
+    generator = Generator()
+    entries, error = generator.plan(template, {})
+    assert not error
+    assert [(os.path.relpath(src_path, root), dst_rel_path) for src_path, dst_rel_path, _ in entries] == [
+        ("base/LICENSE", "LICENSE"),
+        ("service/src", "src"),
+        ("service/src/main.txt", os.path.join("src", "main.txt")),
+        ("base/src/util.txt", os.path.join("src", "util.txt")),
+    ]
+    target = os.path.join(root, "out")
+    _, error = generator.generate(template, target)
+    assert not error
+    assert sorted(os.listdir(target)) == [Generator.MANIFEST_FILE_NAME, "LICENSE", "src"]
+    with open(os.path.join(target, "src", "main.txt")) as f:
+        assert f.read() == "service main\n"
+    with open(os.path.join(target, "LICENSE")) as f:
+        assert f.read() == "MIT\n"
+
+
+def test_circular_inheritance_is_an_error(tmp_path):
+    root = str(tmp_path)
+    _write(os.path.join(root, "a", "a.desc"), "extends=b\n")
+    _write(os.path.join(root, "b", "b.desc"), "extends=a\n")
+    _, error = Generator().generate(os.path.join(root, "a"), os.path.join(root, "out"))
+    assert "circular" in error
+
+
+def test_regenerate_writes_only_outputs_of_changed_files(tmp_path):
+    template = _make_template(str(tmp_path))
+    target = os.path.join(str(tmp_path), "out")
+    generator = Generator(keep_compiled=True)
+    generator.generate(template, target)
+    changed = os.path.join(template, "ci", "pipeline.yml")
+    _write(changed, "name: {{name}}-ci\n")
+    written, error = generator.regenerate(template, target, [changed])
+    assert not error
+    assert written == ["ci/pipeline.yml"]
+    with open(os.path.join(target, "ci", "pipeline.yml")) as f:
+        assert f.read() == "name: demo-ci\n"
+    _write(os.path.join(template, "service.desc"), "name=other\nuse_ci=yes\n")
+    written, error = generator.regenerate(template, target, [os.path.join(template, "service.desc")])
+    assert not error
+    assert sorted(written) == ["ci/pipeline.yml", "other.txt"]
+
+
+def test_regenerate_after_variable_change_keeps_compiled_files(tmp_path):
+    root = str(tmp_path)
+    template = os.path.join(root, "lib")
+    _write(os.path.join(template, "lib.desc"), "name=demo\nversion=1\n")
+    _write(os.path.join(template, "{{name}}.txt"), "{{name}}\n")
+    _write(os.path.join(template, "VERSION"), "{{version|upper}}\n")
+    _write(os.path.join(template, "static.txt"), "static\n")
+    target = os.path.join(root, "out")
+    generator = Generator(keep_compiled=True)
+    assert generator.generate(template, target) == (None, "")
+    assert generator.remember(template, target) == (None, "")
+    compiled = dict(generator._compiled_cache)
+    assert len(compiled) == 3
+    _write(os.path.join(template, "lib.desc"), "name=demo\nversion=2a\n")
+    written, error = generator.regenerate(template, target, [os.path.join(template, "lib.desc")])
+    assert not error
+    assert written == ["VERSION"]
+    with open(os.path.join(target, "VERSION")) as f:
+        assert f.read() == "2A\n"
+    assert all(generator._compiled_cache[path] is compiled[path] for path in compiled)
+    # Renamed output is written under its new name
+    _write(os.path.join(template, "lib.desc"), "name=other\nversion=2a\n")
+    written, error = generator.regenerate(template, target, [os.path.join(template, "lib.desc")])
+    assert not error
+    assert written == ["other.txt"]
+    assert all(generator._compiled_cache[path] is compiled[path] for path in compiled)
+
+
+def test_generate_creates_deep_trees_and_reuses_existing_dirs(tmp_path):
+    root = str(tmp_path)
+    template = os.path.join(root, "java")
+    _write(os.path.join(template, "java.desc"), "package=com\n")
+    _write(os.path.join(template, "src", "{{package}}", "acme", "app", "Main.java"), "package {{package}};\n")
+    _write(os.path.join(template, "src", "{{package}}", "acme", "Util.java"), "\n")
+    target = os.path.join(root, "out", "project")
+    generator = Generator()
+    for _ in range(2):
+        _, error = generator.generate(template, target)
+        assert not error
+    with open(os.path.join(target, "src", "com", "acme", "app", "Main.java")) as f:
+        assert f.read() == "package com;\n"
+    assert os.path.isfile(os.path.join(target, "src", "com", "acme", "Util.java"))
+
+
+def _generation_peak_memory(root: str, file_count: int, files_per_dir: int) -> int:
+    template = os.path.join(root, "data")
+    for i in range(file_count):
+        if i % files_per_dir == 0:
+            current_dir = os.path.join(template, "d{{n}}_%d" % (i // files_per_dir))
+            os.makedirs(current_dir)
+        with open(os.path.join(current_dir, "f%d.txt" % i), "w") as f:
+            f.write("{{n}}")
+    generator = Generator(max_rss=512 * 1024 * 1024)
+    tracemalloc.start()
+    try:
+        _, error = generator.generate(template, os.path.join(root, "out"), {"n": "1"})
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    assert not error
+    assert os.path.isfile(os.path.join(root, "out", "d1_0", "f0.txt"))
+    return peak
+
+
+def test_generation_memory_does_not_grow_with_file_count(tmp_path, monkeypatch):
+    # Set TEMPLGEN_STRESS_FILES=1000000 to run against a million-file template
+    file_count = int(os.environ.get("TEMPLGEN_STRESS_FILES", "8000"))
+    files_per_dir = 250
+    monkeypatch.setattr(Generator, "LISTING_CACHE_MAX_ENTRIES", files_per_dir)
+    small = os.path.join(str(tmp_path), "small")
+    large = os.path.join(str(tmp_path), "large")
+    os.makedirs(small)
+    os.makedirs(large)
+    small_peak = _generation_peak_memory(small, files_per_dir * 4, files_per_dir)
+    large_peak = _generation_peak_memory(large, file_count, files_per_dir)
+    # A materialized plan costs about 240 bytes per file, 1.6 MB for the extra 7000 files
+    assert large_peak - small_peak < 256 * 1024
+
+
+def test_compiled_template_keeps_placeholder_offsets_in_array():
+    compiled = CompiledTemplate("class {{ name }} : {{base}} {{missing}};")
+    assert not hasattr(compiled, "__dict__")
+    assert compiled.names == ("name", "base", "missing")
+    assert list(compiled.offsets) == [6, 16, 19, 27, 28, 39]
+    assert compiled.render({"name": "A", "base": "B"}) == "class A : B {{missing}};"
+
+
+def test_compressed_template_generates_same_output(tmp_path):
+    template = _make_template(str(tmp_path))
+    _write(os.path.join(template, "ci", "big.txt"), "{{name}}\n" * 1000)
+    expected = os.path.join(str(tmp_path), "expected")
+    Generator().generate(template, expected)
+    for method in ("lzma", "zlib"):
+        result, error = Generator.compress_template(template, method)
+        assert not error
+        assert result["size_after"] < result["size_before"]
+        assert os.path.isfile(os.path.join(template, "ci", "big.txt" + Generator.COMPRESSION_SUFFIXES[method]))
+        assert os.path.isfile(os.path.join(template, "service.desc"))
+        out = os.path.join(str(tmp_path), method)
+        _, error = Generator().generate(template, out)
+        assert not error
+        result, error = Generator().diff(template, expected)
+        assert result["modified"] == [] and result["added"] == []
+    _, error = Generator.compress_template(template, None)
+    assert not error
+    assert os.path.isfile(os.path.join(template, "ci", "big.txt"))
+
+
+def test_filters_are_compiled_into_keys_and_applied_once_per_run(tmp_path, monkeypatch):
+    template = os.path.join(str(tmp_path), "lib")
+    _write(os.path.join(template, "lib.desc"), "name=My HTTPServer\npackage={{ name | snake }}\n")
+    for i in range(10):
+        _write(os.path.join(template, "{{name|kebab}}", f"f{i}.txt"),
+               "{{ name | snake }} {{name|camelCase}} {{ name | pascal | upper }} {{name|bogus}} "
+               "(c) {{ today | year }} {{package}}\n")
+    calls = []
+    real_snake = Filters.snake
+    monkeypatch.setitem(FILTERS, "snake", lambda value: calls.append(value) or real_snake(value))
+    target = os.path.join(str(tmp_path), "out")
+    _, error = Generator().generate(template, target)
+    assert not error
+    with open(os.path.join(target, "my-http-server", "f3.txt")) as f:
+        assert f.read() == (f"my_http_server myHttpServer MYHTTPSERVER {{{{name|bogus}}}} "
+                            f"(c) {date.today().year} my_http_server\n")
+    # Once while resolving 'package', reused for all rendered files
+    assert calls == ["My HTTPServer"]
+    assert CompiledTemplate("{{ a | snake |upper}}{{a}}").names == ("a|snake|upper", "a")
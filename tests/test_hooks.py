@@ -0,0 +1,62 @@
+import os
+import time
+
+from templgen.generator import Generator
+from templgen.hooks import HookRunner
+
+
+def _write(path, contents=""):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        f.write(contents)
+
+
+def test_template_hooks_run_after_dependencies(tmp_path):
+    template = os.path.join(str(tmp_path), "app")
+    _write(os.path.join(template, "app.desc"), "name=my app\nuse_lint=no\n")
+    _write(os.path.join(template, "app.hooks"),
+           "[init]\nrun = echo {{name}} > init.txt\n\n"
+           "[format]\nrun = cat init.txt > format.txt\nafter = init\n\n"
+           "[lint]\nrun = exit 1\nif = use_lint\n\n"
+           "[report]\nrun = echo done\nafter = format, lint\n")
+    _write(os.path.join(template, "README"), "{{name}}\n")
+    target = os.path.join(str(tmp_path), "out")
+    _, error = Generator().generate(template, target)
+    assert not error
+    assert sorted(os.listdir(target)) == [Generator.MANIFEST_FILE_NAME, "README"]
+    results, error = HookRunner().run_template_hooks(template, target)
+    assert not error
+    assert list(results) == ["init", "format", "report"]
+    assert results["report"]["output"] == "done\n"
+    with open(os.path.join(target, "format.txt")) as f:
+        assert f.read() == "my app\n"
+
+
+def test_independent_hooks_run_concurrently(tmp_path):
+    hooks = {f"sleep{i}": {"run": "sleep 0.3", "after": []} for i in range(4)}
+    start = time.monotonic()
+    results, error = HookRunner(max_jobs=4).run(hooks, str(tmp_path))
+    assert not error
+    assert len(results) == 4
+    assert time.monotonic() - start < 1.0
+
+
+def test_failed_hook_skips_dependents(tmp_path):
+    hooks = {"a": {"run": "echo oops >&2; exit 3", "after": []},
+             "b": {"run": "true", "after": ["a"]},
+             "c": {"run": "true", "after": ["b"]},
+             "d": {"run": "true", "after": []}}
+    results, error = HookRunner().run(hooks, str(tmp_path))
+    assert error == "hooks failed: a"
+    assert results["a"] == {**results["a"], "returncode": 3, "output": "oops\n"}
+    assert results["b"]["returncode"] is None
+    assert results["c"]["returncode"] is None
+    assert results["d"]["returncode"] == 0
+
+
+def test_circular_and_unknown_dependencies_are_errors(tmp_path):
+    hooks = {"a": {"run": "true", "after": ["b"]}, "b": {"run": "true", "after": ["a"]}}
+    _, error = HookRunner().run(hooks, str(tmp_path))
+    assert error == "circular hook dependency: a -> b -> a"
+    _, error = HookRunner().run({"a": {"run": "true", "after": ["x"]}}, str(tmp_path))
+    assert error == "hook 'a' depends on unknown hook 'x'"
@@ -0,0 +1,113 @@
+import os
+import time
+
+from templgen.integrity import IntegrityChecker
+from templgen.templgen import Templgen
+
+
+def test_ensure_integrity_validates_once_until_something_changes(tmp_path, monkeypatch):
+    monkeypatch.setenv("HOME", str(tmp_path))
+    tg = Templgen()
+    tg.ensure_integrity()
+    tg.ensure_integrity()
+    assert IntegrityChecker.is_stamp_fresh()
+
+    validated = []
+    monkeypatch.setattr(tg.integrity, "validate", lambda *args, **kwargs: validated.append(args) or ([], ""))
+    tg.ensure_integrity()
+    assert validated == []
+    # Let file system clock tick
+    time.sleep(0.05)
+    _, error = tg.user_manager.add_user("jane", interactive=False)
+    assert not error
+    assert not IntegrityChecker.is_stamp_fresh()
+    tg.ensure_integrity()
+    assert len(validated) == 1
+
+
+def test_doctor_reports_and_repairs_problems(tmp_path, monkeypatch):
+    monkeypatch.setenv("HOME", str(tmp_path))
+    tg = Templgen()
+    tg.ensure_integrity()
+    _, error = tg.user_manager.add_user("jane", interactive=False)
+    assert not error
+    user_dir = os.path.join(str(tmp_path), ".templgen", "users", "jane")
+    with open(os.path.join(user_dir, "user.cfg"), "w") as f:
+        f.write("[GENERAL]\nfull_name = Jane\n")
+    os.rmdir(os.path.join(user_dir, "templ_config"))
+    template_dir = os.path.join(str(tmp_path), ".templgen", "templates", "broken")
+    os.makedirs(template_dir)
+    with open(os.path.join(template_dir, "broken.desc"), "w") as f:
+        f.write("extends=missing\n")
+
+    problems, error = tg.integrity.validate()
+    assert not error
+    assert [repaired for _, repaired in problems] == [False, False, False]
+    assert not IntegrityChecker.is_stamp_fresh()
+
+    problems, error = tg.integrity.validate(repair=True)
+    assert not error
+    assert [repaired for _, repaired in problems] == [True, True, False]
+    assert os.path.isdir(os.path.join(user_dir, "templ_config"))
+    with open(os.path.join(user_dir, "user.cfg")) as f:
+        assert "email" in f.read()
+
+    os.remove(os.path.join(template_dir, "broken.desc"))
+    assert tg.integrity.validate() == ([], "")
+    assert IntegrityChecker.is_stamp_fresh()
+
+
+def test_stamp_covers_user_configs_and_templates(tmp_path, monkeypatch):
+    monkeypatch.setenv("HOME", str(tmp_path))
+    tg = Templgen()
+    tg.ensure_integrity()
+    _, error = tg.user_manager.add_user("jane", interactive=False)
+    assert not error
+    templates_dir = os.path.join(str(tmp_path), ".templgen", "templates")
+    os.makedirs(os.path.join(templates_dir, "app"))
+    with open(os.path.join(templates_dir, "app", "app.desc"), "w") as f:
+        f.write("name=app\n")
+    user_dir = os.path.join(str(tmp_path), ".templgen", "users", "jane")
+
+    def changed(change):
+        assert tg.integrity.validate() == ([], "")
+        assert IntegrityChecker.is_stamp_fresh()
+        # Let file system clock tick
+        time.sleep(0.05)
+        change()
+        return not IntegrityChecker.is_stamp_fresh()
+
+    def corrupt_user_config():
+        with open(os.path.join(user_dir, "user.cfg"), "w") as f:
+            f.write("not a config\n")
+
+    def break_template():
+        with open(os.path.join(templates_dir, "app", "app.desc"), "w") as f:
+            f.write("extends=nope\n")
+
+    def fix_template():
+        with open(os.path.join(templates_dir, "app", "app.desc"), "w") as f:
+            f.write("name=app\n")
+
+    assert changed(corrupt_user_config)
+    _, error = tg.user_manager.del_user("jane", confirmed=True)
+    assert not error
+    assert changed(break_template)
+    fix_template()
+    assert changed(lambda: os.makedirs(os.path.join(templates_dir, "other")))
+    _, error = tg.user_manager.add_user("john", interactive=False)
+    assert not error
+    assert changed(lambda: os.rmdir(os.path.join(str(tmp_path), ".templgen", "users", "john", "templ_config")))
+
+
+def test_template_bases_are_resolved_in_instance_home_dir(tmp_path, monkeypatch):
+    monkeypatch.setenv("HOME", os.path.join(str(tmp_path), "process_home"))
+    home_dir = os.path.join(str(tmp_path), "home")
+    tg = Templgen(home_dir=home_dir)
+    tg.ensure_integrity()
+    templates_dir = os.path.join(home_dir, ".templgen", "templates")
+    os.makedirs(os.path.join(templates_dir, "group", "base"))
+    os.makedirs(os.path.join(templates_dir, "app"))
+    with open(os.path.join(templates_dir, "app", "app.desc"), "w") as f:
+        f.write("extends=base\n")
+    assert tg.integrity.validate() == ([], "")
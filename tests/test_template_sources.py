@@ -0,0 +1,92 @@
+import os
+import subprocess
+
+from templgen.templgen import Templgen
+
+
+def _git(repo, *args):
+    subprocess.run(["git", "-C", repo, "-c", "user.name=t", "-c", "user.email=t@t", *args],
+                   check=True, stdout=subprocess.PIPE)
+
+
+def test_git_sources_share_blobs_between_refs(tmp_path, monkeypatch):
+    monkeypatch.setenv("HOME", str(tmp_path))
+    repo = os.path.join(str(tmp_path), "repo")
+    template_dir = os.path.join(repo, "templates", "service")
+    os.makedirs(template_dir)
+    subprocess.run(["git", "init", "-q", repo], check=True)
+    with open(os.path.join(template_dir, "service.desc"), "w") as f:
+        f.write("name=demo\n")
+    with open(os.path.join(template_dir, "README"), "w") as f:
+        f.write("{{name}} v1\n")
+    _git(repo, "add", "-A")
+    _git(repo, "commit", "-q", "-m", "v1")
+    _git(repo, "tag", "v1")
+    with open(os.path.join(template_dir, "README"), "w") as f:
+        f.write("{{name}} v2\n")
+    _git(repo, "commit", "-q", "-am", "v2")
+
+    tg = Templgen()
+    tg.ensure_integrity()
+    sources = tg.template_sources
+    _, error = sources.add_source("svc1", "file://" + repo, ref="v1", path="templates/service")
+    assert not error
+    _, error = sources.add_source("svc2", repo, path="templates/service")
+    assert not error
+    assert sorted(sources.list_sources()[0]) == ["svc1", "svc2"]
+
+    path1, error = tg.generator.resolve_template("svc1")
+    assert not error
+    path2, error = tg.generator.resolve_template("svc2")
+    assert not error
+    assert os.path.basename(path1) == "service" and path1 != path2
+    assert os.path.samefile(os.path.join(path1, "service.desc"), os.path.join(path2, "service.desc"))
+    assert tg.generator.resolve_template("svc1") == (path1, "")
+
+    target = os.path.join(str(tmp_path), "out")
+    _, error = tg.generator.generate(path1, target)
+    assert not error
+    with open(os.path.join(target, "README")) as f:
+        assert f.read() == "demo v1\n"
+
+    _, error = sources.del_source("svc1")
+    assert not error
+    assert list(sources.list_sources()[0]) == ["svc2"]
+
+
+def test_sources_with_same_tree_and_different_names(tmp_path, monkeypatch):
+    monkeypatch.setenv("HOME", str(tmp_path))
+    repo = os.path.join(str(tmp_path), "repo")
+    os.makedirs(repo)
+    subprocess.run(["git", "init", "-q", repo], check=True)
+    with open(os.path.join(repo, "README"), "w") as f:
+        f.write("{{name}}\n")
+    _git(repo, "add", "-A")
+    _git(repo, "commit", "-q", "-m", "v1")
+    _git(repo, "tag", "v1")
+
+    tg = Templgen()
+    tg.ensure_integrity()
+    sources = tg.template_sources
+    # Repository root at two refs with identical contents: one tree, two template names
+    assert sources.add_source("stable", repo, ref="v1") == (None, "")
+    assert sources.add_source("latest", repo) == (None, "")
+    stable, error = sources.materialize("stable")
+    assert not error
+    latest, error = sources.materialize("latest")
+    assert not error
+    assert os.path.dirname(stable) == os.path.dirname(latest)
+    assert os.path.basename(stable) == "stable" and os.path.basename(latest) == "latest"
+    assert os.path.isfile(os.path.join(latest, "README"))
+
+    project = os.path.join(str(tmp_path), "project")
+    os.makedirs(project)
+    with open(os.path.join(str(tmp_path), ".templgen", "fingerprints.json"), "w") as f:
+        f.write("{}")
+    tg.ensure_integrity()
+    assert tg.settings.initlocal(project) == (None, "")
+    local_templgen_dir = os.path.join(project, ".templgen")
+    assert os.path.isfile(os.path.join(local_templgen_dir, "main.cfg"))
+    for name in ("cache", "sources.cfg", "fingerprints.json", ".integrity"):
+        assert os.path.exists(os.path.join(str(tmp_path), ".templgen", name))
+        assert not os.path.exists(os.path.join(local_templgen_dir, name))
@@ -0,0 +1,55 @@
+import os
+
+from templgen.generator import Generator
+from templgen.templatizer import Templatizer
+
+
+def test_templatize_then_generate_round_trip(tmp_path):
+    source = tmp_path / "project"
+    (source / "src" / "acme").mkdir(parents=True)
+    (source / "src" / "acme" / "Acme.java").write_text("package acme;\nclass Acme {}\n")
+    (source / ".git").mkdir()
+    (source / ".git" / "HEAD").write_text("ref")
+    template = os.path.join(str(tmp_path), "javaapp")
+    result, error = Templatizer().templatize(str(source), template, {"acme": "package", "Acme": "class_name"})
+    assert not error
+    assert result == {"files": 1, "substitutions": 2}
+    assert sorted(os.listdir(template)) == ["javaapp.desc", "src"]
+    with open(os.path.join(template, "src", "{{package}}", "{{class_name}}.java")) as f:
+        assert f.read() == "package {{package}};\nclass {{class_name}} {}\n"
+
+    target = os.path.join(str(tmp_path), "out")
+    _, error = Generator().generate(template, target, {"package": "demo", "class_name": "Demo"})
+    assert not error
+    with open(os.path.join(target, "src", "demo", "Demo.java")) as f:
+        assert f.read() == "package demo;\nclass Demo {}\n"
+
+
+def test_parallel_templatize_matches_sequential(tmp_path, monkeypatch):
+    monkeypatch.setattr(Templatizer, "SHARD_SIZE", 3)
+    source = tmp_path / "project"
+    for i in range(20):
+        (source / f"pkg{i % 4}").mkdir(parents=True, exist_ok=True)
+        (source / f"pkg{i % 4}" / f"Acme{i}.txt").write_text("Acme " * i)
+    (source / "blob.bin").write_bytes(b"\xff\xfeAcme")
+    replacements = {"Acme": "name"}
+    sequential_counts = []
+    sequential, error = Templatizer().templatize(str(source), str(tmp_path / "seq"), replacements,
+                                                 on_file=lambda *args: sequential_counts.append(args))
+    assert not error
+    parallel_counts = []
+    parallel, error = Templatizer().templatize(str(source), str(tmp_path / "par"), replacements, processes=3,
+                                               on_file=lambda *args: parallel_counts.append(args))
+    assert not error
+    assert parallel == sequential
+    assert parallel["files"] == 21
+    # Shards complete in any order
+    assert sorted(parallel_counts) == sorted(sequential_counts)
+    assert ("pkg3/Acme7.txt", 7) in parallel_counts
+    for dir_path, _, file_names in os.walk(str(tmp_path / "seq")):
+        for file_name in file_names:
+            if file_name.endswith(".desc"):
+                continue
+            path = os.path.join(dir_path, file_name)
+            with open(path, "rb") as f, open(path.replace(str(tmp_path / "seq"), str(tmp_path / "par")), "rb") as g:
+                assert f.read() == g.read()
@@ -1,7 +1,14 @@
 
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
 from click.testing import CliRunner
 
 from templgen.cli import main
+from templgen.generator import Generator
+from templgen.templgen import Templgen
+from templgen.user_manager import UserManager
 
 
 def test_main():
@@ -10,3 +17,113 @@ def test_main():
 
     #  assert result.output == '()\n'
     assert result.exit_code == 0
+
+
+def test_instances_with_explicit_home_dirs_are_independent_and_silent(tmp_path, capsys):
+    homes = [os.path.join(str(tmp_path), name) for name in ("home1", "home2")]
+    instances = [Templgen(home_dir=home) for home in homes]
+    for tg in instances:
+        assert tg.ensure_integrity() == (None, "")
+    _, error = instances[0].user_manager.add_user("alice", interactive=False)
+    assert not error
+    assert UserManager.list_users(homes[0]) == ["alice"]
+    assert UserManager.list_users(homes[1]) == []
+    _, error = instances[0].user_manager.switch_user("alice")
+    assert not error
+    _, error = instances[1].user_manager.switch_user("alice")
+    assert error == "user not found"
+    assert capsys.readouterr().out == ""
+
+    # Errors are returned instead of exiting the process
+    blocker = os.path.join(str(tmp_path), "file")
+    with open(blocker, "w"):
+        pass
+    _, error = Templgen(home_dir=blocker).ensure_integrity()
+    assert error
+
+
+def test_threads_share_instance_with_different_projects(tmp_path):
+    tg = Templgen(home_dir=str(tmp_path))
+    tg.ensure_integrity()
+    projects = []
+    for i in range(4):
+        project = os.path.join(str(tmp_path), f"project{i}")
+        os.makedirs(project)
+        tg.settings.initlocal(project)
+        tg.settings.read_settings_for_path(project)
+        tg.settings.set("text_editor", f"editor{i}")
+        projects.append(project)
+    # Unsaved modifications do not block reading settings again
+    tg.settings.set("text_editor", "unsaved", save=False)
+    assert tg.settings.read_settings_for_path(str(tmp_path)) == (None, "")
+
+    def check(i):
+        for _ in range(50):
+            tg.settings.read_settings_for_path(projects[i])
+            if tg.settings.get("text_editor") != (f"editor{i}", ""):
+                return False
+        return True
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        assert all(executor.map(check, range(4)))
+
+
+def test_shared_generator_sees_template_changes(tmp_path):
+    tg = Templgen(home_dir=str(tmp_path))
+    tg.ensure_integrity()
+    templates_dir = os.path.join(str(tmp_path), ".templgen", "templates")
+    for name in ("base", "other", "app"):
+        os.makedirs(os.path.join(templates_dir, name, "src"))
+    with open(os.path.join(templates_dir, "app", "app.desc"), "w") as f:
+        f.write("extends=base\n")
+    with open(os.path.join(templates_dir, "base", "base.txt"), "w") as f:
+        f.write("base\n")
+    with open(os.path.join(templates_dir, "other", "other.txt"), "w") as f:
+        f.write("other\n")
+    with open(os.path.join(templates_dir, "app", "src", "a.txt"), "w") as f:
+        f.write("a\n")
+    template_path, error = tg.generator.resolve_template("app")
+    assert not error
+    assert tg.generator.generate(template_path, os.path.join(str(tmp_path), "out1")) == (None, "")
+
+    # Let file system clock tick
+    time.sleep(0.05)
+    os.remove(os.path.join(templates_dir, "app", "src", "a.txt"))
+    with open(os.path.join(templates_dir, "app", "src", "b.txt"), "w") as f:
+        f.write("b\n")
+    with open(os.path.join(templates_dir, "app", "app.desc"), "w") as f:
+        f.write("extends=other\n")
+    out2 = os.path.join(str(tmp_path), "out2")
+    assert tg.generator.generate(template_path, out2) == (None, "")
+    assert sorted(os.listdir(out2)) == [Generator.MANIFEST_FILE_NAME, "other.txt", "src"]
+    assert os.listdir(os.path.join(out2, "src")) == ["b.txt"]
+
+
+def test_cli_exits_if_templgen_dir_cant_be_created(tmp_path, monkeypatch):
+    home = os.path.join(str(tmp_path), "home")
+    with open(home, "w") as f:
+        f.write("not a dir")
+    monkeypatch.setenv("HOME", home)
+    result = CliRunner().invoke(main, ["adduser", "jane", "--default"])
+    assert result.exit_code != 0
+    assert "Error: can't create path" in result.output
+    assert "Successfully" not in result.output
+
+
+def test_threads_share_generator_caches(tmp_path):
+    tg = Templgen(home_dir=str(tmp_path))
+    template = os.path.join(str(tmp_path), "app")
+    for i in range(20):
+        os.makedirs(os.path.join(template, f"d{i}"))
+        for j in range(20):
+            with open(os.path.join(template, f"d{i}", f"f{j}.txt"), "w") as f:
+                f.write("{{name}}\n")
+
+    def generate(i):
+        return tg.generator.generate(template, os.path.join(str(tmp_path), f"out{i}"), {"name": "x"})
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        assert all(result == (None, "") for result in executor.map(generate, range(32)))
+    generator = tg.generator
+    assert generator._cached_listing_entries == sum(len(listing) for listing, _ in generator._listing_cache.values())
+    assert len(generator._listing_cache) == 21
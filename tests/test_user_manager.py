@@ -0,0 +1,86 @@
+import os
+
+from templgen.templgen import Templgen
+from templgen.user_manager import UserManager
+
+
+def test_bulk_add_export_and_delete_users(tmp_path, monkeypatch):
+    monkeypatch.setenv("HOME", str(tmp_path))
+    tg = Templgen()
+    tg.ensure_integrity()
+    users_file = os.path.join(str(tmp_path), "users.csv")
+    with open(users_file, "w") as f:
+        f.write("user_name,full_name,email\nci1,CI One,ci1@example.com\nci2,CI Two,\n")
+    users, error = UserManager.read_users_file(users_file)
+    assert not error
+    _, error = tg.user_manager.add_users(users)
+    assert not error
+    assert sorted(UserManager.list_users(None)) == ["ci1", "ci2"]
+
+    exported, error = tg.user_manager.export_users()
+    assert not error
+    assert exported == [
+        {"user_name": "ci1", "full_name": "CI One", "email": "ci1@example.com", "site": ""},
+        {"user_name": "ci2", "full_name": "CI Two", "email": "", "site": ""},
+    ]
+    jsonl_file = os.path.join(str(tmp_path), "users.jsonl")
+    _, error = UserManager.write_users_file(jsonl_file, exported)
+    assert not error
+    assert UserManager.read_users_file(jsonl_file) == (exported, "")
+
+    _, error = tg.user_manager.del_users(["ci1", "ci2"], confirmed=True)
+    assert not error
+    assert UserManager.list_users(None) == []
+
+
+def test_bulk_add_is_all_or_nothing(tmp_path, monkeypatch):
+    monkeypatch.setenv("HOME", str(tmp_path))
+    tg = Templgen()
+    tg.ensure_integrity()
+    _, error = tg.user_manager.add_user("taken", interactive=False)
+    assert not error
+    _, error = tg.user_manager.add_users([{"user_name": "new"}, {"user_name": "taken"}])
+    assert error == "user 'taken' already exists"
+    assert UserManager.list_users(None) == ["taken"]
+    users_dir = os.path.join(str(tmp_path), ".templgen", "users")
+    assert os.listdir(users_dir) == ["taken"]
+
+
+def test_bulk_add_treats_missing_values_as_defaults(tmp_path, monkeypatch):
+    monkeypatch.setenv("HOME", str(tmp_path))
+    tg = Templgen()
+    tg.ensure_integrity()
+    users_file = os.path.join(str(tmp_path), "users.csv")
+    with open(users_file, "w") as f:
+        # Short row: DictReader fills missing fields with None
+        f.write("user_name,full_name,email,site\nshort,Short Row\n")
+    users, error = UserManager.read_users_file(users_file)
+    assert not error
+    users.append({"user_name": "nulls", "full_name": None, "email": None})
+    _, error = tg.user_manager.add_users(users)
+    assert not error
+    for user_name in ("short", "nulls"):
+        with open(os.path.join(str(tmp_path), ".templgen", "users", user_name, "user.cfg")) as f:
+            assert "None" not in f.read()
+    exported, error = tg.user_manager.export_users()
+    assert not error
+    assert exported == [
+        {"user_name": "nulls", "full_name": "", "email": "", "site": ""},
+        {"user_name": "short", "full_name": "Short Row", "email": "", "site": ""},
+    ]
+
+
+def test_single_user_changes_take_the_users_lock(tmp_path, monkeypatch):
+    monkeypatch.setenv("HOME", str(tmp_path))
+    tg = Templgen()
+    tg.ensure_integrity()
+    _, error = tg.user_manager.add_user("john", interactive=False)
+    assert not error
+    users_dir = os.path.join(str(tmp_path), ".templgen", "users")
+    # A bulk change in progress in another process
+    open(os.path.join(users_dir, UserManager.USERS_LOCK_FILE_NAME), "w").close()
+    _, error = tg.user_manager.add_user("jane", interactive=False)
+    assert error.startswith("users are being modified by another process")
+    _, error = tg.user_manager.del_user("john", confirmed=True)
+    assert error.startswith("users are being modified by another process")
+    assert UserManager.list_users(None) == ["john"]
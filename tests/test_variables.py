@@ -0,0 +1,39 @@
+import os
+
+from templgen.templgen import Templgen
+from templgen.variables import VariableResolver
+
+
+def test_resolve_expands_derived_values_once():
+    variables, error = VariableResolver.resolve({
+        "author": "{{full_name}} <{{email}}>",
+        "header": "Author: {{author}}, {{unknown}}",
+        "full_name": "Jane Doe",
+        "email": "jane@example.com",
+    })
+    assert not error
+    assert variables["author"] == "Jane Doe <jane@example.com>"
+    assert variables["header"] == "Author: Jane Doe <jane@example.com>, {{unknown}}"
+
+
+def test_resolve_detects_cycles():
+    _, error = VariableResolver.resolve({"a": "{{b}}", "b": "{{c}}", "c": "{{a}}", "d": "x"})
+    assert error == "circular variable reference: a -> b -> c -> a"
+
+
+def test_context_variables_come_from_settings_and_current_user(tmp_path, monkeypatch):
+    monkeypatch.setenv("HOME", str(tmp_path))
+    tg = Templgen()
+    tg.ensure_integrity()
+    _, error = tg.user_manager.add_user("jane", interactive=False)
+    assert not error
+    _, error = tg.user_manager.switch_user("jane")
+    assert not error
+    user_config = os.path.join(str(tmp_path), ".templgen", "users", "jane", "user.cfg")
+    with open(user_config, "w") as f:
+        f.write("[GENERAL]\nfull_name = Jane Doe\n")
+    variables, error = tg.variable_resolver.get_context_variables()
+    assert not error
+    assert variables["current_user"] == "jane"
+    assert variables["full_name"] == "Jane Doe"
+    assert "current_user*" not in variables
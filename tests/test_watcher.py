@@ -0,0 +1,26 @@
+import os
+
+import pytest
+
+from templgen.watcher import Watcher
+
+
+@pytest.mark.parametrize("use_inotify", [True, False])
+def test_watcher_reports_changed_files(tmp_path, monkeypatch, use_inotify):
+    monkeypatch.setattr(Watcher, "POLL_INTERVAL", 0.01)
+    watched_dir = tmp_path / "template"
+    (watched_dir / "sub").mkdir(parents=True)
+    (watched_dir / "sub" / "a.txt").write_text("a")
+    config = tmp_path / "main.cfg"
+    config.write_text("")
+    (tmp_path / "other.txt").write_text("")
+    watcher = Watcher([str(watched_dir), str(config)], use_inotify=use_inotify)
+    try:
+        assert watcher.wait(timeout=0.05) == set()
+        os.utime(str(watched_dir / "sub" / "a.txt"), ns=(0, 0))
+        (tmp_path / "other.txt").write_text("ignored")
+        assert watcher.wait(timeout=2) == {str(watched_dir / "sub" / "a.txt")}
+        config.write_text("[GENERAL]\n")
+        assert watcher.wait(timeout=2) == {str(config)}
+    finally:
+        watcher.close()